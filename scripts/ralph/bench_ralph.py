@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the Ralph Loop Runner v2 hot paths.
+
+Each benchmark runs in-process against ralph_v2.py and prints a small table,
+so changes to the runner's streaming code can be measured without calling
+the real Claude CLI.
+
+Usage:
+    python bench_ralph.py matcher
+    python bench_ralph.py matcher --chunk-size 400 --stream-lengths 1000 10000
+    python bench_ralph.py decode
+    python bench_ralph.py decode --transcript .ralph/events/<run>/iter-0001.jsonl.gz
+    python bench_ralph.py reader --big-mb 4 16 64
+    python bench_ralph.py runner
+    python bench_ralph.py runner --iterations 1 100 --transcript .ralph/recordings/<run>
+    python bench_ralph.py prompt
+    python bench_ralph.py prompt --prd .claude/plans/inzone-prd.md --prompt-file PROMPT.md --scope "Phase 1"
+    python bench_ralph.py activity --events 100000
+    python bench_ralph.py analyze --runs 200 --iterations 50
+    python bench_ralph.py pipeline --startup 1.5 --shutdown 0.5 --work 0.2
+    python bench_ralph.py sinks --terminal-ms 1
+"""
+
+import argparse
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import ralph_v2  # noqa: E402
+from fake_claude import synthetic_transcript  # noqa: E402
+from ralph_v2 import Colors, colorize  # noqa: E402
+
+FAKE_CLAUDE = Path(__file__).resolve().parent / "fake_claude.py"
+
+
+def print_table(title: str, headers: List[str], rows: List[List[str]]) -> None:
+    """Print a simple left-aligned table."""
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    print()
+    print(colorize(title, Colors.BOLD, Colors.CYAN))
+    print("  " + "  ".join(f"{h:<{w}}" for h, w in zip(headers, widths)))
+    print("  " + "  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  " + "  ".join(f"{str(c):<{w}}" for c, w in zip(row, widths)))
+
+
+def make_chunks(count: int, size: int) -> List[str]:
+    """Assistant-like text chunks that never contain a completion marker."""
+    base = "Implemented the board column endpoint and updated the tests. "
+    text = (base * (size // len(base) + 1))[:size]
+    return [f"{text}{i}\n" for i in range(count)]
+
+
+def naive_detect(chunks: List[str], probe: int) -> float:
+    """The pre-matcher approach: re-scan the whole accumulated buffer per chunk.
+
+    Returns the average seconds per chunk over the last `probe` chunks.
+    """
+    accumulated = ""
+    start = 0.0
+    for i, chunk in enumerate(chunks):
+        if i == len(chunks) - probe:
+            start = time.perf_counter()
+        accumulated = accumulated + chunk
+        if "RALPH_COMPLETE" in accumulated or "<promise>COMPLETE</promise>" in accumulated:
+            break
+    return (time.perf_counter() - start) / probe
+
+
+def incremental_detect(chunks: List[str], probe: int) -> float:
+    """CompletionMatcher plus a chunk list, as used by process_stream_json.
+
+    Returns the average seconds per chunk over the last `probe` chunks.
+    """
+    matcher = ralph_v2.CompletionMatcher(patterns=[r"ALL\s+TASKS\s+DONE"])
+    text_chunks = []
+    start = 0.0
+    for i, chunk in enumerate(chunks):
+        if i == len(chunks) - probe:
+            start = time.perf_counter()
+        text_chunks.append(chunk)
+        if matcher.feed(chunk):
+            break
+    return (time.perf_counter() - start) / probe
+
+
+def load_transcripts(paths: List[str]) -> List[str]:
+    """Read recorded stream-json lines from .jsonl or .jsonl.gz files."""
+    lines = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            lines.extend(line for line in f if line.strip())
+    return lines
+
+
+def bench_matcher(args: argparse.Namespace) -> None:
+    """Per-chunk completion detection cost as the stream grows."""
+    detectors: List[tuple] = [("naive re-scan", naive_detect), ("CompletionMatcher", incremental_detect)]
+    rows = []
+    for length in args.stream_lengths:
+        chunks = make_chunks(length, args.chunk_size)
+        probe = min(200, length)
+        row = [f"{length:,}", f"{length * args.chunk_size / 1024:,.0f} KB"]
+        for _, detect in detectors:
+            row.append(f"{detect(chunks, probe) * 1e6:.2f} µs")
+        rows.append(row)
+
+    print_table(
+        f"Completion detection, cost per chunk at end of stream ({args.chunk_size}-char chunks)",
+        ["chunks", "text so far", *[name for name, _ in detectors]],
+        rows,
+    )
+
+
+def stdlib_decode(line: str, debug: bool) -> None:
+    """The pre-typed-events path: full json.loads, json.dumps again for debug previews."""
+    data = json.loads(line)
+    if debug:
+        json.dumps(data)[:200]
+
+
+def typed_decode(line: str, debug: bool) -> None:
+    """decode_event with type pre-filtering; debug previews come from the raw line."""
+    event = ralph_v2.decode_event(line)
+    if debug and event is not None:
+        line.strip()[:200]
+
+
+def bench_decode(args: argparse.Namespace) -> None:
+    """Events/sec for stream-json decoding."""
+    if args.transcript:
+        lines = load_transcripts(args.transcript)
+        source = f"{len(args.transcript)} recorded transcript(s)"
+    else:
+        lines = synthetic_transcript(args.events, args.payload_bytes)
+        source = f"synthetic, {args.payload_bytes:,}-byte tool results"
+
+    rows = []
+    for debug in (False, True):
+        for name, decode in (("json.loads", stdlib_decode), (f"decode_event ({ralph_v2.JSON_BACKEND})", typed_decode)):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for line in lines:
+                    decode(line, debug)
+                best = min(best, time.perf_counter() - start)
+            rows.append([name, "on" if debug else "off", f"{len(lines) / best:,.0f}", f"{best / len(lines) * 1e6:.2f} µs"])
+
+    print_table(
+        f"Stream-json decoding, {len(lines):,} events ({source}), best of {args.repeat}",
+        ["decoder", "--verbose", "events/sec", "per event"],
+        rows,
+    )
+
+
+def text_pipe_read(data: bytes, chunk_size: int) -> int:
+    """The pre-reader path: whole lines decoded to str and parsed to dicts."""
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", errors="replace")
+    count = 0
+    for line in stream:
+        if line.strip():
+            ralph_v2.decode_event(line)
+            count += 1
+    return count
+
+
+def binary_pipe_read(data: bytes, chunk_size: int, max_line_bytes: int = ralph_v2.DEFAULT_MAX_LINE_BYTES) -> int:
+    """StreamLineReader over fixed-size chunks, decoding each bytes line."""
+    reader = ralph_v2.StreamLineReader(max_line_bytes)
+    count = 0
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        for line in reader.feed(bytes(view[start:start + chunk_size])):
+            ralph_v2.decode_event(line)
+            count += 1
+    for line in reader.finish():
+        ralph_v2.decode_event(line)
+        count += 1
+    return count
+
+
+def bench_reader(args: argparse.Namespace) -> None:
+    """Throughput and peak Python memory when one tool result is very large."""
+    rows = []
+    for big_mb in args.big_mb:
+        lines = synthetic_transcript(args.events, args.payload_bytes)
+        big = json.dumps({
+            "type": "user",
+            "message": {"content": [{"type": "tool_result", "tool_use_id": "toolu_big",
+                                     "content": "y" * (big_mb * 1024 * 1024), "is_error": False}]},
+        }) + "\n"
+        lines.insert(len(lines) // 2, big)
+        data = "".join(lines).encode()
+
+        for name, read in (("text readline + json", text_pipe_read), ("StreamLineReader", binary_pipe_read)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            count = read(data, ralph_v2.READ_CHUNK_BYTES)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows.append([f"{big_mb} MB", name, f"{count / elapsed:,.0f}", f"{peak / 1024 / 1024:,.1f} MB"])
+
+    print_table(
+        f"Pipe reading, {args.events:,} events plus one large tool result (peak excludes the input itself)",
+        ["largest event", "reader", "events/sec", "peak memory"],
+        rows,
+    )
+
+
+def run_loop(iterations: int, fake_env: dict) -> dict:
+    """Run `iterations` sequential iterations against fake_claude.py, as main() does, and measure them.
+
+    Runs in a fresh process per configuration so peak RSS is not shared.
+    """
+    os.environ.update(fake_env)
+    latencies: List[float] = []
+    original = ralph_v2.decode_stream_line
+
+    def timed_decode_stream_line(line, state, iteration=0):
+        start = time.perf_counter()
+        item = original(line, state, iteration)
+        latencies.append(time.perf_counter() - start)
+        return item
+
+    # The reader's share of every event; the sinks handle them on their own threads
+    ralph_v2.decode_stream_line = timed_decode_stream_line
+    write_times: List[float] = []
+    global_state: dict = {}
+
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        activity_log = ralph_v2.ActivityLog(Path(tmp) / "activity.md")
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            completed = 0
+            for i in range(1, iterations + 1):
+                success, _ = ralph_v2.run_iteration(
+                    i, iterations, "benchmark", global_state=global_state, activity_log=activity_log,
+                    claude_bin=str(FAKE_CLAUDE),
+                )
+                completed += success
+                write_start = time.perf_counter()
+                activity_log.write(completed, i - completed, False, global_state, upto=i)
+                write_times.append(time.perf_counter() - write_start)
+            activity_log.write(completed, iterations - completed, False, global_state, final=True)
+            elapsed = time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+    latencies.sort()
+    return {
+        "events": len(latencies),
+        "elapsed": elapsed,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        "peak_mb": peak_mb,
+        "write_mean": sum(write_times) / len(write_times),
+        "write_last": write_times[-1],
+    }
+
+
+def bench_runner(args: argparse.Namespace) -> None:
+    """End-to-end loop throughput against fake_claude.py, for several run lengths."""
+    fake_env = {
+        "FAKE_CLAUDE_EVENTS": str(args.events),
+        "FAKE_CLAUDE_PAYLOAD_BYTES": str(args.payload_bytes),
+        "FAKE_CLAUDE_REPLAY": args.transcript or "",
+    }
+    source = f"replaying {args.transcript}" if args.transcript else f"{args.events} synthetic events per iteration"
+
+    rows = []
+    spawn = multiprocessing.get_context("spawn")
+    for iterations in args.iterations:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            result = pool.submit(run_loop, iterations, fake_env).result()
+        rows.append([
+            f"{iterations:,}",
+            f"{result['events']:,}",
+            f"{result['elapsed']:.1f}s",
+            f"{result['events'] / result['elapsed']:,.0f}",
+            f"{result['latency_mean'] * 1e6:.1f} µs",
+            f"{result['latency_p95'] * 1e6:.1f} µs",
+            f"{result['peak_mb']:.1f} MB",
+            f"{result['write_mean'] * 1e3:.2f} ms",
+            f"{result['write_last'] * 1e3:.2f} ms",
+        ])
+
+    print_table(
+        f"Runner loop against fake_claude.py ({source})",
+        ["iterations", "events", "wall", "events/sec", "per event", "p95/event", "peak RSS", "log write", "last write"],
+        rows,
+    )
+
+
+def sequential_iterations(iterations: int, work: float, pipelined: bool) -> dict:
+    """Sequential iterations against fake_claude.py with `work` seconds of runner work after each, as main() does."""
+    gaps = ralph_v2.IterationGaps()
+    activity_log = ralph_v2.ActivityLog(Path(os.devnull))
+    pipeline = ralph_v2.IterationPipeline() if pipelined else None
+    if pipeline:
+        activity_log.listeners.append(pipeline)
+    run = pipeline.run_iteration if pipeline else ralph_v2.run_iteration
+
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            start = time.perf_counter()
+            for i in range(1, iterations + 1):
+                run(i, iterations, "benchmark", activity_log=activity_log, gaps=gaps, claude_bin=str(FAKE_CLAUDE))
+                # Verification, task bookkeeping and prompt assembly
+                time.sleep(work)
+            elapsed = time.perf_counter() - start
+            if pipeline:
+                pipeline.close()
+        finally:
+            sys.stdout = stdout
+    return {"elapsed": elapsed, "spares": pipeline.spares_used if pipeline else 0, **gaps.summary()}
+
+
+def bench_pipeline(args: argparse.Namespace) -> None:
+    """Idle time between sequential iterations with and without --pipeline, for a slow-starting CLI."""
+    os.environ.update({
+        "FAKE_CLAUDE_EVENTS": str(args.events),
+        "FAKE_CLAUDE_STARTUP": str(args.startup),
+        "FAKE_CLAUDE_SHUTDOWN": str(args.shutdown),
+    })
+    rows = []
+    for name, pipelined in (("sequential", False), ("--pipeline", True)):
+        result = sequential_iterations(args.iterations, args.work, pipelined)
+        rows.append([
+            name,
+            f"{result['elapsed']:.1f}s",
+            f"{result['gap_p50']:.3f}s",
+            f"{result['gap_p95']:.3f}s",
+            f"{result['gap_runner']:.3f}s",
+            f"{result['gap_startup']:.3f}s",
+            f"{result['spares']}/{args.iterations - 1}",
+        ])
+    print_table(
+        f"{args.iterations} iterations, CLI startup {args.startup:g}s, shutdown {args.shutdown:g}s, "
+        f"runner work {args.work:g}s between iterations",
+        ["mode", "wall", "gap p50", "gap p95", "runner", "startup", "spares used"],
+        rows,
+    )
+
+
+class SlowTerminal(io.StringIO):
+    """A stdout whose every flush takes `delay` seconds, like a slow SSH session or a paused tmux pane."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def flush(self) -> None:
+        time.sleep(self.delay)
+
+
+def slow_store(delay: float) -> Callable[[object], None]:
+    """A stand-in for an event store on a slow disk: `delay` seconds per event."""
+    def record(item) -> None:
+        time.sleep(delay)
+    return record
+
+
+def inline_consumers(lines: List[str], activity_log: "ralph_v2.ActivityLog", store_delay: float) -> dict:
+    """Every consumer on the reader's thread, as process_stream_json runs them."""
+    state: dict = {}
+    store = slow_store(store_delay)
+    start = time.perf_counter()
+    for line in lines:
+        ralph_v2.process_stream_json(line, state, activity_log=activity_log, iteration=1)
+        store(line)
+    elapsed = time.perf_counter() - start
+    return {"reader": elapsed, "done": elapsed, "terminal": 0, "store": 0, "depth": 0, "lag": 0.0}
+
+
+def fanout_consumers(lines: List[str], activity_log: "ralph_v2.ActivityLog", store_delay: float) -> dict:
+    """The consumers behind EventSinks, as run_iteration_async feeds them."""
+    state: dict = {}
+    sinks = ralph_v2.stream_sinks(activity_log=activity_log, metrics=ralph_v2.LoopMetrics())
+    sinks.sinks.append(ralph_v2.EventSink("events", slow_store(store_delay)))
+    start = time.perf_counter()
+    for line in lines:
+        item = ralph_v2.decode_stream_line(line, state, 1)
+        if item is not None:
+            sinks.publish(item)
+    reader = time.perf_counter() - start
+    sinks.flush()
+    done = time.perf_counter() - start
+    sinks.close()
+    by_name = {sink.name: sink for sink in sinks.sinks}
+    return {
+        "reader": reader,
+        "done": done,
+        "terminal": by_name["terminal"].dropped,
+        "store": by_name["events"].dropped,
+        "depth": max(sink.max_depth for sink in sinks.sinks),
+        "lag": max(sink.max_lag for sink in sinks.sinks),
+    }
+
+
+def bench_sinks(args: argparse.Namespace) -> None:
+    """Reader throughput with a slow terminal and event store, consumers inline vs behind event sinks."""
+    lines = synthetic_transcript(args.events, args.payload_bytes)
+    rows = []
+    for name, consume in (("inline", inline_consumers), ("event sinks", fanout_consumers)):
+        with tempfile.TemporaryDirectory() as tmp:
+            activity_log = ralph_v2.ActivityLog(Path(tmp) / "activity.md")
+            activity_log.add_iteration_start(1, 1)
+            stdout, sys.stdout = sys.stdout, SlowTerminal(args.terminal_ms / 1000)
+            try:
+                result = consume(lines, activity_log, args.store_ms / 1000)
+            finally:
+                sys.stdout = stdout
+        rows.append([
+            name,
+            f"{len(lines) / result['reader']:,.0f}",
+            f"{result['reader']:.2f}s",
+            f"{result['done']:.2f}s",
+            f"{result['terminal']:,}",
+            f"{result['store']:,}",
+            f"{result['depth']:,}",
+            f"{result['lag']:.2f}s",
+        ])
+    print_table(
+        f"{len(lines):,} events, terminal flush {args.terminal_ms:g} ms, event store {args.store_ms:g} ms per event",
+        ["consumers", "reader events/sec", "reader", "all handled", "terminal dropped", "store dropped", "max queue",
+         "max lag"],
+        rows,
+    )
+
+
+def synthetic_prd(sections: int, items: int) -> str:
+    """A PRD with numbered prose sections and a roadmap whose items reference them."""
+    body = "The service follows the shared conventions described here. " * 40
+    parts = ["# Synthetic PRD\n"]
+    for number in range(1, sections + 1):
+        parts.append(f"## {number}. Section {number}\n\n{body}\n")
+    parts.append(f"## {sections + 1}. Feature Roadmap\n\n### Phase 1: MVP\n")
+    for i in range(items):
+        parts.append(f"- [ ] Feature {i} (see Section {i % sections + 1})\n")
+    return "".join(parts)
+
+
+def bench_prompt(args: argparse.Namespace) -> None:
+    """Prompt size with the whole PRD vs the --prd slice, and the cost of building it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.prd:
+            prd_path = Path(args.prd)
+        else:
+            prd_path = Path(tmp) / "prd.md"
+            prd_path.write_text(synthetic_prd(args.sections, args.items))
+        template = Path(args.prompt_file).read_text() if args.prompt_file else "Implement the next task.\n"
+        builder = ralph_v2.PrdPromptBuilder(template, prd_path, scope=args.scope)
+
+        start = time.perf_counter()
+        prompt, task = builder.build(1)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(args.repeat):
+            builder.build(1)
+        cached = (time.perf_counter() - start) / args.repeat
+        # Touching the file without changing it costs a hash, not a parse
+        os.utime(prd_path)
+        start = time.perf_counter()
+        builder.build(1)
+        touched = time.perf_counter() - start
+        whole = len(template.encode()) + prd_path.stat().st_size
+
+    sliced = len(prompt.encode())
+    rows = [
+        ["whole PRD read each iteration", f"{whole:,}", f"~{whole // 4:,}", "", ""],
+        ["--prd slice", f"{sliced:,}", f"~{sliced // 4:,}", f"{whole / max(sliced, 1):.1f}x smaller", task or "(none left)"],
+    ]
+    print_table(
+        f"Prompt size per iteration ({prd_path.name if args.prd else f'{args.sections} sections, {args.items} items'})",
+        ["prompt", "bytes", "tokens (bytes/4)", "", "task"],
+        rows,
+    )
+    print_table(
+        "Building the prompt",
+        ["cold (parse)", "cached", "mtime changed, same content", "parses"],
+        [[f"{cold * 1e3:.2f} ms", f"{cached * 1e6:.1f} µs", f"{touched * 1e3:.2f} ms", str(builder.parses)]],
+    )
+
+
+def activity_events(count: int, error_ratio: float) -> List[tuple]:
+    """Tool calls and errors as they reach the activity log, each with freshly decoded strings like real events."""
+    tools = [("Bash", {"command": "pnpm --filter api test"}), ("Read", {"file_path": "apps/api/src/services/board.ts"}),
+             ("Edit", {"file_path": "apps/web/src/components/Column.tsx"}), ("Grep", {"pattern": "useBoard"})]
+    events = []
+    for i in range(count):
+        if (i % 100) < error_ratio * 100:
+            events.append(json.loads(json.dumps(("error", "", f"Exit code 1: test {i} failed"))))
+        else:
+            name, tool_input = tools[i % len(tools)]
+            events.append(json.loads(json.dumps(("tool", name, tool_input))))
+    return events
+
+
+def legacy_activity_log(events: List[tuple]) -> list:
+    """The pre-slotted representation: a dict per entry with an ISO timestamp string."""
+    tools, errors = [], []
+    for kind, name, payload in events:
+        if kind == "tool":
+            tools.append({
+                "tool_name": name,
+                "summary": ralph_v2.summarize_tool_input(payload),
+                "timestamp": datetime.now().isoformat(),
+            })
+        else:
+            errors.append({"error": payload, "timestamp": datetime.now().isoformat()})
+    return [tools, errors]
+
+
+def slotted_activity_log(events: List[tuple]) -> "ralph_v2.ActivityLog":
+    """ActivityLog itself: LogEntry records with monotonic ns timestamps and interned tool names."""
+    log = ralph_v2.ActivityLog(Path(os.devnull))
+    log.add_iteration_start(1, 1)
+    for kind, name, payload in events:
+        if kind == "tool":
+            log.add_tool_call(1, name, payload)
+        else:
+            log.add_error(1, payload)
+    return log
+
+
+def bench_activity(args: argparse.Namespace) -> None:
+    """Memory retained per activity-log entry, and the cost of adding one."""
+    events = activity_events(args.events, args.error_ratio)
+    rows = []
+    for name, build in (("dicts + ISO strings", legacy_activity_log), ("LogEntry slots + ns", slotted_activity_log)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        kept = build(events)
+        elapsed = time.perf_counter() - start
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        rows.append([name, f"{retained / 1024 / 1024:,.1f} MB", f"{retained / len(events):,.0f} B", f"{elapsed / len(events) * 1e6:.2f} µs"])
+
+    print_table(
+        f"Activity log entries, {len(events):,} events ({args.error_ratio:.0%} errors; memory excludes the events themselves)",
+        ["representation", "retained", "per event", "add (traced)"],
+        rows,
+    )
+
+
+ANALYZE_TOOLS = ("Bash", "Read", "Edit", "Write", "Grep", "Glob", "TodoWrite")
+
+
+def synthetic_activity_logs(root: Path, runs: int, iterations: int, tools: int) -> List[Path]:
+    """activity.md files written by ActivityLog itself, one run per day, with varied stats and outcomes."""
+    paths = []
+    for run in range(runs):
+        path = root / f"run-{run:04d}" / "activity.md"
+        path.parent.mkdir(parents=True)
+        log = ralph_v2.ActivityLog(path)
+        log.start_time = datetime(2025, 1, 1, 9) + timedelta(days=run, minutes=run)
+        failed = 0
+        for i in range(1, iterations + 1):
+            seed = run * iterations + i
+            log.add_iteration_start(i, iterations)
+            for call in range(tools + seed % 5):
+                log.add_tool_call(i, ANALYZE_TOOLS[(seed + call) % len(ANALYZE_TOOLS)], {"command": f"step {call}"})
+            success = seed % 11 != 0
+            if success:
+                log.add_stats(i, 0.05 + seed % 40 / 100, 20000 + seed % 97 * 1000, 40000 + seed % 13 * 1000, 3000, 12)
+                if seed % 3 == 0:
+                    log.add_task_outcome(i, f"Task `item {seed}` done (attempt 1)")
+            else:
+                log.add_error(i, "Process exited with code 1")
+                failed += 1
+            log.add_iteration_end(i, success, False)
+        log.write(iterations - failed, failed, False, {}, final=True)
+        paths.append(path)
+    return paths
+
+
+def bench_analyze(args: argparse.Namespace) -> None:
+    """`ralph_v2.py analyze` over many activity logs: ingest and statistics, NumPy vs the pure-Python fallback."""
+    numpy = ralph_v2.np
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_activity_logs(Path(tmp), args.runs, args.iterations, args.tools)
+        rows = []
+        results = []
+        for name, backend in (("NumPy", numpy), ("pure Python", None)):
+            if name == "NumPy" and numpy is None:
+                rows.append([name, "not installed", "", ""])
+                continue
+            ralph_v2.np = backend
+            try:
+                start = time.perf_counter()
+                table = ralph_v2.RunAnalytics()
+                for path in paths:
+                    ralph_v2.ingest_activity_log(table, path)
+                table.freeze()
+                ingested = time.perf_counter() - start
+                results.append(ralph_v2.analyze_runs(table, "week"))
+                elapsed = time.perf_counter() - start
+            finally:
+                ralph_v2.np = numpy
+            rows.append([name, f"{ingested:.2f}s", f"{(elapsed - ingested) * 1000:.1f} ms", f"{len(table) / elapsed:,.0f}"])
+
+    if len(results) == 2:
+        same = all(
+            ralph_v2._fmt(results[0]["overall"][key]) == ralph_v2._fmt(results[1]["overall"][key])
+            for key in ("iterations", "p50", "p95", "cost", "items_done", "tokens_per_call")
+        )
+        rows.append(["backends agree", "yes" if same else "NO", "", ""])
+    print_table(
+        f"analyze, {args.runs:,} runs x {args.iterations:,} iterations ({args.tools}-{args.tools + 4} tool calls each)",
+        ["backend", "read logs", "statistics", "iterations/s"],
+        rows,
+    )
+
+
+BENCHMARKS: dict = {
+    "matcher": bench_matcher,
+    "decode": bench_decode,
+    "reader": bench_reader,
+    "runner": bench_runner,
+    "prompt": bench_prompt,
+    "activity": bench_activity,
+    "analyze": bench_analyze,
+    "pipeline": bench_pipeline,
+    "sinks": bench_sinks,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for ralph_v2.py")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    matcher = subparsers.add_parser("matcher", help="Streaming completion-marker detection")
+    matcher.add_argument("--chunk-size", type=int, default=200, help="Characters per text chunk (default: 200)")
+    matcher.add_argument(
+        "--stream-lengths",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 5000],
+        help="Number of chunks per simulated iteration (default: 100 1000 5000)",
+    )
+
+    decode = subparsers.add_parser("decode", help="Stream-json decoding throughput")
+    decode.add_argument("--transcript", action="append", help="Recorded .jsonl/.jsonl.gz transcript (repeatable)")
+    decode.add_argument("--events", type=int, default=20000, help="Synthetic events when no transcript is given (default: 20000)")
+    decode.add_argument("--payload-bytes", type=int, default=2000, help="Synthetic tool result size (default: 2000)")
+    decode.add_argument("--repeat", type=int, default=3, help="Runs per decoder, best is reported (default: 3)")
+
+    reader = subparsers.add_parser("reader", help="Pipe reading throughput and peak memory")
+    reader.add_argument("--big-mb", type=int, nargs="+", default=[4, 16, 64], help="Size of the largest tool result in MB (default: 4 16 64)")
+    reader.add_argument("--events", type=int, default=5000, help="Ordinary events around it (default: 5000)")
+    reader.add_argument("--payload-bytes", type=int, default=2000, help="Ordinary tool result size (default: 2000)")
+
+    runner = subparsers.add_parser("runner", help="End-to-end loop against fake_claude.py (events/sec, latency, RSS, log writes)")
+    runner.add_argument("--iterations", type=int, nargs="+", default=[1, 100, 1000], help="Run lengths (default: 1 100 1000)")
+    runner.add_argument("--events", type=int, default=200, help="Synthetic events per iteration (default: 200)")
+    runner.add_argument("--payload-bytes", type=int, default=2000, help="Synthetic tool result size (default: 2000)")
+    runner.add_argument("--transcript", help="Replay this recording (file or --record directory) instead of synthetic events")
+
+    prompt = subparsers.add_parser("prompt", help="Prompt size and build cost with --prd vs reading the whole PRD")
+    prompt.add_argument("--prd", help="PRD to slice (default: a synthetic one)")
+    prompt.add_argument("--prompt-file", help="Prompt template (default: a one-line prompt)")
+    prompt.add_argument("--scope", help="Only items under a heading containing this text (like --prd-scope)")
+    prompt.add_argument("--sections", type=int, default=20, help="Sections in the synthetic PRD (default: 20)")
+    prompt.add_argument("--items", type=int, default=100, help="Checklist items in the synthetic PRD (default: 100)")
+    prompt.add_argument("--repeat", type=int, default=1000, help="Cached builds to average (default: 1000)")
+
+    activity = subparsers.add_parser("activity", help="Activity log memory per event, dicts vs slotted records")
+    activity.add_argument("--events", type=int, default=100000, help="Tool calls and errors to log (default: 100000)")
+    activity.add_argument("--error-ratio", type=float, default=0.1, help="Share of errors among them (default: 0.1)")
+
+    analyze = subparsers.add_parser("analyze", help="`ralph_v2.py analyze` over many activity logs, NumPy vs pure Python")
+    analyze.add_argument("--runs", type=int, default=200, help="Activity logs to generate, one run each (default: 200)")
+    analyze.add_argument("--iterations", type=int, default=50, help="Iterations per run (default: 50)")
+    analyze.add_argument("--tools", type=int, default=8, help="Minimum tool calls per iteration (default: 8)")
+
+    pipeline = subparsers.add_parser("pipeline", help="Gap between sequential iterations, with and without --pipeline")
+    pipeline.add_argument("--iterations", type=int, default=10, help="Iterations per mode (default: 10)")
+    pipeline.add_argument("--events", type=int, default=200, help="Synthetic events per iteration (default: 200)")
+    pipeline.add_argument("--startup", type=float, default=1.0, help="Simulated CLI cold start in seconds (default: 1.0)")
+    pipeline.add_argument("--shutdown", type=float, default=0.5,
+                          help="Simulated CLI exit time after the result event in seconds (default: 0.5)")
+    pipeline.add_argument("--work", type=float, default=0.2,
+                          help="Runner work between iterations in seconds, e.g. verification (default: 0.2)")
+
+    sinks = subparsers.add_parser("sinks", help="Reader throughput with a slow terminal and event store, inline consumers vs event sinks")
+    sinks.add_argument("--events", type=int, default=20000, help="Synthetic events (default: 20000)")
+    sinks.add_argument("--payload-bytes", type=int, default=2000, help="Synthetic tool result size (default: 2000)")
+    sinks.add_argument("--terminal-ms", type=float, default=1.0, help="Milliseconds per terminal flush (default: 1.0)")
+    sinks.add_argument("--store-ms", type=float, default=0.5,
+                       help="Milliseconds per event for a slow event store, which must see every event (default: 0.5)")
+
+    args = parser.parse_args()
+    run: Callable[[argparse.Namespace], None] = BENCHMARKS[args.benchmark]
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Fake Claude CLI for exercising ralph_v2.py without calling the real one.
+
+Prints a stream-json transcript on stdout, like `claude -p ... --output-format
+stream-json`, and ignores the Claude arguments it is given. The transcript is
+either a recording (from `ralph_v2.py --record` or an `--event-store` segment)
+or a synthetic one of configurable size, written at full speed, at a fixed
+event rate, or with the recorded real-time pacing.
+
+Like the real CLI it reads the prompt from stdin (unless that is a terminal)
+before printing anything, optionally after a simulated cold start (--startup),
+and can take a while to exit after the result event (--shutdown).
+
+Options can also be set through FAKE_CLAUDE_* environment variables, which is
+how they reach it when ralph_v2.py starts it via --claude-bin.
+
+Usage:
+    python ralph_v2.py 10 --claude-bin scripts/ralph/fake_claude.py
+    FAKE_CLAUDE_EVENTS=2000 FAKE_CLAUDE_RATE=50 python ralph_v2.py 3 --claude-bin scripts/ralph/fake_claude.py
+    FAKE_CLAUDE_STARTUP=1.5 FAKE_CLAUDE_SHUTDOWN=1 python ralph_v2.py 10 --pipeline --claude-bin scripts/ralph/fake_claude.py
+    FAKE_CLAUDE_REPLAY=.ralph/recordings/20250125-103000 FAKE_CLAUDE_REALTIME=1 \\
+        python ralph_v2.py 5 --claude-bin scripts/ralph/fake_claude.py
+    python fake_claude.py --events 100 --payload-bytes 50000 > transcript.jsonl
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+
+def synthetic_transcript(events: int, payload_bytes: int = 2000, partial_ratio: float = 0.5, complete: bool = False) -> List[str]:
+    """A stream-json transcript shaped like a real iteration.
+
+    Mixes assistant text, tool calls and tool results of `payload_bytes` with
+    `stream_event` partial-message deltas (which the runner ignores) in roughly
+    `partial_ratio` of the lines.
+    """
+    payload = ("x" * 63 + "\n") * (payload_bytes // 64 + 1)
+    lines = [json.dumps({"type": "system", "subtype": "init", "tools": ["Bash", "Read", "Edit"], "session_id": "bench"})]
+    i = 0
+    while len(lines) < events - 1:
+        i += 1
+        if (i % 100) < partial_ratio * 100:
+            lines.append(json.dumps({
+                "type": "stream_event",
+                "event": {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "partial "}},
+                "session_id": "bench",
+            }))
+        elif i % 3 == 0:
+            lines.append(json.dumps({
+                "type": "assistant",
+                "message": {"id": f"msg_{i}", "content": [{"type": "text", "text": f"Step {i}: updating the board service."}],
+                            "usage": {"input_tokens": 1200, "output_tokens": 40}},
+                "session_id": "bench",
+            }))
+        elif i % 3 == 1:
+            lines.append(json.dumps({
+                "type": "assistant",
+                "message": {"id": f"msg_{i}", "content": [{"type": "tool_use", "id": f"toolu_{i}", "name": "Bash",
+                                                          "input": {"command": "pnpm --filter api test"}}]},
+                "session_id": "bench",
+            }))
+        else:
+            lines.append(json.dumps({
+                "type": "user",
+                "message": {"content": [{"type": "tool_result", "tool_use_id": f"toolu_{i - 1}",
+                                         "content": payload[:payload_bytes], "is_error": False}]},
+                "session_id": "bench",
+            }))
+    if complete:
+        lines.append(json.dumps({
+            "type": "assistant",
+            "message": {"id": "msg_done", "content": [{"type": "text", "text": "All tasks done. RALPH_COMPLETE"}]},
+            "session_id": "bench",
+        }))
+    lines.append(json.dumps({"type": "result", "cost_usd": 0.5, "duration_ms": 60000,
+                             "total_input_tokens": 50000, "total_output_tokens": 4000, "num_turns": 20}))
+    return [line + "\n" for line in lines]
+
+
+def find_recording(path: Path, iteration: Optional[int]) -> Path:
+    """Pick the transcript to replay: the file itself, or an iteration's file in a recording directory.
+
+    Iterations beyond the recorded ones wrap around, so short recordings can drive long runs.
+    """
+    if path.is_file():
+        return path
+    candidates = sorted(p for p in path.iterdir() if p.name.endswith((".jsonl", ".jsonl.gz")))
+    if not candidates:
+        raise SystemExit(f"fake_claude: no .jsonl or .jsonl.gz recordings in {path}")
+    if iteration is None:
+        return candidates[0]
+    return candidates[(iteration - 1) % len(candidates)]
+
+
+def read_recording(path: Path) -> Tuple[List[bytes], Optional[List[float]]]:
+    """Lines of a recording, plus their recorded arrival times when a `.times` file exists."""
+    opener = gzip.open if path.name.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        lines = [line if line.endswith(b"\n") else line + b"\n" for line in f]
+
+    times_path = path.with_name(path.name.split(".jsonl")[0] + ".times")
+    times = None
+    if times_path.exists():
+        times = [float(value) for value in times_path.read_text().split()]
+    return lines, times
+
+
+def paced(lines: List[bytes], times: Optional[List[float]], rate: float) -> Iterator[Tuple[bytes, Optional[float]]]:
+    """Yield (line, offset) pairs; offset is when to write the line, None for as soon as possible."""
+    for i, line in enumerate(lines):
+        if times is not None and i < len(times):
+            yield line, times[i]
+        elif rate > 0:
+            yield line, i / rate
+        else:
+            yield line, None
+
+
+def env_default(name: str, default: str) -> str:
+    return os.environ.get(f"FAKE_CLAUDE_{name}", default)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fake Claude CLI that prints a recorded or synthetic stream-json transcript")
+    parser.add_argument("--replay", default=env_default("REPLAY", ""), metavar="PATH",
+                        help="Recording to replay: a .jsonl/.jsonl.gz file or a directory of them (env FAKE_CLAUDE_REPLAY)")
+    parser.add_argument("--realtime", action="store_true", default=env_default("REALTIME", "") not in ("", "0"),
+                        help="Replay with the recorded timing from the .times file (env FAKE_CLAUDE_REALTIME=1)")
+    parser.add_argument("--events", type=int, default=int(env_default("EVENTS", "200")),
+                        help="Synthetic events per iteration (default: 200, env FAKE_CLAUDE_EVENTS)")
+    parser.add_argument("--payload-bytes", type=int, default=int(env_default("PAYLOAD_BYTES", "2000")),
+                        help="Synthetic tool result size (default: 2000, env FAKE_CLAUDE_PAYLOAD_BYTES)")
+    parser.add_argument("--partial-ratio", type=float, default=float(env_default("PARTIAL_RATIO", "0.5")),
+                        help="Share of synthetic stream_event partials (default: 0.5, env FAKE_CLAUDE_PARTIAL_RATIO)")
+    parser.add_argument("--rate", type=float, default=float(env_default("RATE", "0")),
+                        help="Events per second, 0 for full speed (default: 0, env FAKE_CLAUDE_RATE)")
+    parser.add_argument("--complete-at", type=int, default=int(env_default("COMPLETE_AT", "0")),
+                        help="Iteration that prints RALPH_COMPLETE, per RALPH_ITERATION (env FAKE_CLAUDE_COMPLETE_AT)")
+    parser.add_argument("--exit-code", type=int, default=int(env_default("EXIT_CODE", "0")),
+                        help="Exit status (default: 0, env FAKE_CLAUDE_EXIT_CODE)")
+    parser.add_argument("--startup", type=float, default=float(env_default("STARTUP", "0")),
+                        help="Seconds of simulated cold start before reading the prompt (default: 0, env FAKE_CLAUDE_STARTUP)")
+    parser.add_argument("--shutdown", type=float, default=float(env_default("SHUTDOWN", "0")),
+                        help="Seconds between the last line and exiting (default: 0, env FAKE_CLAUDE_SHUTDOWN)")
+    # Everything ralph_v2.py passes for the real CLI (-p PROMPT, --output-format, ...) is ignored
+    args, _ = parser.parse_known_args()
+
+    iteration = int(os.environ["RALPH_ITERATION"]) if os.environ.get("RALPH_ITERATION") else None
+
+    if args.startup > 0:
+        time.sleep(args.startup)
+    if not sys.stdin.isatty():
+        # The prompt, which ralph_v2.py writes to stdin; nothing is done with it
+        sys.stdin.buffer.read()
+
+    if args.replay:
+        lines, times = read_recording(find_recording(Path(args.replay), iteration))
+        if not args.realtime:
+            times = None
+    else:
+        complete = bool(args.complete_at) and iteration == args.complete_at
+        lines = [line.encode() for line in synthetic_transcript(args.events, args.payload_bytes, args.partial_ratio, complete)]
+        times = None
+
+    out = sys.stdout.buffer
+    started = time.monotonic()
+    try:
+        for line, offset in paced(lines, times, args.rate):
+            if offset is not None:
+                delay = started + offset - time.monotonic()
+                if delay > 0:
+                    out.flush()
+                    time.sleep(delay)
+            out.write(line)
+        out.flush()
+        if args.shutdown > 0:
+            time.sleep(args.shutdown)
+    except BrokenPipeError:
+        # The runner stopped reading (timeout, budget or Ctrl+C)
+        return 1
+    return args.exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,31 +4,92 @@ Ralph Loop Runner v2 - A user-friendly wrapper for running Claude CLI iterations
 
 Enhanced version with:
 - Color-coded output
-- Real-time streaming JSON parsing
+- Real-time streaming JSON parsing (binary pipe reader, bounded memory for oversized events)
 - Tool call visualization
-- Progress tracking
-- Completion detection (<promise>COMPLETE</promise> or RALPH_COMPLETE)
-- Cost and token statistics
-- Activity log generation (activity.md)
-- macOS notifications when loop finishes (completion, early completion, or interrupt)
+- Progress tracking, optionally as a live dashboard or one line per iteration (--ui)
+- Completion detection (<promise>COMPLETE</promise> or RALPH_COMPLETE, or custom markers/regexes),
+  optionally stopping Claude right at the marker (--exit-on-marker)
+- Cost, token and turn statistics
+- PRD-driven prompts: the runner picks the next checklist item and its sections (--prd),
+  scheduling items as tasks with dependencies, priorities and retries with backoff
+- Incremental verification between iterations: typecheck and related tests of the changed packages,
+  cached by git tree hash, with failures fed into the next prompt (--verify)
+- Per-iteration wall-clock and idle timeouts (--iteration-timeout, --idle-timeout)
+- Cost, token and duration budgets enforced mid-stream, optionally predictive (--max-cost, ...)
+- Activity log generation (activity.md), including a per-tool latency profile
+- Optional OpenMetrics/Prometheus endpoint (--metrics-port)
+- Optional raw event store (compressed JSONL + SQLite index) and `query` subcommand
+- Cross-run statistics from activity logs or the event store, vectorized with NumPy when installed (`analyze`)
+- Recording of raw iterations (--record) for replay with fake_claude.py (--claude-bin)
+- Crash-safe checkpoint of the loop state after every iteration (--resume)
+- Rate-limit aware launches: throttle errors back off and shrink concurrency (AIMD), fatal errors stop
+  the loop; limits optionally shared between runners through a locked state file (--limiter-state)
+- Non-blocking notifications when loop finishes (completion, early completion, or interrupt) and at
+  milestones, via osascript, notify-send, a webhook or a file/FIFO (--notify...)
+- Parallel workers in isolated git worktrees (--workers N)
+- Pipelined sequential iterations: the next Claude process starts while the current one exits, and logs
+  are written in the background; the gap between iterations is reported in the summary (--pipeline)
+- Event sinks: the stream reader only decodes; terminal, activity log, event store, UI and metrics each
+  consume events on their own thread behind a bounded queue, dropping or coalescing when they fall
+  behind, with lag counters (--verbose and the summary)
+- asyncio iteration engine, usable as a library via run_iteration_async()
 
 Usage:
     python ralph_v2.py <iterations> [--prompt-file PROMPT.md]
     python ralph_v2.py 5
     python ralph_v2.py 10 --prompt-file custom_prompt.md
+    python ralph_v2.py 30 --prd .claude/plans/inzone-prd.md --prd-scope "Phase 1"
     python ralph_v2.py 30 --stop-on-complete --verbose
+    python ralph_v2.py 30 --exit-on-marker 10
+    python ralph_v2.py 30 --verify
     python ralph_v2.py 5 --activity-log custom_activity.md
+    python ralph_v2.py 30 --workers 4
+    python ralph_v2.py 30 --pipeline
+    python ralph_v2.py --resume
+    python ralph_v2.py 30 --ui dashboard
+    python ralph_v2.py 30 --iteration-timeout 3600 --idle-timeout 600
+    python ralph_v2.py 30 --max-cost 20 --predictive-budget
+    python ralph_v2.py 30 --metrics-port 9466
+    python ralph_v2.py 30 --workers 4 --max-launch-rate 6 --limiter-state ~/.ralph-limiter.json
+    python ralph_v2.py 30 --notify-webhook http://localhost:8080/ralph --notify-every 10
+    python ralph_v2.py 30 --profile-trace .ralph/trace.json
+    python ralph_v2.py 5 --record
+    python ralph_v2.py 5 --claude-bin scripts/ralph/fake_claude.py
+    python ralph_v2.py 30 --event-store
+    python ralph_v2.py 30 --max-line-bytes 1048576
+    python ralph_v2.py query --tool Bash --errors
+    python ralph_v2.py analyze logs/ --by week --csv runs.csv
 """
 
 import argparse
+import asyncio
+import atexit
+import contextvars
+import csv
+import enum
+import errno
+import fcntl
+import gzip
+import hashlib
 import json
+import math
+import queue
+import re
+import shutil
 import subprocess
 import sys
 import signal
+import socket
 import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Callable, Optional, Tuple, List, Dict, Sequence, Union
 
 
 # ANSI color codes
@@ -50,90 +111,560 @@ class Colors:
     BG_BLUE = "\033[44m"
 
 
+# Tag of the parallel worker producing the current output ("" outside worker mode)
+worker_tag: contextvars.ContextVar = contextvars.ContextVar("ralph_worker_tag", default="")
+
+
+class WorkerTaggedStream:
+    """Line-buffered stdout wrapper that prefixes each line with the current worker tag.
+
+    Each worker's output is buffered until a full line is available, so lines from
+    concurrent workers interleave but never tear.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffers: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        tag = worker_tag.get()
+        if not tag:
+            with self._lock:
+                return self.stream.write(text)
+
+        with self._lock:
+            buffered = self._buffers.get(tag, "") + text
+            *lines, rest = buffered.split("\n")
+            self._buffers[tag] = rest
+            if lines:
+                prefix = colorize(f"[{tag}] ", Colors.DIM)
+                self.stream.write("".join(f"{prefix}{line}\n" for line in lines))
+        return len(text)
+
+    def flush(self) -> None:
+        with self._lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+DEFAULT_COMPLETION_MARKERS = ("RALPH_COMPLETE", "<promise>COMPLETE</promise>")
+
+
+class CompletionMatcher:
+    """Incremental completion-marker detector for streamed assistant text.
+
+    Only a short tail of previously seen text is kept between chunks, so every
+    chunk is scanned once and the cost per chunk does not grow with the amount
+    of text that came before it. Literal markers can span chunk boundaries;
+    regex matches can too, as long as they fit within `regex_window` characters.
+    """
+
+    def __init__(
+        self,
+        markers: Sequence[str] = DEFAULT_COMPLETION_MARKERS,
+        patterns: Sequence[str] = (),
+        regex_window: int = 256,
+    ):
+        self.markers = [marker for marker in markers if marker]
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        overlap = max((len(marker) for marker in self.markers), default=1) - 1
+        if self.patterns:
+            overlap = max(overlap, regex_window)
+        self._overlap = overlap
+        self._tail = ""
+        self.matched: Optional[str] = None
+
+    def feed(self, text: str) -> bool:
+        """Scan the next chunk of text. Returns True once any marker has been seen."""
+        if self.matched is not None:
+            return True
+
+        window = self._tail + text
+        for marker in self.markers:
+            if marker in window:
+                self.matched = marker
+                return True
+        for pattern in self.patterns:
+            match = pattern.search(window)
+            if match:
+                self.matched = match.group(0)
+                return True
+
+        self._tail = window[-self._overlap:] if self._overlap else ""
+        return False
+
+
+def summarize_tool_input(tool_input: dict, max_len: int = 100) -> str:
+    """One-line summary of a tool call's input (command, path, pattern or URL)."""
+    summary = ""
+    if "command" in tool_input:
+        cmd = tool_input["command"]
+        summary = cmd[:max_len] + "..." if len(cmd) > max_len else cmd
+    elif "file_path" in tool_input:
+        summary = tool_input["file_path"]
+    elif "path" in tool_input:
+        summary = tool_input["path"]
+    elif "pattern" in tool_input:
+        summary = tool_input["pattern"]
+    elif "url" in tool_input:
+        summary = tool_input["url"]
+    return summary
+
+
+def tool_result_text(content) -> str:
+    """Flatten a tool_result's content, which is either a string or a list of blocks."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return str(content)
+
+
+# Optional fast JSON backends; the stdlib parser is always available as a fallback
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        json_loads = msgspec.json.Decoder().decode
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        json_loads = json.loads
+        JSON_BACKEND = "json"
+
+# Optional vectorized backend for `analyze`; the pure-Python fallback computes the same statistics
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+JSON_DECODE_ERRORS: tuple = (ValueError,)
+if JSON_BACKEND == "msgspec":
+    JSON_DECODE_ERRORS = (ValueError, msgspec.DecodeError)
+
+# Event types process_stream_json acts on; anything else is only peeked at
+HANDLED_EVENT_TYPES = frozenset({"system", "assistant", "user", "result", "error"})
+
+# Matches a leading "type" key, which is how the Claude CLI serializes every event
+EVENT_TYPE_PREFIX = re.compile(rb'\s*\{\s*"type"\s*:\s*"([^"\\]*)"')
+
+
+def as_text(line: Union[str, bytes]) -> str:
+    """Decode a raw stream line for display; invalid UTF-8 is replaced."""
+    return line.decode("utf-8", errors="replace") if isinstance(line, bytes) else line
+
+
+def peek_event_type(line: Union[str, bytes]) -> Optional[str]:
+    """Cheaply read an event's type without decoding it.
+
+    Returns None when the line doesn't start with a "type" key, in which case the
+    caller has to decode the whole event to find out.
+    """
+    if isinstance(line, str):
+        line = line[:256].encode("utf-8", errors="replace")
+    match = EVENT_TYPE_PREFIX.match(line)
+    return match.group(1).decode("utf-8", errors="replace") if match else None
+
+
+class TextBlock:
+    __slots__ = ("text",)
+    type = "text"
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ToolUseBlock:
+    __slots__ = ("id", "name", "input")
+    type = "tool_use"
+
+    def __init__(self, id: str, name: str, input: dict):
+        self.id = id
+        self.name = name
+        self.input = input
+
+
+class ToolResultBlock:
+    __slots__ = ("tool_use_id", "content", "is_error")
+    type = "tool_result"
+
+    def __init__(self, tool_use_id: str, content: str, is_error: bool):
+        self.tool_use_id = tool_use_id
+        self.content = content
+        self.is_error = is_error
+
+
+class OtherBlock:
+    __slots__ = ("type",)
+
+    def __init__(self, type: str):
+        self.type = type
+
+
+def decode_block(block: dict):
+    """Convert a message content block into its typed form."""
+    block_type = block.get("type", "")
+    if block_type == "text":
+        return TextBlock(block.get("text", ""))
+    if block_type == "tool_use":
+        return ToolUseBlock(block.get("id", ""), block.get("name", "unknown"), block.get("input", {}))
+    if block_type == "tool_result":
+        return ToolResultBlock(
+            block.get("tool_use_id", ""),
+            tool_result_text(block.get("content", "")),
+            bool(block.get("is_error", False)),
+        )
+    return OtherBlock(block_type)
+
+
+class StreamEvent:
+    """A stream-json event. Events the runner ignores are left as this base type,
+    carrying only their peeked type and the raw line."""
+
+    __slots__ = ("type", "raw")
+
+    def __init__(self, type: str, raw: Union[str, bytes]):
+        self.type = type
+        self.raw = raw
+
+
+class SystemEvent(StreamEvent):
+    __slots__ = ("subtype", "tools")
+
+    def __init__(self, data: dict, raw: str):
+        super().__init__("system", raw)
+        self.subtype = data.get("subtype", "")
+        self.tools = data.get("tools", [])
+
+
+class MessageEvent(StreamEvent):
+    """An assistant or user message."""
+
+    __slots__ = ("message_id", "blocks", "usage")
+
+    def __init__(self, data: dict, raw: str):
+        super().__init__(data.get("type", ""), raw)
+        message = data.get("message", {})
+        self.message_id = message.get("id", "")
+        content = message.get("content", [])
+        self.blocks = [decode_block(block) for block in content if isinstance(block, dict)] if isinstance(content, list) else []
+        self.usage = message.get("usage") or {}
+
+
+class ResultEvent(StreamEvent):
+    __slots__ = ("cost_usd", "duration_ms", "tokens_in", "tokens_out", "num_turns", "is_error", "result")
+
+    def __init__(self, data: dict, raw: str):
+        super().__init__("result", raw)
+        self.cost_usd = data.get("cost_usd")
+        self.duration_ms = data.get("duration_ms")
+        self.tokens_in = data.get("total_input_tokens")
+        self.tokens_out = data.get("total_output_tokens")
+        self.num_turns = data.get("num_turns")
+        self.is_error = bool(data.get("is_error", False))
+        result = data.get("result")
+        self.result = result if isinstance(result, str) else ""
+
+
+class ErrorEvent(StreamEvent):
+    __slots__ = ("message", "error_type")
+
+    def __init__(self, data: dict, raw: str):
+        super().__init__("error", raw)
+        error = data.get("error", {})
+        self.message = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+        # e.g. "rate_limit_error", "overloaded_error" (see classify_error)
+        self.error_type = error.get("type", "") if isinstance(error, dict) else ""
+
+
+EVENT_CLASSES = {
+    "system": SystemEvent,
+    "assistant": MessageEvent,
+    "user": MessageEvent,
+    "result": ResultEvent,
+    "error": ErrorEvent,
+}
+
+
+def decode_event(line: Union[str, bytes]) -> Optional[StreamEvent]:
+    """Decode one stream-json line into a typed event.
+
+    Lines may be str or undecoded bytes straight from the pipe. Event types the
+    runner ignores are recognized from the line prefix and never fully parsed.
+    Returns None for lines that aren't JSON objects.
+    """
+    event_type = peek_event_type(line)
+    if event_type is not None and event_type not in HANDLED_EVENT_TYPES:
+        return StreamEvent(event_type, line)
+
+    try:
+        data = json_loads(line)
+    except JSON_DECODE_ERRORS:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    event_type = data.get("type", "")
+    event_class = EVENT_CLASSES.get(event_type)
+    if event_class is None:
+        return StreamEvent(event_type, line)
+    return event_class(data, line)
+
+
+class EventDeduper:
+    """Bounded-memory duplicate filter for stream-json content blocks.
+
+    Keys are reduced to 64-bit fingerprints held in an LRU window of at most
+    `capacity` entries, so memory stays flat however long an iteration streams.
+    Duplicates only need to be caught while they are recent, which is when the
+    CLI re-emits them.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.suppressed = 0
+        self.suppressed_by_kind: Counter = Counter()
+
+    @staticmethod
+    def fingerprint(kind: str, key: str) -> int:
+        """64-bit fingerprint of a (kind, key) pair."""
+        digest = hashlib.blake2b(kind.encode() + b"\0" + key.encode("utf-8", "surrogatepass"), digest_size=8)
+        return int.from_bytes(digest.digest(), "little")
+
+    def first_seen(self, kind: str, key: str) -> bool:
+        """Record a block and return True unless it is a recent duplicate."""
+        fingerprint = self.fingerprint(kind, key)
+        if fingerprint in self._seen:
+            self._seen.move_to_end(fingerprint)
+            self.suppressed += 1
+            self.suppressed_by_kind[kind] += 1
+            return False
+
+        self._seen[fingerprint] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return True
+
+
+def per_iteration_averages(iterations: int, global_state: dict) -> str:
+    """Average input tokens, turns and prompt size per iteration, e.g. to compare prompts."""
+    if not iterations:
+        return ""
+    parts = []
+    if global_state.get("total_tokens_in"):
+        parts.append(f"{global_state['total_tokens_in'] / iterations:,.0f} tokens in")
+    if global_state.get("total_turns"):
+        parts.append(f"{global_state['total_turns'] / iterations:.1f} turns")
+    if global_state.get("total_prompt_bytes"):
+        parts.append(f"{global_state['total_prompt_bytes'] / iterations:,.0f} prompt bytes")
+    return ", ".join(parts)
+
+
+class LogEntryKind(enum.IntEnum):
+    """What an activity log entry records."""
+
+    TOOL_CALL = 1
+    ERROR = 2
+
+
+class LogEntry:
+    """A tool call or error of one iteration in the activity log.
+
+    `ns` is time.monotonic_ns() when it was logged; tool names are interned, so
+    an entry holds little besides its summary text.
+    """
+
+    __slots__ = ("kind", "ns", "name", "text")
+
+    def __init__(self, kind: LogEntryKind, ns: int, name: str, text: str):
+        self.kind = kind
+        self.ns = ns
+        self.name = name
+        self.text = text
+
+
+class IterationRecord:
+    """What the activity log keeps about an iteration until its section is written."""
+
+    __slots__ = (
+        "total", "started_ns", "ended_ns", "interrupted", "entries", "stats", "success", "complete",
+        "summary", "marker_exit", "prompt", "task_outcome", "verification",
+    )
+
+    def __init__(self, total: int, started_ns: Optional[int]):
+        self.total = total
+        self.started_ns = started_ns
+        self.ended_ns: Optional[int] = None
+        self.interrupted = False
+        self.entries: List[LogEntry] = []
+        self.stats: Optional[dict] = None
+        self.success: Optional[bool] = None
+        self.complete = False
+        self.summary: Optional[str] = None
+        self.marker_exit: Optional[dict] = None
+        self.prompt: Optional[dict] = None
+        self.task_outcome: Optional[str] = None
+        self.verification: Optional[dict] = None
+
+
 class ActivityLog:
-    """Tracks and writes activity to activity.md file."""
+    """Tracks and writes activity to activity.md file.
+
+    The log is append-only: each iteration's section is appended once, when the
+    iteration has finished, and the summary at the top lives in a fixed-size
+    block that is rewritten in place. Writing costs O(events in the iterations
+    being flushed) no matter how long the run is, and a crash can at worst
+    leave the last section incomplete, never truncate earlier ones.
+    """
+
+    # Size in bytes of the in-place summary block at the top of the file
+    HEADER_BLOCK_SIZE = 1024
 
     def __init__(self, output_path: Path):
         self.output_path = output_path
-        self.entries: List[dict] = []
         self.start_time = datetime.now()
+        # Per-iteration data, dropped once the iteration's section is written
+        self.iterations: Dict[int, IterationRecord] = {}
+        # Guards `iterations` against parallel workers starting iterations during a write.
+        # Reentrant because the SIGINT handler writes the log from the main thread.
+        self._lock = threading.RLock()
+        # Serializes write(); reentrant like _lock, for the SIGINT handler
+        self._write_lock = threading.RLock()
+        self._created = False
+        self.resumed_at: Optional[datetime] = None
+        # Objects that also receive every add_* call they define a method for (e.g. LoopMetrics),
+        # and may add a closing section with render_activity_section()
+        self.listeners: List[object] = []
+        self._finalized = False
+
+    def _iteration(self, iteration: int) -> Optional[IterationRecord]:
+        return self.iterations.get(iteration)
+
+    def resume(self, start_time: datetime) -> None:
+        """Continue an existing log (see --resume) instead of starting a new one."""
+        self.start_time = start_time
+        self.resumed_at = datetime.now()
+        self._created = self.output_path.exists()
+
+    def add_interrupted_iteration(self, iteration: int, total: int, reason: str) -> None:
+        """Log an iteration that a previous runner never finished."""
+        data = IterationRecord(total, None)
+        data.ended_ns = time.monotonic_ns()
+        data.interrupted = True
+        data.success = False
+        data.entries.append(LogEntry(LogEntryKind.ERROR, data.ended_ns, "", reason))
+        with self._lock:
+            self.iterations[iteration] = data
+
+    def _notify(self, method: str, *args) -> None:
+        for listener in self.listeners:
+            handler = getattr(listener, method, None)
+            if handler:
+                handler(*args)
 
     def add_iteration_start(self, iteration: int, total: int) -> None:
         """Log the start of an iteration."""
-        self.entries.append({
-            "type": "iteration_start",
-            "iteration": iteration,
-            "total": total,
-            "timestamp": datetime.now().isoformat(),
-        })
+        data = IterationRecord(total, time.monotonic_ns())
+        with self._lock:
+            self.iterations[iteration] = data
+        self._notify("add_iteration_start", iteration, total)
 
     def add_iteration_end(self, iteration: int, success: bool, complete: bool) -> None:
         """Log the end of an iteration."""
-        self.entries.append({
-            "type": "iteration_end",
-            "iteration": iteration,
-            "success": success,
-            "complete": complete,
-            "timestamp": datetime.now().isoformat(),
-        })
+        data = self._iteration(iteration)
+        if data is not None:
+            data.success = success
+            data.complete = complete
+            data.ended_ns = time.monotonic_ns()
+        self._notify("add_iteration_end", iteration, success, complete)
+
+    def add_merge_failure(self, iteration: int, branch: str, details: str) -> None:
+        """Log that a finished iteration's branch could not be merged back (see --workers); it counts as failed."""
+        self.add_error(iteration, f"Merge of {branch} failed: {details}")
+        data = self._iteration(iteration)
+        if data is not None:
+            data.success = False
+        self._notify("add_merge_failure", iteration, branch, details)
 
     def add_tool_call(self, iteration: int, tool_name: str, tool_input: dict) -> None:
         """Log a tool call."""
         # Extract relevant info from tool_input
-        summary = ""
-        if "command" in tool_input:
-            cmd = tool_input["command"]
-            summary = cmd[:100] + "..." if len(cmd) > 100 else cmd
-        elif "file_path" in tool_input:
-            summary = tool_input["file_path"]
-        elif "path" in tool_input:
-            summary = tool_input["path"]
-        elif "pattern" in tool_input:
-            summary = tool_input["pattern"]
-        elif "url" in tool_input:
-            summary = tool_input["url"]
-
-        self.entries.append({
-            "type": "tool_call",
-            "iteration": iteration,
-            "tool_name": tool_name,
-            "summary": summary,
-            "timestamp": datetime.now().isoformat(),
-        })
+        summary = summarize_tool_input(tool_input)
 
-    def add_stats(self, iteration: int, cost: float, duration: float, tokens_in: int, tokens_out: int) -> None:
+        data = self._iteration(iteration)
+        if data is not None:
+            data.entries.append(LogEntry(LogEntryKind.TOOL_CALL, time.monotonic_ns(), sys.intern(tool_name), summary))
+        self._notify("add_tool_call", iteration, tool_name, tool_input)
+
+    def add_stats(
+        self, iteration: int, cost: float, duration: float, tokens_in: int, tokens_out: int, num_turns: Optional[int] = None
+    ) -> None:
         """Log iteration stats."""
-        self.entries.append({
-            "type": "stats",
-            "iteration": iteration,
-            "cost": cost,
-            "duration": duration,
-            "tokens_in": tokens_in,
-            "tokens_out": tokens_out,
-            "timestamp": datetime.now().isoformat(),
-        })
+        data = self._iteration(iteration)
+        if data is not None:
+            data.stats = {
+                "cost": cost,
+                "duration": duration,
+                "tokens_in": tokens_in,
+                "tokens_out": tokens_out,
+                "num_turns": num_turns,
+            }
+        self._notify("add_stats", iteration, cost, duration, tokens_in, tokens_out)
+
+    def add_marker_exit(
+        self, iteration: int, reason: str, after_marker: float, saved_seconds: Optional[float], saved_cost: Optional[float]
+    ) -> None:
+        """Log that Claude was stopped at the completion marker (see --exit-on-marker)."""
+        data = self._iteration(iteration)
+        if data is not None:
+            data.marker_exit = {
+                "reason": reason,
+                "after_marker": after_marker,
+                "saved_seconds": saved_seconds,
+                "saved_cost": saved_cost,
+            }
+
+    def add_task_outcome(self, iteration: int, outcome: str) -> None:
+        """Log what became of the iteration's PRD task (done, retry or failed)."""
+        data = self._iteration(iteration)
+        if data is not None:
+            data.task_outcome = outcome
+
+    def add_verification(self, iteration: int, report: dict) -> None:
+        """Log the checks run after the iteration, with timings and cache hits (see Verifier.run)."""
+        data = self._iteration(iteration)
+        if data is not None:
+            data.verification = report
+
+    def add_prompt(self, iteration: int, prompt_bytes: int, task: Optional[str] = None) -> None:
+        """Log the size of the prompt sent, and the PRD item it asked for (see --prd)."""
+        data = self._iteration(iteration)
+        if data is not None:
+            data.prompt = {"bytes": prompt_bytes, "task": task}
 
     def add_error(self, iteration: int, error_msg: str) -> None:
         """Log an error."""
-        self.entries.append({
-            "type": "error",
-            "iteration": iteration,
-            "error": error_msg,
-            "timestamp": datetime.now().isoformat(),
-        })
+        data = self._iteration(iteration)
+        if data is not None:
+            data.entries.append(LogEntry(LogEntryKind.ERROR, time.monotonic_ns(), "", error_msg))
+        self._notify("add_error", iteration, error_msg)
 
     def add_iteration_summary(self, iteration: int, accumulated_text: str) -> None:
         """Log the assistant's accumulated text output as an iteration summary."""
         # Extract a meaningful summary from the accumulated text
         # Take the last significant chunk (usually the wrap-up text)
         summary = self._extract_summary(accumulated_text)
-        if summary:
-            self.entries.append({
-                "type": "iteration_summary",
-                "iteration": iteration,
-                "summary": summary,
-                "timestamp": datetime.now().isoformat(),
-            })
+        data = self._iteration(iteration)
+        if summary and data is not None:
+            data.summary = summary
 
     @staticmethod
     def _extract_summary(text: str) -> str:
@@ -148,12 +679,14 @@ class ActivityLog:
         summary_lines = lines[-30:]
         return "\n".join(summary_lines)
 
-    def write(self, completed: int, failed: int, early_complete: bool, global_state: dict) -> None:
-        """Write the activity log to activity.md."""
+    def _render_header(self, completed: int, failed: int, early_complete: bool, global_state: dict) -> bytes:
+        """Render the summary block, padded to exactly HEADER_BLOCK_SIZE bytes."""
         lines = []
         lines.append("# Ralph Activity Log")
         lines.append("")
         lines.append(f"**Started:** {self.start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        if self.resumed_at:
+            lines.append(f"**Resumed:** {self.resumed_at.strftime('%Y-%m-%d %H:%M:%S')}")
         lines.append(f"**Finished:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         lines.append("")
 
@@ -173,451 +706,4662 @@ class ActivityLog:
             lines.append(f"- **Total Duration:** {duration_mins:.1f} minutes")
         if global_state.get("total_tokens_in") and global_state.get("total_tokens_out"):
             lines.append(f"- **Total Tokens:** {global_state['total_tokens_in']:,} in / {global_state['total_tokens_out']:,} out")
+        if global_state.get("marker_exits"):
+            if "marker_saved_seconds" in global_state:
+                saved = f"~{global_state['marker_saved_seconds']:.0f}s"
+                if "marker_saved_cost" in global_state:
+                    saved += f" / ~${global_state['marker_saved_cost']:.4f}"
+            else:
+                saved = "n/a (no iteration ran to its exit)"
+            lines.append(f"- **Exited on Marker:** {global_state['marker_exits']} iteration(s), saved {saved}")
+        if global_state.get("kept_branches"):
+            lines.append(f"- **Kept Branches:** {len(global_state['kept_branches'])} (listed at the end of the log)")
+        if "tasks_done" in global_state:
+            lines.append(
+                f"- **PRD Tasks:** {global_state['tasks_done']} done, {global_state['tasks_failed']} failed, "
+                f"{global_state['task_retries']} retries"
+            )
+        if global_state.get("verify_runs"):
+            checks = global_state.get("verify_checks", 0)
+            hit_rate = f"{global_state.get('verify_cache_hits', 0) / checks:.0%}" if checks else "n/a"
+            lines.append(
+                f"- **Verification:** {global_state['verify_runs']} runs, {global_state.get('verify_failed', 0)} failed, "
+                f"{hit_rate} cache hits, {global_state.get('verify_seconds', 0):.0f}s"
+            )
+        average = per_iteration_averages(completed + failed, global_state)
+        if average:
+            lines.append(f"- **Per Iteration:** {average}")
         lines.append("")
 
-        # Group entries by iteration
-        iterations_data = {}
-        for entry in self.entries:
-            if entry["type"] == "iteration_start":
-                iter_num = entry["iteration"]
-                if iter_num not in iterations_data:
-                    iterations_data[iter_num] = {"tools": [], "errors": [], "stats": None, "success": None, "complete": False, "summary": None}
-            elif entry["type"] == "iteration_end":
-                iter_num = entry["iteration"]
-                if iter_num in iterations_data:
-                    iterations_data[iter_num]["success"] = entry["success"]
-                    iterations_data[iter_num]["complete"] = entry["complete"]
-            elif entry["type"] == "tool_call":
-                iter_num = entry["iteration"]
-                if iter_num in iterations_data:
-                    iterations_data[iter_num]["tools"].append(entry)
-            elif entry["type"] == "stats":
-                iter_num = entry["iteration"]
-                if iter_num in iterations_data:
-                    iterations_data[iter_num]["stats"] = entry
-            elif entry["type"] == "error":
-                iter_num = entry["iteration"]
-                if iter_num in iterations_data:
-                    iterations_data[iter_num]["errors"].append(entry)
-            elif entry["type"] == "iteration_summary":
-                iter_num = entry["iteration"]
-                if iter_num in iterations_data:
-                    iterations_data[iter_num]["summary"] = entry["summary"]
-
-        # Iteration details
-        lines.append("## Iteration Details")
+        # Pad with an invisible HTML comment so the block always has the same size
+        filler = b"<!--  -->\n"
+        header = ("\n".join(lines) + "\n").encode()
+        if len(header) + len(filler) > self.HEADER_BLOCK_SIZE:
+            # Too much to show: drop summary lines from the end rather than fail the write
+            while len(lines) > 1 and len(("\n".join(lines) + "\n- …\n\n").encode()) + len(filler) > self.HEADER_BLOCK_SIZE:
+                lines.pop()
+            header = ("\n".join(lines) + "\n- …\n\n").encode()
+        padding = self.HEADER_BLOCK_SIZE - len(header) - len(filler)
+        return header + b"<!-- " + b" " * padding + b" -->\n"
+
+    @staticmethod
+    def _render_iteration(iter_num: int, data: IterationRecord, interrupted: bool = False) -> List[str]:
+        """Render one iteration's section."""
+        lines = []
+        status = "✓" if data.success else "✗"
+        complete_marker = " (COMPLETE)" if data.complete else ""
+        if interrupted:
+            complete_marker = " (INTERRUPTED)"
+        lines.append(f"### Iteration {iter_num} {status}{complete_marker}")
         lines.append("")
 
-        for iter_num in sorted(iterations_data.keys()):
-            data = iterations_data[iter_num]
-            status = "✓" if data["success"] else "✗"
-            complete_marker = " (COMPLETE)" if data["complete"] else ""
-            lines.append(f"### Iteration {iter_num} {status}{complete_marker}")
+        # Stats
+        if data.stats:
+            stats = data.stats
+            lines.append(f"- Cost: ${stats['cost']:.4f}" if stats.get('cost') else "")
+            lines.append(f"- Duration: {stats['duration']/1000:.1f}s" if stats.get('duration') else "")
+            lines.append(f"- Tokens: {stats.get('tokens_in', 0):,} in / {stats.get('tokens_out', 0):,} out")
+            lines.append(f"- Turns: {stats['num_turns']}" if stats.get('num_turns') else "")
             lines.append("")
 
-            # Stats
-            if data["stats"]:
-                stats = data["stats"]
-                lines.append(f"- Cost: ${stats['cost']:.4f}" if stats.get('cost') else "")
-                lines.append(f"- Duration: {stats['duration']/1000:.1f}s" if stats.get('duration') else "")
-                lines.append(f"- Tokens: {stats.get('tokens_in', 0):,} in / {stats.get('tokens_out', 0):,} out")
-                lines.append("")
-
-            # Tools used
-            if data["tools"]:
-                lines.append("**Tools Used:**")
-                for tool in data["tools"]:
-                    summary = f" - `{tool['summary']}`" if tool["summary"] else ""
-                    lines.append(f"- `{tool['tool_name']}`{summary}")
-                lines.append("")
-
-            # Errors
-            if data["errors"]:
-                lines.append("**Errors:**")
-                for error in data["errors"]:
-                    lines.append(f"- {error['error']}")
-                lines.append("")
-
-            # Iteration summary (what was accomplished)
-            if data["summary"]:
-                lines.append("**Summary of Work Done:**")
-                lines.append("")
-                for summary_line in data["summary"].split("\n"):
-                    lines.append(f"> {summary_line}")
-                lines.append("")
-
-        # Write to file
-        self.output_path.write_text("\n".join(lines))
+        if data.marker_exit:
+            marker_exit = data.marker_exit
+            if marker_exit["saved_seconds"] is not None:
+                saved = f"saved ~{marker_exit['saved_seconds']:.0f}s"
+                if marker_exit["saved_cost"] is not None:
+                    saved += f" and ~${marker_exit['saved_cost']:.4f}"
+                saved += " vs. this run's average full iteration"
+            else:
+                saved = "no full iteration yet to estimate the saving"
+            lines.append(
+                f"**Exited on marker:** {marker_exit['after_marker']:.1f}s after the marker "
+                f"({marker_exit['reason']}); {saved}"
+            )
+            lines.append("")
 
+        if data.prompt:
+            prompt = data.prompt
+            task = f" - task: `{prompt['task']}`" if prompt["task"] else ""
+            lines.append(f"**Prompt:** {prompt['bytes']:,} bytes{task}")
+            lines.append("")
 
-def send_macos_notification(title: str, message: str, sound: str = "default") -> None:
-    """Send a macOS notification using osascript."""
-    try:
-        script = f'''
-        display notification "{message}" with title "{title}" sound name "{sound}"
-        '''
-        subprocess.run(
-            ["osascript", "-e", script],
-            capture_output=True,
-            timeout=5
-        )
-    except Exception:
-        # Silently fail if notification can't be sent
-        pass
+        if data.task_outcome:
+            lines.append(f"**Task:** {data.task_outcome}")
+            lines.append("")
 
+        if data.verification:
+            report = data.verification
+            results = report["results"]
+            if results:
+                lines.append(
+                    f"**Verification:** {sum(not r['ok'] for r in results)} of {len(results)} checks failed, "
+                    f"{report['cache_hits']} cached, {report['seconds']:.1f}s ({report['changed_files']} changed files)"
+                )
+                for result in results:
+                    lines.append(f"- {describe_check(result)}")
+            else:
+                lines.append(f"**Verification:** no checked package changed ({report['seconds']:.1f}s)")
+            lines.append("")
 
-def colorize(text: str, *styles: str) -> str:
-    """Apply color/style codes to text."""
-    return "".join(styles) + text + Colors.RESET
+        # Tools used
+        tools = [entry for entry in data.entries if entry.kind is LogEntryKind.TOOL_CALL]
+        if tools:
+            lines.append("**Tools Used:**")
+            for tool in tools:
+                summary = f" - `{tool.text}`" if tool.text else ""
+                lines.append(f"- `{tool.name}`{summary}")
+            lines.append("")
 
+        # Errors
+        errors = [entry for entry in data.entries if entry.kind is LogEntryKind.ERROR]
+        if errors:
+            lines.append("**Errors:**")
+            for error in errors:
+                lines.append(f"- {error.text}")
+            lines.append("")
 
-def print_header(iteration: int, total: int) -> None:
-    """Print a formatted iteration header."""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    header = f" Iteration {iteration}/{total} "
-    line = "═" * 60
+        # Iteration summary (what was accomplished)
+        if data.summary:
+            lines.append("**Summary of Work Done:**")
+            lines.append("")
+            for summary_line in data.summary.split("\n"):
+                lines.append(f"> {summary_line}")
+            lines.append("")
 
-    print()
-    print(colorize(line, Colors.CYAN))
-    print(colorize(f"║{header:^58}║", Colors.CYAN, Colors.BOLD))
-    print(colorize(f"║{'Started at ' + timestamp:^58}║", Colors.CYAN))
-    print(colorize(line, Colors.CYAN))
-    print()
+        return lines
 
+    def _create(self, header: bytes) -> None:
+        """Atomically replace any previous log with an empty one."""
+        tmp_path = self.output_path.with_name(self.output_path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(b"\n## Iteration Details\n\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.output_path)
+        self._created = True
 
-def print_footer(iteration: int, success: bool) -> None:
-    """Print a formatted iteration footer."""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    status = "✓ Completed" if success else "✗ Failed"
-    color = Colors.GREEN if success else Colors.RED
+    def write(
+        self,
+        completed: int,
+        failed: int,
+        early_complete: bool,
+        global_state: dict,
+        upto: Optional[int] = None,
+        final: bool = False,
+    ) -> None:
+        """Append finished iterations to activity.md and refresh its summary.
 
-    print()
-    print(colorize(f"── End of iteration {iteration} at {timestamp} {status} ──", color, Colors.BOLD))
-    print()
+        Args:
+            upto: Only append iterations up to this number, leaving later ones
+                (e.g. parallel iterations not merged yet) for a later call.
+            final: Also append iterations that never finished, marked as
+                interrupted, and the listeners' run-wide sections. Used when
+                the loop is stopping.
+        """
+        # The --pipeline thread and the SIGINT handler's final write can overlap
+        with self._write_lock:
+            if self._finalized and not final:
+                # A write queued before the final one (see --pipeline) would only put back a stale summary
+                return
+            header = self._render_header(completed, failed, early_complete, global_state)
+            if not self._created:
+                self._create(header)
 
+            with self._lock:
+                ready = sorted(
+                    iter_num for iter_num, data in self.iterations.items()
+                    if (final or data.ended_ns is not None) and (upto is None or iter_num <= upto)
+                )
+                flushed = [(iter_num, self.iterations.pop(iter_num)) for iter_num in ready]
+                closing = final and not self._finalized
+                self._finalized = self._finalized or final
 
-def print_tool_call(tool_name: str, tool_input: dict) -> None:
-    """Print a formatted tool call."""
-    print(colorize(f"  🔧 {tool_name}", Colors.YELLOW, Colors.BOLD))
+            lines = []
+            for iter_num, data in flushed:
+                lines.extend(self._render_iteration(iter_num, data, interrupted=data.ended_ns is None or data.interrupted))
+            if closing:
+                if global_state.get("kept_branches"):
+                    lines.append("## Kept Branches")
+                    lines.append("")
+                    lines.append("Iteration branches of failed merges and failed iterations with commits, for manual resolution:")
+                    lines.append("")
+                    lines.extend(f"- `{branch}`" for branch in global_state["kept_branches"])
+                    lines.append("")
+                # Run-wide sections from listeners (e.g. the tool profile) go after the last iteration
+                for listener in self.listeners:
+                    render_section = getattr(listener, "render_activity_section", None)
+                    if render_section:
+                        lines.extend(render_section())
 
-    # Show relevant parts of the input
-    if "command" in tool_input:
-        cmd = tool_input['command']
-        # Truncate long commands
-        if len(cmd) > 80:
-            cmd = cmd[:77] + "..."
-        print(colorize(f"     $ {cmd}", Colors.DIM))
-    elif "file_path" in tool_input:
-        print(colorize(f"     📄 {tool_input['file_path']}", Colors.DIM))
-    elif "path" in tool_input:
-        print(colorize(f"     📄 {tool_input['path']}", Colors.DIM))
-    elif "pattern" in tool_input:
-        print(colorize(f"     🔍 {tool_input['pattern']}", Colors.DIM))
-    elif "url" in tool_input:
-        print(colorize(f"     🌐 {tool_input['url']}", Colors.DIM))
+            fd = os.open(self.output_path, os.O_WRONLY)
+            try:
+                if lines:
+                    # A single write per flush: a crash can only leave the last section partial
+                    section = ("\n".join(lines) + "\n").encode()
+                    os.lseek(fd, 0, os.SEEK_END)
+                    os.write(fd, section)
+                # The summary block is smaller than a page and rewritten with a single pwrite
+                os.pwrite(fd, header, 0)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
 
-def print_tool_result(result: str, is_error: bool = False) -> None:
-    """Print a formatted tool result (truncated if long)."""
-    max_lines = 10
-    lines = result.split("\n")
+DEFAULT_EVENT_STORE = ".ralph/events"
 
-    if is_error:
-        print(colorize("     ❌ Error:", Colors.RED))
-        color = Colors.RED
-    else:
-        color = Colors.DIM
 
-    for i, line in enumerate(lines[:max_lines]):
-        truncated_line = line[:100] + "..." if len(line) > 100 else line
-        print(colorize(f"     {truncated_line}", color))
+class EventStore:
+    """Archive of every raw stream-json event, with a SQLite index for fast queries.
 
-    if len(lines) > max_lines:
-        print(colorize(f"     ... ({len(lines) - max_lines} more lines)", Colors.DIM))
+    Raw lines go to one gzip-compressed JSONL segment per iteration
+    (`<root>/<run>/iter-0001.jsonl.gz`). `<root>/index.sqlite` holds one row per
+    event, or per content block for assistant/user messages, keyed by run,
+    iteration, kind, tool name and timestamp, with the line number of the raw
+    event in its segment.
+    """
 
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started REAL NOT NULL,
+            workdir TEXT,
+            argv TEXT
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            run_id TEXT NOT NULL,
+            iteration INTEGER NOT NULL,
+            line INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            event_type TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            tool_name TEXT,
+            tool_use_id TEXT,
+            is_error INTEGER NOT NULL DEFAULT 0,
+            summary TEXT
+        );
+        CREATE INDEX IF NOT EXISTS events_run_iteration ON events (run_id, iteration);
+        CREATE INDEX IF NOT EXISTS events_kind_tool ON events (run_id, kind, tool_name);
+        CREATE INDEX IF NOT EXISTS events_tool_use_id ON events (run_id, tool_use_id);
+        CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+    """
 
-def print_assistant_text(text: str) -> None:
-    """Print assistant's text output."""
-    for line in text.split("\n"):
-        if line.strip():
-            print(colorize(f"  {line}", Colors.WHITE))
-        else:
-            print()
+    # Index rows are inserted in batches of this size
+    BATCH_SIZE = 500
+    # Characters of text kept in the index's summary column
+    SUMMARY_CHARS = 500
 
+    def __init__(self, root: Path, run_id: str, argv: Optional[List[str]] = None):
+        self.root = root
+        self.run_id = run_id
+        self.run_dir = root / run_id
+        self.run_dir.mkdir(parents=True, exist_ok=True)
 
-def process_stream_json(line: str, state: dict, debug: bool = False, activity_log: ActivityLog = None, iteration: int = 0) -> None:
-    """Process a single line of stream-json output."""
-    if not line.strip():
-        return
+        self.db = sqlite3.connect(root / "index.sqlite", check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.execute(
+            "INSERT OR REPLACE INTO runs (run_id, started, workdir, argv) VALUES (?, ?, ?, ?)",
+            (run_id, time.time(), str(Path.cwd()), json.dumps(argv or sys.argv)),
+        )
+        self.db.commit()
 
-    try:
-        data = json.loads(line)
-    except json.JSONDecodeError:
-        # Not JSON - print it as it might be an error message or debug output
-        stripped = line.strip()
-        if stripped:
-            print(colorize(f"  {stripped}", Colors.DIM))
-            sys.stdout.flush()
-        return
+        self._lock = threading.Lock()
+        self._segments: Dict[int, gzip.GzipFile] = {}
+        self._line_counts: Dict[int, int] = {}
+        # Tool names by tool_use_id, per iteration, so results can be indexed by tool
+        self._tool_names: Dict[int, Dict[str, str]] = {}
+        self._pending: List[tuple] = []
+        self._closed = False
 
-    event_type = data.get("type", "")
+    @staticmethod
+    def segment_path(root: Path, run_id: str, iteration: int) -> Path:
+        return root / run_id / f"iter-{iteration:04d}.jsonl.gz"
 
-    # Debug: show all event types and data we receive
-    if debug:
-        data_str = json.dumps(data)[:200]
-        print(colorize(f"  [DEBUG] {event_type}: {data_str}", Colors.DIM))
-        sys.stdout.flush()
+    def begin_iteration(self, iteration: int) -> None:
+        with self._lock:
+            if iteration not in self._segments:
+                self._segments[iteration] = gzip.open(self.segment_path(self.root, self.run_id, iteration), "ab")
+                self._line_counts.setdefault(iteration, 0)
 
-    # Claude CLI stream-json format
-    if event_type == "system":
-        subtype = data.get("subtype", "")
-        if subtype == "init" and debug:
-            tools = data.get("tools", [])
-            print(colorize(f"  📋 Session started with {len(tools)} tools", Colors.CYAN))
-            sys.stdout.flush()
+    def end_iteration(self, iteration: int) -> None:
+        with self._lock:
+            segment = self._segments.pop(iteration, None)
+            if segment:
+                segment.close()
+            self._tool_names.pop(iteration, None)
+            self._flush()
 
-    elif event_type == "assistant":
-        message = data.get("message", {})
-        content = message.get("content", [])
+    def record(
+        self, iteration: int, event: Optional[StreamEvent], raw_line: Union[str, bytes], ts: Optional[float] = None
+    ) -> None:
+        """Archive one raw stream line and index it. `event` is None for non-JSON lines.
 
-        for block in content:
-            block_type = block.get("type", "")
+        `ts` is when the line arrived, if not now.
+        """
+        with self._lock:
+            segment = self._segments.get(iteration)
+            if segment is None:
+                segment = self._segments[iteration] = gzip.open(
+                    self.segment_path(self.root, self.run_id, iteration), "ab"
+                )
+            line = self._line_counts.get(iteration, 0)
+            self._line_counts[iteration] = line + 1
+            if isinstance(raw_line, str):
+                raw_line = raw_line.encode("utf-8", "surrogatepass")
+            segment.write(raw_line.rstrip(b"\n") + b"\n")
 
-            if block_type == "text":
-                text = block.get("text", "")
-                if text and text not in state.get("seen_text", set()):
-                    state.setdefault("seen_text", set()).add(text)
-                    state["accumulated_text"] = state.get("accumulated_text", "") + text
+            self._pending.extend(self._index_rows(iteration, line, ts if ts is not None else time.time(), event, raw_line))
+            if len(self._pending) >= self.BATCH_SIZE:
+                self._flush()
 
-                    # Check for completion markers
-                    accumulated = state["accumulated_text"]
-                    if "RALPH_COMPLETE" in accumulated or "<promise>COMPLETE</promise>" in accumulated:
-                        state["complete"] = True
+    def _index_rows(self, iteration: int, line: int, ts: float, event: Optional[StreamEvent], raw_line: bytes):
+        limit = self.SUMMARY_CHARS
+        base = (self.run_id, iteration, line, ts)
+        if event is None:
+            yield (*base, "non_json", "non_json", None, None, 0, as_text(raw_line).strip()[:limit])
+            return
 
-                    print(colorize(text, Colors.WHITE))
-                    sys.stdout.flush()
+        tool_names = self._tool_names.setdefault(iteration, {})
+        if isinstance(event, MessageEvent) and event.blocks:
+            for block in event.blocks:
+                if isinstance(block, ToolUseBlock):
+                    tool_names[block.id] = block.name
+                    summary = summarize_tool_input(block.input, max_len=limit)
+                    yield (*base, event.type, block.type, block.name, block.id, 0, summary)
+                elif isinstance(block, ToolResultBlock):
+                    yield (*base, event.type, block.type, tool_names.get(block.tool_use_id), block.tool_use_id,
+                           int(block.is_error), block.content[:limit])
+                elif isinstance(block, TextBlock):
+                    yield (*base, event.type, block.type, None, None, 0, block.text[:limit])
+                else:
+                    yield (*base, event.type, block.type, None, None, 0, "")
+        elif isinstance(event, ErrorEvent):
+            yield (*base, event.type, event.type, None, None, 1, event.message[:limit])
+        elif isinstance(event, ResultEvent):
+            stats = {
+                "cost_usd": event.cost_usd,
+                "duration_ms": event.duration_ms,
+                "total_input_tokens": event.tokens_in,
+                "total_output_tokens": event.tokens_out,
+                "num_turns": event.num_turns,
+            }
+            yield (*base, event.type, event.type, None, None, int(event.is_error), json.dumps(stats))
+        elif isinstance(event, SystemEvent):
+            yield (*base, event.type, event.type, None, None, 0, event.subtype)
+        else:
+            yield (*base, event.type, event.type, None, None, 0, "")
 
-            elif block_type == "tool_use":
-                tool_name = block.get("name", "unknown")
-                tool_input = block.get("input", {})
-                tool_id = block.get("id", "")
+    def _flush(self) -> None:
+        if self._pending:
+            self.db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending.clear()
+        self.db.commit()
 
-                if tool_id and tool_id not in state.get("seen_tools", set()):
-                    state.setdefault("seen_tools", set()).add(tool_id)
-                    print()
-                    print_tool_call(tool_name, tool_input)
-                    # Log tool call to activity log
-                    if activity_log:
-                        activity_log.add_tool_call(iteration, tool_name, tool_input)
-                    sys.stdout.flush()
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            self._flush()
+            self.db.close()
 
-    elif event_type == "user":
-        message = data.get("message", {})
-        content = message.get("content", [])
 
-        for block in content:
-            if block.get("type") == "tool_result":
-                tool_id = block.get("tool_use_id", "")
-                result_content = block.get("content", "")
-                is_error = block.get("is_error", False)
-
-                if tool_id and tool_id not in state.get("seen_results", set()):
-                    state.setdefault("seen_results", set()).add(tool_id)
-                    if is_error:
-                        truncated = result_content[:100] + "..." if len(result_content) > 100 else result_content
-                        print(colorize(f"     ❌ {truncated}", Colors.RED))
-                        # Log error to activity log
-                        if activity_log:
-                            activity_log.add_error(iteration, truncated)
-                    elif debug:
-                        truncated = result_content[:80] + "..." if len(result_content) > 80 else result_content
-                        print(colorize(f"     ✓ {truncated}", Colors.DIM))
-                    sys.stdout.flush()
-
-    elif event_type == "result":
-        cost = data.get("cost_usd")
-        duration = data.get("duration_ms")
-        tokens_in = data.get("total_input_tokens")
-        tokens_out = data.get("total_output_tokens")
+DEFAULT_RECORD_DIR = ".ralph/recordings"
 
-        print()
-        stats = []
-        if cost is not None:
-            stats.append(f"💰 ${cost:.4f}")
-            state["total_cost"] = state.get("total_cost", 0) + cost
-        if duration is not None:
-            stats.append(f"⏱️  {duration/1000:.1f}s")
-            state["total_duration"] = state.get("total_duration", 0) + duration
-        if tokens_in is not None and tokens_out is not None:
-            stats.append(f"📊 {tokens_in}→{tokens_out} tokens")
-            state["total_tokens_in"] = state.get("total_tokens_in", 0) + tokens_in
-            state["total_tokens_out"] = state.get("total_tokens_out", 0) + tokens_out
-
-        # Log stats to activity log
+
+class StreamRecorder:
+    """Saves Claude's exact stdout per iteration, for replay with fake_claude.py.
+
+    `<root>/<run>/iter-0001.jsonl` receives the raw bytes as read from the pipe
+    (so oversized lines are kept whole), and `iter-0001.times` the arrival time
+    of each line in seconds since Claude started, for real-time replay.
+    """
+
+    def __init__(self, root: Path, run_id: str):
+        self.run_dir = root / run_id
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # iteration -> (raw stream file, times file)
+        self._files: Dict[int, tuple] = {}
+
+    def begin_iteration(self, iteration: int) -> None:
+        with self._lock:
+            self._files[iteration] = (
+                open(self.run_dir / f"iter-{iteration:04d}.jsonl", "wb"),
+                open(self.run_dir / f"iter-{iteration:04d}.times", "w"),
+            )
+
+    def record(self, iteration: int, chunk: bytes, offset: float) -> None:
+        """Save a chunk read `offset` seconds after Claude started."""
+        with self._lock:
+            files = self._files.get(iteration)
+            if files is None:
+                return
+            stream, times = files
+            stream.write(chunk)
+            lines = chunk.count(b"\n")
+            if lines:
+                times.write(f"{offset:.3f}\n" * lines)
+
+    def end_iteration(self, iteration: int) -> None:
+        with self._lock:
+            for f in self._files.pop(iteration, ()):
+                f.close()
+
+
+DEFAULT_CHECKPOINT = ".ralph/checkpoint.json"
+
+
+class Checkpoint:
+    """Loop state (counters, accumulated stats, next iteration) for `--resume`.
+
+    Saved atomically (temp file, fsync, rename) after every iteration. As an
+    ActivityLog listener it also records iterations when they start, so one
+    that was running when the runner died is found in `running` on resume.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, data: Optional[dict] = None):
+        self.path = path
+        self.data: dict = data or {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path: Path) -> "Checkpoint":
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            raise RuntimeError(f"No checkpoint at {path}")
+        except ValueError as e:
+            raise RuntimeError(f"Checkpoint {path} is not valid JSON: {e}")
+        if data.get("version") != cls.VERSION:
+            raise RuntimeError(f"Checkpoint {path} has unsupported version {data.get('version')!r}")
+        return cls(path, data)
+
+    def save(self, **fields) -> None:
+        with self._lock:
+            self.data.update(fields)
+            self.data["version"] = self.VERSION
+            self.data["updated"] = datetime.now().isoformat()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def add_iteration_start(self, iteration: int, total: int) -> None:
+        with self._lock:
+            self.save(running=sorted(set(self.data.get("running", [])) | {iteration}))
+
+    def iteration_done(self, iteration: int, **fields) -> None:
+        """Save the state after `iteration` has been counted."""
+        with self._lock:
+            running = [n for n in self.data.get("running", []) if n != iteration]
+            next_iteration = max(self.data.get("next_iteration", 1), iteration + 1)
+            self.save(running=running, next_iteration=next_iteration, **fields)
+
+
+PRD_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+PRD_CHECKBOX = re.compile(r"^(\s*)[-*+]\s+\[([ xX])\]\s+(.*\S)\s*$")
+# Heading numbers: "## 5. Database Schema", "### 11.2 Phase 1", "## Section 7: API Endpoints"
+PRD_SECTION_NUMBER = re.compile(r"^(?:Section\s+)?(\d+(?:\.\d+)*)\.?(?:[\s:]|$)", re.IGNORECASE)
+# References to other sections from a checklist item: "(see Section 5)", "§7.2", "[schema](#5-database-schema)"
+PRD_SECTION_REFERENCE = re.compile(r"(?:\bSection\s+|§\s*)(\d+(?:\.\d+)*)", re.IGNORECASE)
+PRD_ANCHOR_REFERENCE = re.compile(r"\]\(#([^)\s]+)\)")
+# Scheduling tags in checklist items: "- [ ] Board CRUD @id:boards @after:schema,auth @priority:2"
+PRD_TASK_TAG = re.compile(r"\s*@(id|after|priority):(\S+)")
+PROMPT_PLACEHOLDER = re.compile(r"\{\{\s*([a-z_]+)(?:\s+([^{}]*?))?\s*\}\}")
+PROMPT_PLACEHOLDERS = frozenset({"prd_path", "next_item", "item_path", "sections", "section", "progress"})
+# Appended to prompt files without placeholders when --prd is used
+PRD_TASK_BLOCK = """
+
+## Next Task (from {{prd_path}}, {{progress}})
+
+Work on this checklist item only. It was picked by the runner, so there is no need to
+read the whole PRD to find it; open other parts of the PRD only if the item needs them.
+
+Under: {{item_path}}
+
+{{next_item}}
+
+{{sections}}
+"""
+
+
+def markdown_slug(title: str) -> str:
+    """GitHub-style heading anchor: lowercase, punctuation dropped, spaces to dashes."""
+    return re.sub(r"[^\w\- ]", "", title.strip().lower()).replace(" ", "-")
+
+
+class PrdChecklist:
+    """A PRD markdown file parsed into numbered sections and `- [ ]` checklist items."""
+
+    def __init__(self, text: str):
+        self.lines = text.splitlines()
+        # Each section: level, title, number ("5", "11.2" or None), slug, start/end line (end exclusive)
+        self.sections: List[dict] = []
+        # Each item: line, checked, text (the item and its indented sub-lines), path (enclosing sections),
+        # title (first line without tags), id, after (ids it depends on), priority, children (sub-item ids)
+        self.items: List[dict] = []
+
+        self._ids: Counter = Counter()
+        stack: List[dict] = []
+        # Enclosing items of the current line, as (indent, item)
+        parents: List[Tuple[int, dict]] = []
+        in_fence = False
+        for index, line in enumerate(self.lines):
+            if line.lstrip().startswith(("```", "~~~")):
+                in_fence = not in_fence
+                continue
+            if in_fence:
+                continue
+            heading = PRD_HEADING.match(line)
+            if heading:
+                level = len(heading.group(1))
+                while stack and stack[-1]["level"] >= level:
+                    stack.pop()["end"] = index
+                title = heading.group(2)
+                number = PRD_SECTION_NUMBER.match(title)
+                section = {
+                    "level": level,
+                    "title": title,
+                    "number": number.group(1) if number else None,
+                    "slug": markdown_slug(title),
+                    "start": index,
+                    "end": len(self.lines),
+                }
+                self.sections.append(section)
+                stack.append(section)
+                parents.clear()
+                continue
+            checkbox = PRD_CHECKBOX.match(line)
+            if checkbox:
+                indent = len(checkbox.group(1))
+                tags: Dict[str, str] = {}
+                for name, value in PRD_TASK_TAG.findall(checkbox.group(3)):
+                    tags[name] = value
+                title = PRD_TASK_TAG.sub("", checkbox.group(3)).strip()
+                try:
+                    priority = int(tags.get("priority", 0))
+                except ValueError:
+                    priority = 0
+                item = {
+                    "line": index,
+                    "checked": checkbox.group(2) != " ",
+                    "text": self._item_block(index, indent),
+                    "path": list(stack),
+                    "title": title,
+                    "id": self._unique_id(tags.get("id") or markdown_slug(title)[:80]),
+                    "after": [ref for ref in tags.get("after", "").split(",") if ref],
+                    "priority": priority,
+                    "children": [],
+                }
+                while parents and parents[-1][0] >= indent:
+                    parents.pop()
+                if parents:
+                    parents[-1][1]["children"].append(item["id"])
+                parents.append((indent, item))
+                self.items.append(item)
+
+    def _unique_id(self, item_id: str) -> str:
+        self._ids[item_id] += 1
+        return item_id if self._ids[item_id] == 1 else f"{item_id}-{self._ids[item_id]}"
+
+    def _item_block(self, index: int, indent: int) -> str:
+        """The item line plus the more-indented lines (notes, sub-items) that follow it."""
+        end = index + 1
+        while end < len(self.lines):
+            line = self.lines[end]
+            if line.strip() and len(line) - len(line.lstrip()) <= indent:
+                break
+            end += 1
+        while end > index + 1 and not self.lines[end - 1].strip():
+            end -= 1
+        return "\n".join(line[indent:] for line in self.lines[index:end])
+
+    def in_scope(self, item: dict, scope: Optional[str]) -> bool:
+        return not scope or any(scope.lower() in section["title"].lower() for section in item["path"])
+
+    def next_item(self, scope: Optional[str] = None, skip: Sequence[str] = ()) -> Optional[dict]:
+        """The first unchecked item under a heading containing `scope`, other than those in `skip`."""
+        for item in self.items:
+            if not item["checked"] and item["text"] not in skip and self.in_scope(item, scope):
+                return item
+        return None
+
+    def progress(self, scope: Optional[str] = None) -> Tuple[int, int]:
+        """(checked, total) items in scope."""
+        items = [item for item in self.items if self.in_scope(item, scope)]
+        return sum(item["checked"] for item in items), len(items)
+
+    def section(self, reference: str) -> Optional[dict]:
+        """A section by number ("5", "7.2") or anchor slug."""
+        reference = reference.strip().lstrip("#").lower()
+        for section in self.sections:
+            if section["number"] == reference or section["slug"] == reference:
+                return section
+        return None
+
+    def section_text(self, section: dict) -> str:
+        return "\n".join(self.lines[section["start"]:section["end"]]).strip()
+
+    def referenced_sections(self, item: dict) -> List[dict]:
+        """Sections the item points to, without the ones it is itself in."""
+        references = PRD_SECTION_REFERENCE.findall(item["text"]) + PRD_ANCHOR_REFERENCE.findall(item["text"])
+        found = []
+        for reference in references:
+            section = self.section(reference)
+            if section and section not in found and not any(section is parent for parent in item["path"]):
+                found.append(section)
+        return found
+
+
+DEFAULT_TASK_LEDGER = ".ralph/tasks.jsonl"
+DEFAULT_TASK_ATTEMPTS = 3
+DEFAULT_TASK_BACKOFF_SECONDS = 30.0
+MAX_TASK_BACKOFF_SECONDS = 3600.0
+# How often a parallel iteration checks again while the only remaining tasks are running or waiting on them
+TASK_POLL_SECONDS = 1.0
+
+
+class Task:
+    """A PRD checklist item as a schedulable unit of work."""
+
+    __slots__ = ("id", "title", "after", "priority", "order", "in_scope", "state", "attempts", "not_before", "started")
+
+    def __init__(self, item: dict, order: int, in_scope: bool):
+        self.id = item["id"]
+        self.title = item["title"]
+        self.after = item["after"] + item["children"]
+        self.priority = item["priority"]
+        self.order = order
+        self.in_scope = in_scope
+        self.state = "done" if item["checked"] else "pending"
+        self.attempts = 0
+        self.not_before = 0.0
+        self.started = 0.0
+
+
+class TaskScheduler:
+    """Hands out PRD checklist items as tasks and retries the ones that fail.
+
+    Task states are pending, running, done and failed. A pending task is ready
+    once the tasks it depends on are done: those named with `@after:id,...`
+    and its own sub-items. Ready tasks go out by `@priority:N` (higher first),
+    then PRD order. An iteration that ends without the item checked in the PRD
+    counts as a failed attempt; the task is retried after an exponential
+    backoff, up to `max_attempts` attempts, then marked failed. Every start and
+    outcome is appended to a JSONL ledger.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_TASK_ATTEMPTS,
+        backoff: float = DEFAULT_TASK_BACKOFF_SECONDS,
+        ledger: Optional[Path] = None,
+        run_id: Optional[str] = None,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.ledger = ledger
+        self.run_id = run_id
+        self.tasks: Dict[str, Task] = {}
+        # Task id each running iteration is working on
+        self.running: Dict[int, str] = {}
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+
+    def sync(self, prd: PrdChecklist, scope: Optional[str] = None) -> None:
+        """Add new checklist items as tasks and mark checked ones done."""
+        for order, item in enumerate(prd.items):
+            task = self.tasks.get(item["id"])
+            if task is None:
+                self.tasks[item["id"]] = Task(item, order, prd.in_scope(item, scope))
+                continue
+            task.order = order
+            task.after = item["after"] + item["children"]
+            task.priority = item["priority"]
+            if item["checked"] and task.state == "pending":
+                task.state = "done"
+            elif not item["checked"] and task.state == "done":
+                # Unchecked again by hand
+                task.state = "pending"
+
+    def _blocked(self, task: Task) -> bool:
+        """A dependency failed, so the task can never become ready."""
+        return any(self.tasks[dep].state == "failed" for dep in task.after if dep in self.tasks)
+
+    def _ready(self, task: Task) -> bool:
+        return all(self.tasks[dep].state == "done" for dep in task.after if dep in self.tasks)
+
+    def claim(self, iteration: int) -> Tuple[Optional[Task], Optional[float]]:
+        """The next ready task, now running for `iteration`.
+
+        Returns (None, seconds) when the remaining tasks are backing off, or are
+        running in other iterations (or waiting on those), and (None, None) when
+        no task can run any more.
+        """
+        # A prompt built again for the same iteration gets a fresh pick
+        self.abandon(iteration)
+        now = time.monotonic()
+        candidates = [
+            task for task in self.tasks.values()
+            if task.in_scope and task.state == "pending" and self._ready(task)
+        ]
+        if not candidates:
+            # A running task may still fail and need a retry, or unblock its dependents
+            return None, (TASK_POLL_SECONDS if self.running else None)
+        candidates.sort(key=lambda task: (-task.priority, task.order))
+        for task in candidates:
+            if task.not_before <= now:
+                task.state = "running"
+                task.started = now
+                self.running[iteration] = task.id
+                self._record(iteration, task, "started")
+                return task, None
+        return None, min(task.not_before for task in candidates) - now
+
+    def finish(self, iteration: int, prd: PrdChecklist, throttled: bool = False) -> Optional[str]:
+        """Settle the task `iteration` worked on against the PRD; returns a description of the outcome.
+
+        A `throttled` iteration (rate limited, see LaunchLimiter) that didn't check
+        its task off puts it back without counting an attempt.
+        """
+        task_id = self.running.pop(iteration, None)
+        task = self.tasks.get(task_id) if task_id else None
+        if task is None:
+            return None
+        item = next((item for item in prd.items if item["id"] == task.id), None)
+        elapsed = time.monotonic() - task.started
+        if throttled and item is not None and not item["checked"]:
+            task.state = "pending"
+            self._record(iteration, task, "throttled", elapsed=elapsed)
+            return f"Task `{task.title}` hit a rate limit, back in the queue (attempt not counted)"
+        task.attempts += 1
+        if item is None or item["checked"]:
+            task.state = "done"
+            self.done += 1
+            self._record(iteration, task, "done", elapsed=elapsed)
+            return f"Task `{task.title}` done (attempt {task.attempts})"
+        if task.attempts >= self.max_attempts:
+            task.state = "failed"
+            self.failed += 1
+            self._record(iteration, task, "failed", elapsed=elapsed)
+            return f"Task `{task.title}` still unchecked after {task.attempts} attempts, giving up on it"
+        backoff = min(self.backoff * 2 ** (task.attempts - 1), MAX_TASK_BACKOFF_SECONDS)
+        task.state = "pending"
+        task.not_before = time.monotonic() + backoff
+        self.retries += 1
+        self._record(iteration, task, "retry", elapsed=elapsed, backoff=backoff)
+        return f"Task `{task.title}` still unchecked, retrying in {backoff:g}s (attempt {task.attempts}/{self.max_attempts})"
+
+    def abandon(self, iteration: int) -> None:
+        """Put back the task of an iteration that never ran (e.g. stopped by budget)."""
+        task_id = self.running.pop(iteration, None)
+        if task_id:
+            self.tasks[task_id].state = "pending"
+
+    def all_done(self) -> bool:
+        return all(task.state == "done" for task in self.tasks.values() if task.in_scope)
+
+    def summary(self) -> str:
+        """Why nothing can run any more, e.g. "2 failed, 1 blocked"."""
+        in_scope = [task for task in self.tasks.values() if task.in_scope]
+        failed = sum(task.state == "failed" for task in in_scope)
+        blocked = sum(task.state == "pending" and self._blocked(task) for task in in_scope)
+        waiting = sum(task.state == "pending" and not self._blocked(task) for task in in_scope)
+        parts = [f"{sum(task.state == 'done' for task in in_scope)} done"]
+        if failed:
+            parts.append(f"{failed} failed")
+        if blocked:
+            parts.append(f"{blocked} blocked by failed tasks")
+        if waiting:
+            parts.append(f"{waiting} waiting on unknown or out-of-scope dependencies")
+        return ", ".join(parts)
+
+    def _record(self, iteration: int, task: Task, event: str, **fields) -> None:
+        if not self.ledger:
+            return
+        record = {
+            "ts": datetime.now().isoformat(),
+            "run_id": self.run_id,
+            "iteration": iteration,
+            "task": task.id,
+            "title": task.title,
+            "event": event,
+            "attempt": task.attempts if event != "started" else task.attempts + 1,
+        }
+        record.update({key: round(value, 3) for key, value in fields.items()})
+        self.ledger.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.ledger, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def restore(self) -> None:
+        """Carry over attempts and failures of this run from the ledger (see --resume)."""
+        if not self.ledger or not self.ledger.exists():
+            return
+        with open(self.ledger) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                task = self.tasks.get(record.get("task"))
+                if record.get("run_id") != self.run_id or task is None:
+                    continue
+                if record["event"] in ("retry", "failed"):
+                    task.attempts = record["attempt"]
+                    self.retries += record["event"] == "retry"
+                if record["event"] == "failed" and task.state == "pending":
+                    task.state = "failed"
+                    self.failed += 1
+                elif record["event"] == "done":
+                    self.done += 1
+
+
+class PrdPromptBuilder:
+    """Builds each iteration's prompt from a template and the PRD's next unchecked item.
+
+    Instead of every iteration re-reading the whole PRD to find its task, the
+    runner parses the checklist and fills the template's placeholders with the
+    next item and the sections it references:
+
+        {{prd_path}}    path of the PRD
+        {{next_item}}   the item, with its indented notes and sub-items
+        {{item_path}}   the headings the item is under
+        {{sections}}    the sections the item references ("Section 5", "§7.2", "](#anchor)")
+        {{section N}}   a fixed section by number or anchor, e.g. {{section 3}}
+        {{progress}}    "12/40 items done"
+
+    A template without placeholders gets PRD_TASK_BLOCK appended. The parsed
+    PRD is cached and only re-parsed when its mtime/size and content hash change.
+    Which item comes next, and retries of failed ones, is up to a TaskScheduler;
+    parallel iterations each get a different item.
+    """
+
+    def __init__(
+        self,
+        template: str,
+        prd_path: Path,
+        scope: Optional[str] = None,
+        display_path: Optional[str] = None,
+        scheduler: Optional[TaskScheduler] = None,
+    ):
+        for match in PROMPT_PLACEHOLDER.finditer(template):
+            if match.group(1) not in PROMPT_PLACEHOLDERS:
+                raise ValueError(f"Unknown prompt placeholder {match.group(0)} (known: {', '.join(sorted(PROMPT_PLACEHOLDERS))})")
+        if not PROMPT_PLACEHOLDER.search(template):
+            template = template.rstrip() + PRD_TASK_BLOCK
+        self.template = template
+        self.prd_path = prd_path
+        self.display_path = display_path or str(prd_path)
+        self.scope = scope
+        self.scheduler = scheduler or TaskScheduler()
+        # Set once build() found no task that can run
+        self.exhausted = False
+        self.parses = 0
+        # Seconds build() spent waiting for a task to come out of backoff
+        self.waited = 0.0
+        self._stat: Optional[Tuple[int, int]] = None
+        self._digest: Optional[str] = None
+        self._prd: Optional[PrdChecklist] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> PrdChecklist:
+        """The parsed PRD, re-read only when the file changed."""
+        stat = self.prd_path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._prd is not None and key == self._stat:
+            return self._prd
+        data = self.prd_path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if self._prd is None or digest != self._digest:
+            self._prd = PrdChecklist(data.decode("utf-8", errors="replace"))
+            self._digest = digest
+            self.parses += 1
+        self._stat = key
+        return self._prd
+
+    def build(self, iteration: int) -> Optional[Tuple[str, Optional[str]]]:
+        """The prompt for `iteration` and the title of the checklist item it was given.
+
+        Waits while every remaining task is backing off after a failure, and
+        returns None once no task can run any more.
+        """
+        waiting = False
+        while True:
+            with self._lock:
+                prd = self.load()
+                self.scheduler.sync(prd, self.scope)
+                task, wait = self.scheduler.claim(iteration)
+                done, total = prd.progress(self.scope)
+            if task or wait is None:
+                break
+            if not waiting:
+                print(colorize(f"  ⏳ Iteration {iteration}: no PRD task ready yet (retry backoff or running tasks), waiting", Colors.DIM))
+                waiting = True
+            time.sleep(wait)
+            self.waited += wait
+        if task is None:
+            self.exhausted = True
+            return None
+        item = next(item for item in prd.items if item["id"] == task.id)
+
+        def fill(match: "re.Match") -> str:
+            name, argument = match.group(1), match.group(2)
+            if name == "prd_path":
+                return self.display_path
+            if name == "progress":
+                return f"{done}/{total} items done"
+            if name == "section":
+                section = prd.section(argument or "")
+                return prd.section_text(section) if section else match.group(0)
+            if name == "next_item":
+                return item["text"]
+            if name == "item_path":
+                return " > ".join(section["title"] for section in item["path"]) or "(top level)"
+            sections = prd.referenced_sections(item)
+            if not sections:
+                return ""
+            return "Referenced sections of the PRD:\n\n" + "\n\n".join(prd.section_text(section) for section in sections)
+
+        return PROMPT_PLACEHOLDER.sub(fill, self.template), task.title
+
+    def prefetch(self) -> None:
+        """Re-parse the PRD now if it changed, so the next finish() and build() find it cached."""
+        with self._lock:
+            self.load()
+
+    def finish(self, iteration: int, throttled: bool = False) -> Optional[str]:
+        """Settle `iteration`'s task once its work is merged (or it failed); see TaskScheduler.finish."""
+        with self._lock:
+            return self.scheduler.finish(iteration, self.load(), throttled)
+
+    def abandon(self, iteration: int) -> None:
+        with self._lock:
+            self.scheduler.abandon(iteration)
+
+
+class BudgetGovernor:
+    """Cost, token and wall-clock budgets shared by every iteration of a run.
+
+    Finished iterations are settled with the totals from their `result` event.
+    Running iterations report live token usage from assistant messages as they
+    stream; until their result arrives, their cost is estimated at the run's
+    average cost per token so far. `exceeded()` is checked while iterations
+    stream, and `admit()` before a new one starts. In predictive mode, admit()
+    also declines an iteration that would probably overrun the budget, using the
+    average of the last few finished iterations.
+    """
+
+    # Finished iterations used for the predictive average
+    WINDOW = 5
+
+    def __init__(
+        self,
+        max_cost: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_duration: Optional[float] = None,
+        predictive: bool = False,
+    ):
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.max_duration = max_duration
+        self.predictive = predictive
+        self.started = time.monotonic()
+        self.cost = 0.0
+        self.tokens = 0
+        # iteration -> live token count of iterations still running
+        self.live: Dict[int, int] = {}
+        self.recent: deque = deque(maxlen=self.WINDOW)
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return any(limit is not None for limit in (self.max_cost, self.max_tokens, self.max_duration))
+
+    def restore(self, cost: float, tokens: int, elapsed: float) -> None:
+        """Carry over what a previous runner already spent (see --resume)."""
+        with self._lock:
+            self.cost = cost
+            self.tokens = tokens
+            self.started = time.monotonic() - elapsed
+
+    def used_fraction(self) -> Optional[Tuple[float, str]]:
+        """The largest share of any limit spent so far, and which limit it is."""
+        with self._lock:
+            cost, tokens = self._spent()
+            elapsed = time.monotonic() - self.started
+        shares = []
+        if self.max_cost is not None:
+            shares.append((cost / self.max_cost, f"${self.max_cost:g} cost"))
+        if self.max_tokens is not None:
+            shares.append((tokens / self.max_tokens, f"{self.max_tokens:,} token"))
+        if self.max_duration is not None:
+            shares.append((elapsed / self.max_duration, f"{self.max_duration / 60:g} min duration"))
+        return max(shares) if shares else None
+
+    def remaining_seconds(self) -> Optional[float]:
+        if self.max_duration is None:
+            return None
+        return self.started + self.max_duration - time.monotonic()
+
+    def _cost_per_token(self) -> float:
+        return self.cost / self.tokens if self.tokens else 0.0
+
+    def _spent(self) -> Tuple[float, int]:
+        live_tokens = sum(self.live.values())
+        return self.cost + live_tokens * self._cost_per_token(), self.tokens + live_tokens
+
+    def _check(self, cost: float, tokens: int, elapsed: float) -> Optional[str]:
+        if self.max_cost is not None and cost >= self.max_cost:
+            return f"cost ${cost:.4f} reached --max-cost ${self.max_cost:.4f}"
+        if self.max_tokens is not None and tokens >= self.max_tokens:
+            return f"{tokens:,} tokens reached --max-tokens {self.max_tokens:,}"
+        if self.max_duration is not None and elapsed >= self.max_duration:
+            return f"run time {elapsed / 60:.1f} min reached --max-duration {self.max_duration / 60:.1f} min"
+        return None
+
+    def iteration_started(self, iteration: int) -> None:
+        with self._lock:
+            self.live[iteration] = 0
+
+    def update(self, iteration: int, live_tokens: int) -> Optional[str]:
+        """Record a running iteration's token usage; returns why the budget is exhausted, if it is."""
+        with self._lock:
+            if iteration in self.live:
+                self.live[iteration] = live_tokens
+            return self._check(*self._spent(), time.monotonic() - self.started)
+
+    def exceeded(self) -> Optional[str]:
+        with self._lock:
+            return self._check(*self._spent(), time.monotonic() - self.started)
+
+    def settle(self, iteration: int, cost: Optional[float], tokens: int, duration: float) -> None:
+        """Replace an iteration's live usage with its final totals.
+
+        `cost` is None when the iteration ended without a result event; its live
+        tokens are then charged at the average cost per token.
+        """
+        with self._lock:
+            self.live.pop(iteration, None)
+            if cost is None:
+                cost = tokens * self._cost_per_token()
+            self.cost += cost
+            self.tokens += tokens
+            self.recent.append((cost, tokens, duration))
+
+    def admit(self) -> Optional[str]:
+        """Returns why a new iteration should not start, or None to go ahead."""
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            cost, tokens = self._spent()
+            reason = self._check(cost, tokens, elapsed)
+            if reason or not self.predictive or not self.recent:
+                return reason
+
+            # The new iteration, plus those still running, at the recent average
+            count = len(self.recent)
+            avg_cost = sum(r[0] for r in self.recent) / count
+            avg_tokens = sum(r[1] for r in self.recent) / count
+            avg_duration = sum(r[2] for r in self.recent) / count
+            upcoming = len(self.live) + 1
+            projected = self._check(
+                self.cost + avg_cost * upcoming,
+                int(self.tokens + avg_tokens * upcoming),
+                elapsed + avg_duration,
+            )
+            if projected:
+                return f"another iteration would probably exceed the budget (projected {projected})"
+            return None
+
+
+# How an iteration's errors bear on the next launch (see classify_error)
+ERROR_THROTTLE = "throttle"  # rate limited or overloaded: retry later, launch less
+ERROR_FATAL = "fatal"  # retrying can't help (bad key, no credit, no CLI): stop the loop
+ERROR_OTHER = "error"  # anything else: the next iteration may well succeed
+ERROR_SEVERITY = {None: 0, ERROR_OTHER: 1, ERROR_THROTTLE: 2, ERROR_FATAL: 3}
+
+# Checked in order against error events, error results and non-JSON output; first match wins
+ERROR_PATTERNS = (
+    (ERROR_FATAL, re.compile(
+        r"authentication_error|permission_error|invalid[ _-]?(?:api|x-api)[ _-]?key|credit balance is too low"
+        r"|please run /login|OAuth token (?:has expired|revoked)",
+        re.IGNORECASE,
+    )),
+    (ERROR_THROTTLE, re.compile(
+        r"rate[ _-]?limit|overloaded|too many requests|usage limit reached|\b(?:429|529)\b"
+        r"|API Error: 50[234]\b",
+        re.IGNORECASE,
+    )),
+)
+# Exit codes of a CLI that can't run at all (not executable, not found)
+FATAL_EXIT_CODES = frozenset({126, 127})
+RETRY_AFTER = re.compile(r"retry[- _]after\W{0,3}(\d+(?:\.\d+)?)", re.IGNORECASE)
+# Claude subscription limits say when they reset: "Claude AI usage limit reached|1750000000"
+USAGE_LIMIT_RESET = re.compile(r"usage limit reached\|(\d{10})")
+
+
+def classify_error(message: str) -> Optional[str]:
+    """ERROR_THROTTLE or ERROR_FATAL for known error shapes, None for anything else."""
+    for kind, pattern in ERROR_PATTERNS:
+        if pattern.search(message):
+            return kind
+    return None
+
+
+def parse_retry_after(message: str) -> Optional[float]:
+    """Seconds an error message asks to wait before retrying, if it says."""
+    match = USAGE_LIMIT_RESET.search(message)
+    if match:
+        return max(int(match.group(1)) - time.time(), 0.0)
+    match = RETRY_AFTER.search(message)
+    return float(match.group(1)) if match else None
+
+
+def note_error(state: dict, message: str) -> None:
+    """Keep the most severe error class an iteration ran into, and any retry-after it named."""
+    kind = classify_error(message)
+    if kind is None:
+        return
+    if ERROR_SEVERITY[kind] > ERROR_SEVERITY[state.get("error_class")]:
+        state["error_class"] = kind
+        state["error_message"] = message[:500]
+    retry_after = parse_retry_after(message)
+    if retry_after is not None:
+        state["retry_after"] = max(state.get("retry_after", 0.0), retry_after)
+
+
+DEFAULT_THROTTLE_BACKOFF_SECONDS = 30.0
+MAX_THROTTLE_BACKOFF_SECONDS = 900.0
+# Launch rate (per minute) a throttle can halve --max-launch-rate down to
+MIN_LAUNCH_RATE = 0.5
+LIMITER_POLL_SECONDS = 1.0
+# Launches of runners on other hosts are forgotten after this long, in case they died
+LIMITER_LEASE_SECONDS = 24 * 3600.0
+
+
+class LaunchLimiter:
+    """Decides when the next Claude process may start, backing off on rate limits.
+
+    Two limits adapt AIMD-style (additive increase, multiplicative decrease) to
+    how iterations end: the number of Claude processes running at once, which
+    starts at `max_concurrent`, and with `rate`, a token bucket of launches per
+    minute. Every successful iteration raises them a little, up to their
+    configured values; every throttled one (see classify_error) halves both and
+    starts a cooldown in which nothing launches: the retry-after the error named,
+    or `backoff` doubling with each consecutive throttle.
+
+    With `state_path`, the state lives in a JSON file locked with flock(), so
+    every runner pointed at the same file (other terminals, or other hosts on a
+    shared filesystem) draws on one budget. Launches held by processes that
+    died are reclaimed.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        rate: Optional[float] = None,
+        backoff: float = DEFAULT_THROTTLE_BACKOFF_SECONDS,
+        state_path: Optional[Path] = None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.backoff = backoff
+        self.state_path = state_path
+        self.host = socket.gethostname()
+        # iteration -> error class it ended with (None for clean ones)
+        self.outcomes: Dict[int, Optional[str]] = {}
+        self._state = self._initial_state()
+        self._lock = threading.Lock()
+
+    def _initial_state(self) -> dict:
+        return {
+            "limit": float(self.max_concurrent),
+            "rate": self.rate,
+            "tokens": float(self.max_concurrent),
+            "refilled": time.time(),
+            "cooldown_until": 0.0,
+            "consecutive_throttles": 0,
+            "in_flight": {},
+        }
+
+    def _update(self, change: Callable[[dict], object]):
+        """Apply `change` to the state, under the file lock when the state is shared."""
+        with self._lock:
+            if self.state_path is None:
+                return change(self._state)
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = {**self._initial_state(), **json.loads(f.read() or "{}")}
+                    except ValueError:
+                        state = self._initial_state()
+                    result = change(state)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _holder(self, iteration: int) -> str:
+        return f"{self.host}:{os.getpid()}:{iteration}"
+
+    def _reclaim(self, state: dict, now: float) -> None:
+        for holder, since in list(state["in_flight"].items()):
+            host, pid, _ = holder.rsplit(":", 2)
+            if host == self.host:
+                try:
+                    os.kill(int(pid), 0)
+                    continue
+                except ProcessLookupError:
+                    pass
+                except (PermissionError, ValueError):
+                    continue
+            elif now - since < LIMITER_LEASE_SECONDS:
+                continue
+            del state["in_flight"][holder]
+
+    def try_acquire(self, iteration: int) -> Optional[Tuple[float, str]]:
+        """Take a launch for `iteration`, or return how long to wait and why."""
+        holder = self._holder(iteration)
+
+        def acquire(state: dict) -> Optional[Tuple[float, str]]:
+            now = time.time()
+            self._reclaim(state, now)
+            if now < state["cooldown_until"]:
+                return state["cooldown_until"] - now, f"rate limited, cooling down after {state['consecutive_throttles']} throttle(s) in a row"
+            allowed = max(1, min(int(state["limit"]), self.max_concurrent))
+            running = len(state["in_flight"])
+            if running >= allowed:
+                return LIMITER_POLL_SECONDS, f"{running}/{allowed} Claude processes running"
+            if self.rate is not None:
+                # The tightest configured rate of the runners sharing the state wins
+                rate = state["rate"] = min(state["rate"] or self.rate, self.rate)
+                state["tokens"] = min(float(self.max_concurrent), state["tokens"] + (now - state["refilled"]) * rate / 60)
+                state["refilled"] = now
+                if state["tokens"] < 1:
+                    return (1 - state["tokens"]) * 60 / rate, f"launch rate limited to {rate:.1f}/min"
+                state["tokens"] -= 1
+            state["in_flight"][holder] = now
+            return None
+
+        return self._update(acquire)
+
+    async def acquire(self, iteration: int, ui: Optional["HeadlessUI"] = None) -> float:
+        """Wait until `iteration` may launch Claude, reporting the first wait for each reason.
+
+        Returns the seconds waited.
+        """
+        started = time.monotonic()
+        reported = None
+        while True:
+            waiting = await asyncio.to_thread(self.try_acquire, iteration)
+            if waiting is None:
+                break
+            wait, reason = waiting
+            if reason != reported and wait >= LIMITER_POLL_SECONDS:
+                message = f"⏳ Iteration {iteration} waiting {wait:.0f}s to start: {reason}"
+                print(colorize(f"  {message}", Colors.YELLOW))
+                sys.stdout.flush()
+                if ui:
+                    ui.emit(f"ralph {message}")
+                reported = reason
+            await asyncio.sleep(min(wait, LIMITER_POLL_SECONDS * 10))
+        return time.monotonic() - started
+
+    def release(self, iteration: int, error_class: Optional[str], retry_after: Optional[float] = None) -> Optional[float]:
+        """Return `iteration`'s launch and adapt to how it ended; returns the cooldown a throttle started."""
+        holder = self._holder(iteration)
+        self.outcomes[iteration] = error_class
+
+        def release(state: dict) -> Optional[float]:
+            state["in_flight"].pop(holder, None)
+            if error_class == ERROR_THROTTLE:
+                state["consecutive_throttles"] += 1
+                state["limit"] = max(1.0, state["limit"] / 2)
+                if state["rate"]:
+                    state["rate"] = max(MIN_LAUNCH_RATE, state["rate"] / 2)
+                if retry_after is None:
+                    delay = min(self.backoff * 2 ** (state["consecutive_throttles"] - 1), MAX_THROTTLE_BACKOFF_SECONDS)
+                else:
+                    delay = retry_after
+                state["cooldown_until"] = max(state["cooldown_until"], time.time() + delay)
+                return delay
+            if error_class is None:
+                state["consecutive_throttles"] = 0
+                state["limit"] = min(float(self.max_concurrent), state["limit"] + 1 / state["limit"])
+                if self.rate is not None and state["rate"]:
+                    state["rate"] = min(self.rate, state["rate"] + 1)
+            return None
+
+        return self._update(release)
+
+
+# Options whose value is skipped when picking a command's prefix (`pnpm --filter api test` -> `pnpm test`)
+PREFIX_VALUE_OPTIONS = frozenset({"--filter", "-F", "-C", "--prefix", "--dir", "-w", "--workspace", "--cwd"})
+SHELL_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+
+
+def command_prefix(command: str) -> str:
+    """Group a shell command by program and subcommand, e.g. `npx prisma`, `pnpm test`, `git status`.
+
+    Leading `cd dir &&` and environment assignments are skipped, as are options
+    and arguments that look like paths.
+    """
+    command = re.sub(r"^\s*cd\s+\S+\s*&&\s*", "", command)
+    words = [word for word in command.split() if not SHELL_ASSIGNMENT.match(word)]
+    if not words:
+        return ""
+    prefix = [words[0].rsplit("/", 1)[-1]]
+    skip = False
+    for word in words[1:]:
+        if word in ("&&", "||", "|", ";"):
+            break
+        if skip:
+            skip = False
+            continue
+        if word.startswith("-"):
+            skip = word in PREFIX_VALUE_OPTIONS
+            continue
+        if "/" not in word and "." not in word:
+            prefix.append(word)
+        break
+    return " ".join(prefix)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ToolProfiler:
+    """Times each tool call, from its tool_use block to the matching tool_result.
+
+    Timestamps are monotonic and taken when the runner sees the events. The gaps
+    between tool calls (from iteration start or the last tool result to the next
+    tool call, and from the last result to the iteration's end) are recorded as
+    model think time. Registered as an ActivityLog listener, it learns about
+    iteration starts and ends from the log and adds a profile section to
+    activity.md when the run ends; `write_trace()` exports every span as Chrome
+    trace JSON (chrome://tracing, Perfetto or speedscope).
+    """
+
+    MODEL = "model (think)"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.origin_ns = time.monotonic_ns()
+        # (iteration, tool_use_id) -> (tool_name, command prefix, start_ns)
+        self.pending: Dict[Tuple[int, str], Tuple[str, str, int]] = {}
+        # iteration -> when it last had no tool running
+        self.idle_since: Dict[int, int] = {}
+        # (iteration, name, prefix, start_ns, end_ns, finished)
+        self.spans: List[Tuple[int, str, str, int, int, bool]] = []
+
+    def add_iteration_start(self, iteration: int, total: int) -> None:
+        with self._lock:
+            self.idle_since[iteration] = time.monotonic_ns()
+
+    def add_iteration_end(self, iteration: int, success: bool, complete: bool) -> None:
+        now = time.monotonic_ns()
+        with self._lock:
+            idle_since = self.idle_since.pop(iteration, None)
+            if idle_since is not None and not self._running(iteration):
+                self.spans.append((iteration, self.MODEL, "", idle_since, now, True))
+            # Tools still running when the iteration ended (e.g. stopped by a timeout)
+            for key in [key for key in self.pending if key[0] == iteration]:
+                name, prefix, start = self.pending.pop(key)
+                self.spans.append((iteration, name, prefix, start, now, False))
+
+    def _running(self, iteration: int) -> bool:
+        return any(key[0] == iteration for key in self.pending)
+
+    def tool_started(
+        self, iteration: int, tool_use_id: str, tool_name: str, tool_input: dict, at: Optional[int] = None
+    ) -> None:
+        """`at` is the time.monotonic_ns() the tool call arrived, if not now; likewise for tool_finished."""
+        now = at if at is not None else time.monotonic_ns()
+        prefix = command_prefix(tool_input["command"]) if isinstance(tool_input.get("command"), str) else ""
+        with self._lock:
+            if not self._running(iteration):
+                idle_since = self.idle_since.get(iteration)
+                if idle_since is not None:
+                    self.spans.append((iteration, self.MODEL, "", idle_since, now, True))
+            self.pending[(iteration, tool_use_id)] = (tool_name, prefix, now)
+
+    def tool_finished(self, iteration: int, tool_use_id: str, at: Optional[int] = None) -> None:
+        now = at if at is not None else time.monotonic_ns()
+        with self._lock:
+            started = self.pending.pop((iteration, tool_use_id), None)
+            if started is None:
+                return
+            name, prefix, start = started
+            self.spans.append((iteration, name, prefix, start, now, True))
+            if not self._running(iteration):
+                self.idle_since[iteration] = now
+
+    def stats(self) -> List[Tuple[str, int, float, float, float, float]]:
+        """Rows of (key, calls, p50, p95, max, total) in seconds, slowest total first.
+
+        Keys are tool names, `Tool: prefix` for shell commands, and the model think time.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        durations: Dict[str, List[float]] = {}
+        for _, name, prefix, start, end, _ in spans:
+            seconds = (end - start) / 1e9
+            durations.setdefault(name, []).append(seconds)
+            if prefix:
+                durations.setdefault(f"{name}: {prefix}", []).append(seconds)
+
+        rows = []
+        for key, values in durations.items():
+            values.sort()
+            rows.append((key, len(values), percentile(values, 0.5), percentile(values, 0.95), values[-1], sum(values)))
+        rows.sort(key=lambda row: row[5], reverse=True)
+        return rows
+
+    def render_activity_section(self) -> List[str]:
+        rows = self.stats()
+        if not rows:
+            return []
+        lines = [
+            "## Tool Profile",
+            "",
+            "Time from each tool call to its result, and model time between tool calls, across all iterations.",
+            "",
+            "| Tool | Calls | p50 | p95 | Max | Total |",
+            "|------|------:|----:|----:|----:|------:|",
+        ]
+        for key, calls, p50, p95, longest, total in rows:
+            lines.append(f"| `{key}` | {calls} | {p50:.2f}s | {p95:.2f}s | {longest:.2f}s | {total:.1f}s |")
+        lines.append("")
+        return lines
+
+    def trace(self) -> dict:
+        """All spans in the Chrome trace event format, one track per iteration."""
+        with self._lock:
+            spans = list(self.spans)
+        events = []
+        for iteration in sorted({span[0] for span in spans}):
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": iteration, "args": {"name": f"Iteration {iteration}"}})
+        for iteration, name, prefix, start, end, finished in spans:
+            events.append({
+                "name": f"{name}: {prefix}" if prefix else name,
+                "cat": "model" if name == self.MODEL else "tool",
+                "ph": "X",
+                "ts": (start - self.origin_ns) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": 1,
+                "tid": iteration,
+                "args": {"finished": finished},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.trace()))
+        os.replace(tmp_path, path)
+
+
+# Upper bounds (seconds) of the iteration duration histogram buckets
+ITERATION_DURATION_BUCKETS = (30, 60, 120, 300, 600, 900, 1800, 3600, 7200)
+
+
+def _openmetrics_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class LoopMetrics:
+    """In-process counters and histograms for the loop, rendered as OpenMetrics.
+
+    Registered as an ActivityLog listener, so it sees the same iteration, tool,
+    stats and error events that end up in activity.md; the iteration engine
+    additionally reports the latest stream event for the staleness gauge.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.last_event: Optional[float] = None
+        self.running: Dict[int, float] = {}
+        self.iterations: Counter = Counter()
+        self.tool_calls: Counter = Counter()
+        self.errors = 0
+        self.tokens: Counter = Counter()
+        self.cost = 0.0
+        self.duration_buckets = [0] * len(ITERATION_DURATION_BUCKETS)
+        self.duration_count = 0
+        self.duration_sum = 0.0
+
+    # ActivityLog listener methods
+
+    def add_iteration_start(self, iteration: int, total: int) -> None:
+        with self._lock:
+            self.running[iteration] = time.monotonic()
+
+    def add_iteration_end(self, iteration: int, success: bool, complete: bool) -> None:
+        with self._lock:
+            started = self.running.pop(iteration, None)
+            if started is None:
+                # Already counted
+                return
+            self.iterations["complete" if complete else "success" if success else "failed"] += 1
+            elapsed = time.monotonic() - started
+            self.duration_count += 1
+            self.duration_sum += elapsed
+            for i, bound in enumerate(ITERATION_DURATION_BUCKETS):
+                if elapsed <= bound:
+                    self.duration_buckets[i] += 1
+
+    def add_tool_call(self, iteration: int, tool_name: str, tool_input: dict) -> None:
+        with self._lock:
+            self.tool_calls[tool_name] += 1
+
+    def add_stats(self, iteration: int, cost: float, duration: float, tokens_in: int, tokens_out: int) -> None:
+        with self._lock:
+            self.cost += cost
+            self.tokens["in"] += tokens_in
+            self.tokens["out"] += tokens_out
+
+    def add_error(self, iteration: int, error_msg: str) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def stream_event(self, at: Optional[float] = None) -> None:
+        """Note that a stream-json event arrived, now or at the time.time() `at`."""
+        self.last_event = at if at is not None else time.time()
+
+    def render(self) -> str:
+        """The current values in the OpenMetrics text format."""
+        out: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, samples: Sequence[Tuple[str, Dict[str, str], float]]) -> None:
+            out.append(f"# TYPE {name} {kind}")
+            out.append(f"# HELP {name} {help_text}")
+            for suffix, labels, value in samples:
+                out.append(f"{name}{suffix}{_openmetrics_labels(labels)} {value}")
+
+        with self._lock:
+            now = time.time()
+            family("ralph_iterations", "counter", "Finished iterations by outcome.", [
+                ("_total", {"outcome": outcome}, self.iterations[outcome]) for outcome in ("success", "failed", "complete")
+            ])
+            family("ralph_iterations_running", "gauge", "Iterations currently running.", [("", {}, len(self.running))])
+            buckets = [("_bucket", {"le": f"{bound:.1f}"}, count) for bound, count in zip(ITERATION_DURATION_BUCKETS, self.duration_buckets)]
+            buckets.append(("_bucket", {"le": "+Inf"}, self.duration_count))
+            family("ralph_iteration_duration_seconds", "histogram", "Wall-clock duration of finished iterations.", buckets + [
+                ("_count", {}, self.duration_count),
+                ("_sum", {}, round(self.duration_sum, 3)),
+            ])
+            family("ralph_tool_calls", "counter", "Tool calls by tool name.", [
+                ("_total", {"tool_name": name}, count) for name, count in sorted(self.tool_calls.items())
+            ])
+            family("ralph_errors", "counter", "Errors recorded in the activity log.", [("_total", {}, self.errors)])
+            family("ralph_tokens", "counter", "Tokens used, by direction.", [
+                ("_total", {"direction": direction}, self.tokens[direction]) for direction in ("in", "out")
+            ])
+            family("ralph_cost_usd", "counter", "Cost in US dollars.", [("_total", {}, round(self.cost, 6))])
+            family("ralph_start_time_seconds", "gauge", "Unix time the runner started.", [("", {}, round(self.started, 3))])
+            if self.last_event is not None:
+                family("ralph_seconds_since_last_event", "gauge", "Seconds since the last stream-json event.", [
+                    ("", {}, round(now - self.last_event, 3))
+                ])
+
+        out.append("# EOF")
+        return "\n".join(out) + "\n"
+
+
+class MetricsServer:
+    """Serves LoopMetrics at http://HOST:PORT/metrics from a daemon thread."""
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    def __init__(self, metrics: LoopMetrics, port: int, host: str = "127.0.0.1"):
+        content_type = self.CONTENT_TYPE
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes would otherwise be logged to stderr, in the middle of the output
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ralph-metrics", daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def send_macos_notification(title: str, message: str, sound: str = "default") -> None:
+    """Send a macOS notification using osascript."""
+    try:
+        script = f'''
+        display notification "{message}" with title "{title}" sound name "{sound}"
+        '''
+        subprocess.run(
+            ["osascript", "-e", script],
+            capture_output=True,
+            timeout=5
+        )
+    except Exception:
+        # Silently fail if notification can't be sent
+        pass
+
+
+def send_desktop_notification(title: str, message: str, sound: str = "default") -> None:
+    """Send a freedesktop notification (Linux) using notify-send."""
+    try:
+        subprocess.run(
+            ["notify-send", "--app-name=Ralph", title, message],
+            capture_output=True,
+            timeout=5
+        )
+    except Exception:
+        pass
+
+
+class WebhookBackend:
+    """POSTs each notification as JSON to a URL (Slack-style `text` included)."""
+
+    TIMEOUT_SECONDS = 5
+
+    def __init__(self, url: str, run_id: Optional[str] = None):
+        self.url = url
+        self.run_id = run_id
+
+    def __call__(self, title: str, message: str, sound: str = "default", event: str = "info") -> None:
+        body = json.dumps({
+            "title": title,
+            "message": message,
+            "text": f"{title}: {message}",
+            "event": event,
+            "run_id": self.run_id,
+            "timestamp": datetime.now().isoformat(),
+        }).encode()
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.TIMEOUT_SECONDS) as response:
+            response.read()
+
+
+class FileBackend:
+    """Appends each notification as a JSON line to a file or FIFO.
+
+    A FIFO without a reader is skipped rather than waited on.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __call__(self, title: str, message: str, sound: str = "default", event: str = "info") -> None:
+        line = json.dumps({"event": event, "title": title, "message": message, "timestamp": datetime.now().isoformat()}) + "\n"
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NONBLOCK, 0o644)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return
+            raise
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+NOTIFY_BACKENDS = ("auto", "osascript", "notify-send", "none")
+
+
+def default_notify_backend() -> str:
+    """osascript on macOS, notify-send where it is installed, otherwise none."""
+    if sys.platform == "darwin":
+        return "osascript"
+    if shutil.which("notify-send"):
+        return "notify-send"
+    return "none"
+
+
+class Notifier:
+    """Delivers notifications from a background thread, so a slow or hanging
+    backend never blocks the loop or the Ctrl+C path.
+
+    Notifications are queued (and dropped if the queue is full) and sent to
+    every backend in turn; a failing backend is reported with --verbose only.
+    As an ActivityLog listener it also sends milestone notifications: every
+    `every` finished iterations, and once per threshold when the budget's
+    spent fraction crosses one of `budget_thresholds` (e.g. 0.8).
+    """
+
+    QUEUE_SIZE = 100
+
+    def __init__(
+        self,
+        backends: Sequence,
+        every: Optional[int] = None,
+        budget: Optional["BudgetGovernor"] = None,
+        budget_thresholds: Sequence[float] = (),
+        verbose: bool = False,
+    ):
+        self.backends = list(backends)
+        self.every = every
+        self.budget = budget
+        self.budget_thresholds = sorted(budget_thresholds)
+        self.verbose = verbose
+        self.sent = 0
+        self.dropped = 0
+        self.finished = 0
+        self._crossed: set = set()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(self.QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        if self.backends:
+            self._thread = threading.Thread(target=self._run, name="ralph-notifier", daemon=True)
+            self._thread.start()
+
+    def notify(self, title: str, message: str, sound: str = "default", event: str = "info") -> None:
+        """Queue a notification; never blocks."""
+        if not self._thread:
+            return
+        try:
+            self._queue.put_nowait((title, message, sound, event))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            title, message, sound, event = item
+            for backend in self.backends:
+                try:
+                    backend(title, message, sound, event=event)
+                except Exception as e:
+                    if self.verbose:
+                        print(colorize(f"  🔕 Notification via {getattr(backend, '__name__', type(backend).__name__)} failed: {e}", Colors.DIM))
+            self.sent += 1
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Send what is queued, waiting at most `timeout` seconds (the thread is a daemon)."""
+        if not self._thread:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    # ActivityLog listener methods (milestones)
+
+    def add_stats(self, iteration: int, cost: float, duration: float, tokens_in: int, tokens_out: int) -> None:
+        self.check_budget()
+
+    def add_iteration_end(self, iteration: int, success: bool, complete: bool) -> None:
+        with self._lock:
+            self.finished += 1
+            finished = self.finished
+        if self.every and finished % self.every == 0:
+            self.notify("Ralph Loop Progress", f"{finished} iterations finished (latest: {iteration})", event="milestone")
+        self.check_budget()
+
+    def check_budget(self) -> None:
+        """Notify about budget thresholds crossed since the last check."""
+        if not self.budget or not self.budget_thresholds:
+            return
+        used = self.budget.used_fraction()
+        if used is None:
+            return
+        fraction, limit = used
+        with self._lock:
+            crossed = [t for t in self.budget_thresholds if fraction >= t and t not in self._crossed]
+            self._crossed.update(crossed)
+        if crossed:
+            self.notify("Ralph Loop Budget", f"{max(crossed):.0%} of the {limit} budget used", event="budget")
+
+
+def colorize(text: str, *styles: str) -> str:
+    """Apply color/style codes to text."""
+    return "".join(styles) + text + Colors.RESET
+
+
+def print_header(iteration: int, total: int) -> None:
+    """Print a formatted iteration header."""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    header = f" Iteration {iteration}/{total} "
+    line = "═" * 60
+
+    print()
+    print(colorize(line, Colors.CYAN))
+    print(colorize(f"║{header:^58}║", Colors.CYAN, Colors.BOLD))
+    print(colorize(f"║{'Started at ' + timestamp:^58}║", Colors.CYAN))
+    print(colorize(line, Colors.CYAN))
+    print()
+
+
+def print_footer(iteration: int, success: bool) -> None:
+    """Print a formatted iteration footer."""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    status = "✓ Completed" if success else "✗ Failed"
+    color = Colors.GREEN if success else Colors.RED
+
+    print()
+    print(colorize(f"── End of iteration {iteration} at {timestamp} {status} ──", color, Colors.BOLD))
+    print()
+
+
+def print_tool_call(tool_name: str, tool_input: dict) -> None:
+    """Print a formatted tool call."""
+    print(colorize(f"  🔧 {tool_name}", Colors.YELLOW, Colors.BOLD))
+
+    # Show relevant parts of the input
+    if "command" in tool_input:
+        cmd = tool_input['command']
+        # Truncate long commands
+        if len(cmd) > 80:
+            cmd = cmd[:77] + "..."
+        print(colorize(f"     $ {cmd}", Colors.DIM))
+    elif "file_path" in tool_input:
+        print(colorize(f"     📄 {tool_input['file_path']}", Colors.DIM))
+    elif "path" in tool_input:
+        print(colorize(f"     📄 {tool_input['path']}", Colors.DIM))
+    elif "pattern" in tool_input:
+        print(colorize(f"     🔍 {tool_input['pattern']}", Colors.DIM))
+    elif "url" in tool_input:
+        print(colorize(f"     🌐 {tool_input['url']}", Colors.DIM))
+
+
+def print_tool_result(result: str, is_error: bool = False) -> None:
+    """Print a formatted tool result (truncated if long)."""
+    max_lines = 10
+    lines = result.split("\n")
+
+    if is_error:
+        print(colorize("     ❌ Error:", Colors.RED))
+        color = Colors.RED
+    else:
+        color = Colors.DIM
+
+    for i, line in enumerate(lines[:max_lines]):
+        truncated_line = line[:100] + "..." if len(line) > 100 else line
+        print(colorize(f"     {truncated_line}", color))
+
+    if len(lines) > max_lines:
+        print(colorize(f"     ... ({len(lines) - max_lines} more lines)", Colors.DIM))
+
+
+def print_assistant_text(text: str) -> None:
+    """Print assistant's text output."""
+    for line in text.split("\n"):
+        if line.strip():
+            print(colorize(f"  {line}", Colors.WHITE))
+        else:
+            print()
+
+
+UI_MODES = ("stream", "dashboard", "headless")
+# Redraws per second at most in --ui dashboard
+DASHBOARD_FPS = 8
+# Seconds of output tokens averaged for the tokens/sec figure
+TOKEN_RATE_WINDOW = 30.0
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+def format_elapsed(seconds: float) -> str:
+    """Compact elapsed time: 42s, 3m05s, 1h02m."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class HeadlessUI:
+    """`--ui headless`: one line per finished iteration, nothing else.
+
+    Installed as `sys.stdout`, it swallows the per-event output; the iteration
+    lines go straight to the real stream, which suits CI logs.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # iteration -> {"started", "tool", "tools", "errors", "tokens", "message_id"}
+        self.active: Dict[int, dict] = {}
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.cost = 0.0
+
+    # File-like interface used while installed as sys.stdout
+
+    def write(self, text: str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    # Hooks called by run_iteration_async / process_stream_json
+
+    def iteration_started(self, iteration: int, total: int) -> None:
+        with self._lock:
+            self.total = total
+            self.active[iteration] = {
+                "started": time.monotonic(), "tool": None, "tools": 0, "errors": 0, "message_id": None,
+            }
+
+    def on_event(self, iteration: int, event: StreamEvent) -> None:
+        with self._lock:
+            current = self.active.get(iteration)
+            if current is None:
+                return
+            if isinstance(event, MessageEvent):
+                for block in event.blocks:
+                    if isinstance(block, ToolUseBlock) and (current["tool"] or ("",))[0] != block.id:
+                        current["tool"] = (block.id, block.name, summarize_tool_input(block.input, 60), time.monotonic())
+                        current["tools"] += 1
+                    elif isinstance(block, ToolResultBlock):
+                        if current["tool"] and current["tool"][0] == block.tool_use_id:
+                            current["tool"] = None
+                        if block.is_error:
+                            current["errors"] += 1
+                if event.type == "assistant" and event.message_id != current["message_id"]:
+                    current["message_id"] = event.message_id
+                    self._count_tokens(event.usage.get("output_tokens") or 0)
+            elif isinstance(event, ResultEvent):
+                self.cost += event.cost_usd or 0
+            elif isinstance(event, ErrorEvent):
+                current["errors"] += 1
+
+    def _count_tokens(self, tokens: int) -> None:
+        pass
+
+    def iteration_finished(self, iteration: int, success: bool, complete: bool, state: dict) -> None:
+        with self._lock:
+            current = self.active.pop(iteration, None)
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if current is None:
+            return
+
+        status = "ok" if success else "FAILED"
+        if complete:
+            status += " complete"
+        line = (
+            f"ralph iteration {iteration}/{self.total} {status} "
+            f"wall={time.monotonic() - current['started']:.1f}s "
+            f"cost=${state.get('total_cost', 0):.4f} "
+            f"tokens={state.get('total_tokens_in', 0)}/{state.get('total_tokens_out', 0)} "
+            f"tools={current['tools']} errors={current['errors']}"
+        )
+        self.emit(line)
+
+    def emit(self, line: str) -> None:
+        """Write a status line past the output capture."""
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+class Dashboard(HeadlessUI):
+    """`--ui dashboard`: a fixed status area above the latest output lines.
+
+    Installed as `sys.stdout`, it only collects output lines; a background thread
+    redraws the whole screen at most `fps` times per second with one write and
+    one flush, instead of a print and flush per stream event.
+    """
+
+    def __init__(self, stream, fps: int = DASHBOARD_FPS, history: int = 500):
+        super().__init__(stream)
+        self.interval = 1.0 / fps
+        self.lines: deque = deque(maxlen=history)
+        self._partial = ""
+        self._token_samples: deque = deque()
+        self._dirty = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            *lines, self._partial = (self._partial + text).split("\n")
+            self.lines.extend(ANSI_ESCAPE.sub("", line) for line in lines)
+        if lines:
+            self._dirty.set()
+        return len(text)
+
+    def emit(self, line: str) -> None:
+        with self._lock:
+            self.lines.append(line)
+        self._dirty.set()
+
+    def start(self) -> None:
+        # Alternate screen, cursor hidden; restored in stop()
+        self.stream.write("\033[?1049h\033[?25l")
+        self.stream.flush()
+        self._thread = threading.Thread(target=self._render_loop, name="ralph-dashboard", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None or self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._dirty.set()
+        self._thread.join()
+        self.stream.write("\033[?25h\033[?1049l")
+        self.stream.flush()
+
+    def _render_loop(self) -> None:
+        last = 0.0
+        while not self._stopped.is_set():
+            # Redraw on new output, and at least once a second for the clocks
+            self._dirty.wait(timeout=1.0)
+            wait = last + self.interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._dirty.clear()
+            if self._stopped.is_set():
+                break
+            last = time.monotonic()
+            self.stream.write(self.render())
+            self.stream.flush()
+
+    def _count_tokens(self, tokens: int) -> None:
+        if tokens:
+            self._token_samples.append((time.monotonic(), tokens))
+
+    def tokens_per_second(self) -> float:
+        now = time.monotonic()
+        samples = self._token_samples
+        while samples and samples[0][0] < now - TOKEN_RATE_WINDOW:
+            samples.popleft()
+        if not samples:
+            return 0.0
+        return sum(tokens for _, tokens in samples) / max(now - samples[0][0], 1.0)
+
+    def render(self) -> str:
+        """The full frame: cursor home, every row cleared to end of line, rest of screen cleared."""
+        columns, rows = shutil.get_terminal_size()
+        now = time.monotonic()
+
+        with self._lock:
+            done = self.completed + self.failed
+            status = [(
+                f" 🤖 Ralph · {done}/{self.total} done · {self.completed} ✓ {self.failed} ✗ · "
+                f"${self.cost:.4f} · {self.tokens_per_second():.0f} tok/s · {format_elapsed(now - self._started)}",
+                (Colors.BLUE, Colors.BOLD),
+            )]
+            for iteration, current in sorted(self.active.items()):
+                row = f"   Iteration {iteration}/{self.total} · {format_elapsed(now - current['started'])}"
+                if current["tool"]:
+                    _, name, summary, started = current["tool"]
+                    row += f" · 🔧 {name} ({format_elapsed(now - started)}) {summary}"
+                status.append((row, (Colors.CYAN,)))
+            status.append(("─" * columns, (Colors.DIM,)))
+
+            tail_rows = max(rows - len(status) - 1, 0)
+            tail = list(self.lines)[-tail_rows:] if tail_rows else []
+
+        frame = ["\033[H"]
+        for text, styles in status:
+            frame.append(colorize(text[:columns - 1], *styles) + "\033[K\n")
+        for line in tail:
+            frame.append(line[:columns - 1] + "\033[K\n")
+        frame.append("\033[J")
+        return "".join(frame)
+
+
+class StreamItem:
+    """One stream line as the reader hands it to the sinks.
+
+    `fresh` holds the message's content blocks that weren't duplicates, so
+    sinks don't have to consult the deduper. `wall` and `ns` are when the line
+    arrived (time.time() and time.monotonic_ns()), which sinks use instead of
+    the time they get around to it.
+    """
+
+    __slots__ = ("iteration", "event", "line", "fresh", "wall", "ns")
+
+    def __init__(self, iteration: int, event: Optional[StreamEvent], line: Union[str, bytes], fresh: tuple = ()):
+        self.iteration = iteration
+        self.event = event
+        self.line = line
+        self.fresh = fresh
+        self.wall = time.time()
+        self.ns = time.monotonic_ns()
+
+
+def decode_stream_line(line: Union[str, bytes], state: dict, iteration: int = 0) -> Optional[StreamItem]:
+    """The reader's part of handling a stream line: decode it and update the iteration's `state`.
+
+    `state` gets what the loop decides on (completion, live tokens for the
+    budget, stats, errors for the launch limiter); display and record keeping
+    are left to the sinks. Returns None for blank lines.
+    """
+    if not line.strip():
+        return None
+
+    deduper = state.get("dedup")
+    if deduper is None:
+        deduper = state["dedup"] = EventDeduper()
+
+    event = decode_event(line)
+    fresh = []
+
+    if event is None:
+        # Not JSON - it might be an error message from the CLI
+        stripped = as_text(line).strip()
+        if stripped:
+            note_error(state, stripped)
+
+    elif isinstance(event, MessageEvent) and event.type == "assistant":
+        # Usage is repeated on every content block of a message; count it once
+        if event.usage and event.message_id != state.get("last_message_id"):
+            state["last_message_id"] = event.message_id
+            state["live_tokens"] = (
+                state.get("live_tokens", 0) + (event.usage.get("input_tokens") or 0) + (event.usage.get("output_tokens") or 0)
+            )
+
+        for block in event.blocks:
+            if isinstance(block, TextBlock):
+                text = block.text
+                if text and deduper.first_seen("text", text):
+                    # Chunks are joined once, when the iteration summary is written
+                    state.setdefault("text_chunks", []).append(text)
+                    fresh.append(block)
+
+                    # Check for completion markers
+                    matcher = state.get("completion")
+                    if matcher is None:
+                        matcher = state["completion"] = CompletionMatcher()
+                    if matcher.feed(text):
+                        state["complete"] = True
+
+            elif isinstance(block, ToolUseBlock):
+                if block.id and deduper.first_seen("tool_use", block.id):
+                    fresh.append(block)
+
+    elif isinstance(event, MessageEvent) and event.type == "user":
+        for block in event.blocks:
+            if isinstance(block, ToolResultBlock) and block.tool_use_id and deduper.first_seen("tool_result", block.tool_use_id):
+                fresh.append(block)
+
+    elif isinstance(event, ResultEvent):
+        state["result_received"] = True
+        if event.cost_usd is not None:
+            state["total_cost"] = state.get("total_cost", 0) + event.cost_usd
+        if event.duration_ms is not None:
+            state["total_duration"] = state.get("total_duration", 0) + event.duration_ms
+        if event.tokens_in is not None and event.tokens_out is not None:
+            state["total_tokens_in"] = state.get("total_tokens_in", 0) + event.tokens_in
+            state["total_tokens_out"] = state.get("total_tokens_out", 0) + event.tokens_out
+        if event.num_turns is not None:
+            state["total_turns"] = state.get("total_turns", 0) + event.num_turns
+        if event.is_error:
+            note_error(state, event.result)
+
+    elif isinstance(event, ErrorEvent):
+        note_error(state, f"{event.error_type}: {event.message}")
+
+    return StreamItem(iteration, event, line, tuple(fresh))
+
+
+def _truncated(text: str, limit: int) -> str:
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def print_stream_item(item: StreamItem, debug: bool = False) -> None:
+    """Terminal output for a stream line."""
+    event = item.event
+    if event is None:
+        # Not JSON - print it as it might be an error message or debug output
+        stripped = as_text(item.line).strip()
+        if stripped:
+            print(colorize(f"  {stripped}", Colors.DIM))
+            sys.stdout.flush()
+        return
+
+    # Debug: show all event types and a preview of the raw line we received
+    if debug:
+        print(colorize(f"  [DEBUG] {event.type}: {as_text(item.line[:800]).strip()[:200]}", Colors.DIM))
+
+    # Claude CLI stream-json format
+    if isinstance(event, SystemEvent):
+        if event.subtype == "init" and debug:
+            print(colorize(f"  📋 Session started with {len(event.tools)} tools", Colors.CYAN))
+
+    elif isinstance(event, MessageEvent):
+        for block in item.fresh:
+            if isinstance(block, TextBlock):
+                print(colorize(block.text, Colors.WHITE))
+            elif isinstance(block, ToolUseBlock):
+                print()
+                print_tool_call(block.name, block.input)
+            elif block.is_error:
+                print(colorize(f"     ❌ {_truncated(block.content, 100)}", Colors.RED))
+            elif debug:
+                print(colorize(f"     ✓ {_truncated(block.content, 80)}", Colors.DIM))
+
+    elif isinstance(event, ResultEvent):
+        print()
+        stats = []
+        if event.cost_usd is not None:
+            stats.append(f"💰 ${event.cost_usd:.4f}")
+        if event.duration_ms is not None:
+            stats.append(f"⏱️  {event.duration_ms/1000:.1f}s")
+        if event.tokens_in is not None and event.tokens_out is not None:
+            stats.append(f"📊 {event.tokens_in}→{event.tokens_out} tokens")
+        if event.num_turns is not None:
+            stats.append(f"🔁 {event.num_turns} turns")
+        if stats:
+            print(colorize(f"  {' | '.join(stats)}", Colors.MAGENTA))
+
+    elif isinstance(event, ErrorEvent):
+        print()
+        print(colorize(f"  ❌ Error: {event.message}", Colors.RED, Colors.BOLD))
+    sys.stdout.flush()
+
+
+def log_stream_item(item: StreamItem, activity_log: Optional[ActivityLog], profiler: Optional[ToolProfiler] = None) -> None:
+    """Activity log entries and tool timings for a stream line."""
+    event = item.event
+    iteration = item.iteration
+    if isinstance(event, MessageEvent):
+        for block in item.fresh:
+            if isinstance(block, ToolUseBlock):
+                if profiler:
+                    profiler.tool_started(iteration, block.id, block.name, block.input, at=item.ns)
+                if activity_log:
+                    activity_log.add_tool_call(iteration, block.name, block.input)
+            elif isinstance(block, ToolResultBlock):
+                if profiler:
+                    profiler.tool_finished(iteration, block.tool_use_id, at=item.ns)
+                if block.is_error and activity_log:
+                    activity_log.add_error(iteration, _truncated(block.content, 100))
+    elif isinstance(event, ResultEvent) and activity_log:
+        activity_log.add_stats(
+            iteration, event.cost_usd or 0, event.duration_ms or 0, event.tokens_in or 0, event.tokens_out or 0, event.num_turns
+        )
+    elif isinstance(event, ErrorEvent) and activity_log:
+        activity_log.add_error(iteration, event.message)
+
+
+def process_stream_json(
+    line: Union[str, bytes],
+    state: dict,
+    debug: bool = False,
+    activity_log: ActivityLog = None,
+    iteration: int = 0,
+    event_store: Optional[EventStore] = None,
+    ui: Optional[HeadlessUI] = None,
+    profiler: Optional[ToolProfiler] = None,
+) -> None:
+    """Process a single line of stream-json output (str, or raw bytes from the pipe).
+
+    Decodes it and hands it to every consumer in turn, on the calling thread.
+    run_iteration_async does the same through an EventFanout instead, so slow
+    consumers don't hold up the pipe.
+    """
+    item = decode_stream_line(line, state, iteration)
+    if item is None:
+        return
+    if event_store:
+        event_store.record(iteration, item.event, line, ts=item.wall)
+    if ui and item.event is not None:
+        ui.on_event(iteration, item.event)
+    print_stream_item(item, debug)
+    log_stream_item(item, activity_log, profiler)
+
+
+SINK_DROP = "drop"
+SINK_COALESCE = "coalesce"
+# Events a sink can fall behind by before it starts losing them; sinks that
+# should see every event get more room than the terminal
+DEFAULT_SINK_CAPACITY = 10000
+TERMINAL_SINK_CAPACITY = 1000
+# Seconds an interrupted iteration waits for its sinks to catch up
+SINK_CLOSE_TIMEOUT_SECONDS = 2.0
+# Seconds a sink may go without handling an event before the end of an iteration stops waiting for it
+# (the iteration's --idle-timeout, if set, takes its place)
+SINK_STALL_SECONDS = 30.0
+
+
+class EventSink:
+    """A consumer of an iteration's stream events, behind a bounded queue and served by its own thread.
+
+    The reader never waits for a sink, and a sink never holds more than
+    `capacity` events. When the queue is full:
+
+        drop      the oldest queued event is discarded, and `notice(item,
+                  count)` is told how many were lost before the next item is
+                  handled. Every sink but metrics: the terminal can always
+                  skip ahead, and the activity log, event store and UI only
+                  lose events after falling DEFAULT_SINK_CAPACITY behind
+        coalesce  the queue holds a single event, which newer ones replace;
+                  for sinks that only want the latest state (metrics)
+
+    Lag counters: events handled, dropped and coalesced, the deepest the
+    queue got, the longest an event waited in it (`max_lag`, seconds from
+    arrival to being handled), and failures: handlers that raised, and
+    flushes or closes that gave up on a sink that stopped making progress.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handle: Callable[[StreamItem], None],
+        policy: str = SINK_DROP,
+        capacity: int = DEFAULT_SINK_CAPACITY,
+        notice: Optional[Callable[[StreamItem, int], None]] = None,
+    ):
+        self.name = name
+        self.handle = handle
+        self.policy = policy
+        self.capacity = 1 if policy == SINK_COALESCE else capacity
+        self.notice = notice
+        self.handled = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.max_depth = 0
+        self.max_lag = 0.0
+        self._unnoticed = 0
+        self._items: deque = deque()
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"ralph-sink-{name}", daemon=True)
+        self._thread.start()
+
+    def offer(self, item: StreamItem) -> None:
+        """Queue `item`; never waits."""
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._items) >= self.capacity:
+                if self.policy == SINK_DROP:
+                    self._items.popleft()
+                    self.dropped += 1
+                    self._unnoticed += 1
+                else:
+                    self._items.popleft()
+                    self.coalesced += 1
+            self._items.append(item)
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._items or self._closed)
+                if not self._items:
+                    return
+                item = self._items.popleft()
+                unnoticed, self._unnoticed = self._unnoticed, 0
+                self._busy = True
+            self.max_lag = max(self.max_lag, (time.monotonic_ns() - item.ns) / 1e9)
+            try:
+                if unnoticed and self.notice:
+                    self.notice(item, unnoticed)
+                self.handle(item)
+            except Exception as e:
+                self.failures += 1
+                if self.failures == 1:
+                    print(colorize(f"  ⚠️  Event sink {self.name} failed: {e}", Colors.YELLOW))
+            with self._cond:
+                self._busy = False
+                self.handled += 1
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None, stall: float = SINK_STALL_SECONDS) -> bool:
+        """Wait until every queued event is handled.
+
+        Gives up once `timeout` seconds have passed, or `stall` seconds went by
+        without an event being handled; that counts as a failure. Returns
+        whether the sink caught up.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._items or self._busy:
+                handled = self.handled
+                wait = stall if deadline is None else min(stall, deadline - time.monotonic())
+                self._cond.wait_for(lambda: self.handled != handled or not (self._items or self._busy), max(wait, 0))
+                if self.handled == handled and (self._items or self._busy):
+                    self.failures += 1
+                    return False
+        return True
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Handle what is queued, waiting at most `timeout` seconds, and stop the thread.
+
+        Whatever is still queued after that is discarded (counted as dropped
+        and as a failure), so a sink that hangs can't act on the iteration
+        after it ended; the event it is stuck in is the last one it handles.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            with self._cond:
+                if self._items:
+                    self.dropped += len(self._items)
+                    self._items.clear()
+                    self.failures += 1
+
+    def counters(self) -> dict:
+        return {
+            "handled": self.handled,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "max_depth": self.max_depth,
+            "max_lag": round(self.max_lag, 4),
+        }
+
+
+class EventFanout:
+    """The sinks an iteration's reader hands every stream line to; see EventSink."""
+
+    def __init__(self, sinks: Sequence[EventSink]):
+        self.sinks = list(sinks)
+
+    def publish(self, item: StreamItem) -> None:
+        for sink in self.sinks:
+            sink.offer(item)
+
+    def flush(self, timeout: Optional[float] = None, stall: float = SINK_STALL_SECONDS) -> List[EventSink]:
+        """Wait for every sink to catch up (see EventSink.flush); returns the sinks given up on."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        behind = []
+        for sink in self.sinks:
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            if not sink.flush(remaining, stall):
+                behind.append(sink)
+        return behind
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for sink in self.sinks:
+            sink.close(max(deadline - time.monotonic(), 0) if deadline is not None else None)
+
+
+def stream_sinks(
+    debug: bool = False,
+    activity_log: Optional[ActivityLog] = None,
+    event_store: Optional[EventStore] = None,
+    ui: Optional[HeadlessUI] = None,
+    profiler: Optional[ToolProfiler] = None,
+    metrics: Optional["LoopMetrics"] = None,
+) -> EventFanout:
+    """The sinks of one iteration: terminal, activity log and tool profile, event store, UI and metrics."""
+    def skipped(item: StreamItem, count: int) -> None:
+        print(colorize(f"  … {count} event(s) not shown, the terminal fell behind", Colors.DIM))
+
+    def unlogged(item: StreamItem, count: int) -> None:
+        if activity_log:
+            activity_log.add_error(item.iteration, f"{count} event(s) not logged, the activity log fell behind")
+
+    def show(item: StreamItem) -> None:
+        if item.event is not None:
+            ui.on_event(item.iteration, item.event)
+
+    sinks = [EventSink("terminal", lambda item: print_stream_item(item, debug), SINK_DROP, TERMINAL_SINK_CAPACITY, skipped)]
+    if activity_log or profiler:
+        sinks.append(EventSink("activity", lambda item: log_stream_item(item, activity_log, profiler), notice=unlogged))
+    if event_store:
+        sinks.append(EventSink("events", lambda item: event_store.record(item.iteration, item.event, item.line, ts=item.wall)))
+    if ui:
+        sinks.append(EventSink("ui", show))
+    if metrics:
+        sinks.append(EventSink("metrics", lambda item: metrics.stream_event(item.wall), SINK_COALESCE))
+    return EventFanout(sinks)
+
+
+def record_sink_counters(sinks: EventFanout, global_state: Optional[dict], verbose: bool = False) -> None:
+    """Add an iteration's sink counters to global_state["event_sinks"]; with --verbose, report sinks that fell behind."""
+    for sink in sinks.sinks:
+        counters = sink.counters()
+        if verbose and (sink.dropped or sink.failures):
+            print(colorize(
+                f"  🐢 Sink {sink.name} fell behind: {sink.dropped} dropped, "
+                f"{sink.failures} failures, max lag {sink.max_lag:.2f}s",
+                Colors.DIM,
+            ))
+        if global_state is None:
+            continue
+        with global_state_lock:
+            total = global_state.setdefault("event_sinks", {}).setdefault(sink.name, {})
+            for key, value in counters.items():
+                if key.startswith("max_"):
+                    total[key] = max(total.get(key, 0), value)
+                else:
+                    total[key] = total.get(key, 0) + value
+
+
+global_state_lock = threading.Lock()
+
+# Seconds a timed-out child gets after SIGTERM before its process group is killed
+TERMINATE_GRACE_SECONDS = 10.0
+# Process group ids of running Claude children, signalled at exit (see terminate_live_children)
+live_process_groups: set = set()
+
+
+# Default seconds --exit-on-marker waits after the marker for Claude's result event
+DEFAULT_MARKER_GRACE_SECONDS = 5.0
+# Seconds a child stopped at the completion marker gets after SIGTERM (it has nothing left to do)
+MARKER_TERMINATE_GRACE_SECONDS = 2.0
+MARKER_GRACE_OVER = "completion marker grace period over"
+
+
+def signal_process_group(process, sig: int) -> None:
+    """Send a signal to a child's process group (the child and any tools it started)."""
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def terminate_process_group(process, grace: float = TERMINATE_GRACE_SECONDS) -> None:
+    """Escalate SIGTERM to SIGKILL on a child's process group.
+
+    The group is killed even when the child exits within the grace period, so
+    hung tool subprocesses it leaves behind go with it.
+    """
+    signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        pass
+    signal_process_group(process, signal.SIGKILL)
+    await process.wait()
+
+
+async def write_stdin(process, data: bytes) -> None:
+    """Send `data` to a child's stdin and close it; a child that exits without reading it is fine."""
+    try:
+        process.stdin.write(data)
+        await process.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        process.stdin.close()
+
+
+def terminate_live_children() -> None:
+    """SIGTERM every Claude child that is still running (registered with atexit).
+
+    Children run in their own session, so a Ctrl+C in the terminal no longer
+    reaches them directly.
+    """
+    for pgid in list(live_process_groups):
+        try:
+            os.killpg(pgid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+# Bytes requested from the child's stdout pipe per read
+READ_CHUNK_BYTES = 1024 * 1024
+# Lines longer than this are not buffered whole (see StreamLineReader)
+DEFAULT_MAX_LINE_BYTES = 512 * 1024
+
+SALVAGE_FIELDS = {
+    "message_id": re.compile(rb'"id"\s*:\s*"(msg_[^"\\]*)"'),
+    "tool_id": re.compile(rb'"id"\s*:\s*"(toolu_[^"\\]*)"'),
+    "tool_use_id": re.compile(rb'"tool_use_id"\s*:\s*"([^"\\]*)"'),
+    "name": re.compile(rb'"name"\s*:\s*"([^"\\]*)"'),
+    "is_error": re.compile(rb'"is_error"\s*:\s*(true|false)'),
+    "input": re.compile(rb'"(command|file_path|path|pattern|url)"\s*:\s*"((?:[^"\\]|\\.){0,300})'),
+    "text": re.compile(rb'"(?:text|content)"\s*:\s*"'),
+}
+# Bytes of text/tool output kept from a salvaged line
+SALVAGE_TEXT_BYTES = 4096
+JSON_STRING_BODY = re.compile(rb'(?:[^"\\]|\\.)*')
+
+
+def _json_string_prefix(raw: bytes) -> str:
+    """Decode the start of a JSON string body that may have been cut off mid-escape."""
+    for cut in range(0, 6):
+        candidate = raw[:len(raw) - cut] if cut else raw
+        try:
+            return json.loads(b'"' + candidate + b'"')
+        except ValueError:
+            continue
+    return as_text(raw)
+
+
+def salvage_oversized_line(head: bytes, tail: bytes, size: int) -> bytes:
+    """Build a small stand-in event for a stream line too large to buffer.
+
+    Only the line's first and last bytes are available. The fields the runner
+    uses (type, tool ids and names, error flag and the beginning of the text)
+    are recovered from them, and `_truncated_bytes` records the original size.
+    """
+    def find(field: str, *sources: bytes) -> Optional[re.Match]:
+        for source in sources:
+            match = SALVAGE_FIELDS[field].search(source)
+            if match:
+                return match
+        return None
+
+    def group(field: str, *sources: bytes) -> str:
+        match = find(field, *sources)
+        return as_text(match.group(1)) if match else ""
+
+    event_type = peek_event_type(head) or ""
+    event: dict = {"type": event_type, "_truncated_bytes": size}
+    text_match = find("text", head)
+    text = ""
+    if text_match:
+        window = head[text_match.end():text_match.end() + SALVAGE_TEXT_BYTES]
+        text = _json_string_prefix(JSON_STRING_BODY.match(window).group(0))
+
+    if event_type == "user":
+        error = find("is_error", tail, head)
+        event["message"] = {"content": [{
+            "type": "tool_result",
+            "tool_use_id": group("tool_use_id", head, tail),
+            "content": text,
+            "is_error": bool(error and error.group(1) == b"true"),
+        }]}
+    elif event_type == "assistant":
+        tool_id = group("tool_id", head)
+        if tool_id:
+            tool_input = {}
+            input_match = find("input", head)
+            if input_match:
+                tool_input[as_text(input_match.group(1))] = _json_string_prefix(input_match.group(2))
+            block = {"type": "tool_use", "id": tool_id, "name": group("name", head) or "unknown", "input": tool_input}
+        else:
+            block = {"type": "text", "text": text}
+        event["message"] = {"id": group("message_id", head), "content": [block]}
+
+    return json.dumps(event).encode()
+
+
+class StreamLineReader:
+    """Splits a child's stdout into lines at the bytes level.
+
+    Data arrives in large chunks; newlines are located with `bytearray.find` and
+    each line is copied out once through a memoryview, still undecoded. Lines
+    longer than `max_line_bytes` are never buffered whole: the reader keeps
+    their first `max_line_bytes` and last `TAIL_BYTES`, drops everything in
+    between as it streams past, and emits a salvaged stand-in event instead.
+    Memory therefore depends on the limit, not on the largest tool output.
+    """
+
+    TAIL_BYTES = 4096
+
+    def __init__(self, max_line_bytes: int = DEFAULT_MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self._buffer = bytearray()
+        # (head, tail, size) of the oversized line currently being skipped
+        self._oversized: Optional[Tuple[bytes, bytearray, int]] = None
+        self.oversized_lines = 0
+        self.bytes_skipped = 0
+
+    def _skip(self, data: bytes) -> None:
+        head, tail, size = self._oversized
+        tail += data[-self.TAIL_BYTES:]
+        del tail[:-self.TAIL_BYTES]
+        self._oversized = (head, tail, size + len(data))
+
+    def _finish_oversized(self) -> bytes:
+        head, tail, size = self._oversized
+        self._oversized = None
+        self.oversized_lines += 1
+        self.bytes_skipped += size - len(head)
+        return salvage_oversized_line(head, bytes(tail), size)
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add the next chunk from the pipe and return the lines it completed."""
+        lines = []
+        if self._oversized is not None:
+            newline = chunk.find(b"\n")
+            if newline < 0:
+                self._skip(chunk)
+                return lines
+            self._skip(chunk[:newline])
+            lines.append(self._finish_oversized())
+            chunk = chunk[newline + 1:]
+
+        buffer = self._buffer
+        buffer += chunk
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                newline = buffer.find(b"\n", start)
+                if newline < 0:
+                    break
+                if newline > start:
+                    lines.append(bytes(view[start:newline]))
+                start = newline + 1
+        del buffer[:start]
+
+        if len(buffer) > self.max_line_bytes:
+            self._oversized = (bytes(buffer[:self.max_line_bytes]), bytearray(buffer[-self.TAIL_BYTES:]), len(buffer))
+            buffer.clear()
+        return lines
+
+    def finish(self) -> List[bytes]:
+        """Return whatever is left once the pipe is closed."""
+        if self._oversized is not None:
+            return [self._finish_oversized()]
+        rest = bytes(self._buffer)
+        self._buffer.clear()
+        return [rest] if rest.strip() else []
+
+
+def record_marker_exit(
+    iteration: int,
+    reason: str,
+    after_marker: float,
+    elapsed: float,
+    state: dict,
+    global_state: Optional[dict],
+    activity_log: Optional[ActivityLog],
+) -> None:
+    """Log an iteration stopped at its completion marker, with an estimate of the time and cost saved.
+
+    What Claude would still have spent can't be observed, so the saving is
+    estimated against the average iteration of this run that ran to its exit.
+    """
+    saved_seconds = saved_cost = None
+    if global_state is not None:
+        with global_state_lock:
+            full = global_state.get("full_iterations", 0)
+            if full:
+                saved_seconds = max(global_state["full_iteration_seconds"] / full - elapsed, 0.0)
+                if "total_cost" in state:
+                    saved_cost = max(global_state["full_iteration_cost"] / full - state["total_cost"], 0.0)
+            global_state["marker_exits"] = global_state.get("marker_exits", 0) + 1
+            # Left unset until an estimate exists, so the summary doesn't show a made-up zero
+            if saved_seconds is not None:
+                global_state["marker_saved_seconds"] = global_state.get("marker_saved_seconds", 0) + saved_seconds
+            if saved_cost is not None:
+                global_state["marker_saved_cost"] = global_state.get("marker_saved_cost", 0) + saved_cost
+    if saved_seconds is not None:
+        print(colorize(f"     Saved ~{saved_seconds:.0f}s vs. this run's average full iteration", Colors.DIM))
+    if activity_log:
+        activity_log.add_marker_exit(iteration, reason, after_marker, saved_seconds, saved_cost)
+
+
+def claude_environment(iteration: int, extra_env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Environment for an iteration's Claude process."""
+    # Set CLAUDE_CODE_SILENT=1 to suppress Claude Code notification hooks
+    # Ralph has its own notification system, so we don't want duplicates
+    env = os.environ.copy()
+    env["CLAUDE_CODE_SILENT"] = "1"
+    env["RALPH_ITERATION"] = str(iteration)
+    if extra_env:
+        env.update(extra_env)
+    return env
+
+
+async def start_claude(claude_bin: str, env: Dict[str, str], cwd: Optional[Path] = None) -> asyncio.subprocess.Process:
+    """Start the Claude CLI, which then waits for its prompt on stdin."""
+    # The prompt goes to Claude's stdin rather than argv, so its size isn't limited by ARG_MAX
+    cmd = [
+        claude_bin,
+        "-p",
+        "--output-format", "stream-json",
+        "--verbose",
+        "--dangerously-skip-permissions",
+        "--max-turns", "50",
+        "--teammate-mode", "in-process",
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=env,
+        cwd=cwd,
+        limit=READ_CHUNK_BYTES,
+        # Own process group, so a timeout can stop the tools Claude started too
+        start_new_session=True,
+    )
+    live_process_groups.add(process.pid)
+    return process
+
+
+async def run_iteration_async(
+    iteration: int,
+    total: int,
+    prompt: str,
+    verbose: bool = False,
+    global_state: dict = None,
+    activity_log: ActivityLog = None,
+    cwd: Optional[Path] = None,
+    extra_env: Optional[Dict[str, str]] = None,
+    completion_markers: Sequence[str] = DEFAULT_COMPLETION_MARKERS,
+    completion_patterns: Sequence[str] = (),
+    event_store: Optional[EventStore] = None,
+    max_line_bytes: int = DEFAULT_MAX_LINE_BYTES,
+    ui: Optional[HeadlessUI] = None,
+    iteration_timeout: Optional[float] = None,
+    idle_timeout: Optional[float] = None,
+    budget: Optional[BudgetGovernor] = None,
+    metrics: Optional[LoopMetrics] = None,
+    profiler: Optional[ToolProfiler] = None,
+    recorder: Optional[StreamRecorder] = None,
+    claude_bin: str = "claude",
+    task: Optional[str] = None,
+    exit_on_marker: Optional[float] = None,
+    limiter: Optional[LaunchLimiter] = None,
+    gaps: Optional["IterationGaps"] = None,
+    prestarted: Optional[asyncio.subprocess.Process] = None,
+) -> Tuple[bool, bool]:
+    """Run a single Claude iteration on the running event loop.
+
+    The child's stdout is read in large binary chunks, split into lines by a
+    StreamLineReader, and every line is decoded and published to the
+    iteration's event sinks (see EventSink), so one loop can drive several
+    iterations alongside timers and other background work, and a slow terminal
+    or disk doesn't stall the pipe.
+
+    Args:
+        cwd: Directory to run Claude in (default: current directory), e.g. a worker's worktree.
+        extra_env: Additional environment variables for the Claude process.
+        completion_markers: Literal strings that signal all work is done.
+        completion_patterns: Regular expressions that signal all work is done.
+        event_store: Archive every raw stream event of this iteration here.
+        max_line_bytes: Stream lines longer than this are skipped past and replaced
+            by a salvaged summary instead of being buffered.
+        ui: Dashboard or headless output that is told about iteration progress.
+        iteration_timeout: Stop Claude after this many seconds of wall-clock time.
+        idle_timeout: Stop Claude after this many seconds without a stream-json event.
+            A timed-out child's process group gets SIGTERM, then SIGKILL, and the
+            iteration counts as failed.
+        budget: Shared budget; Claude is stopped the same way once it is exhausted.
+        metrics: Told about stream events, for the time-since-last-event gauge.
+        profiler: Times tool calls; should also be an activity_log listener.
+        recorder: Save Claude's raw output for replay with fake_claude.py.
+        claude_bin: Claude CLI executable, e.g. fake_claude.py for testing.
+        task: The PRD checklist item the prompt asks for, for the activity log.
+        exit_on_marker: Once a completion marker is seen, wait at most this many
+            seconds for the result event, then stop Claude instead of waiting for
+            it to exit. The iteration counts as successful and complete.
+        limiter: Wait for its go-ahead before starting Claude, and report back how
+            the iteration ended (clean, throttled, fatal or other error). A fatal
+            error is also recorded as global_state["fatal_error"].
+        gaps: Told when Claude starts, first speaks and exits, to measure the
+            idle time between iterations.
+        prestarted: A Claude process started ahead of time for this iteration
+            (see IterationPipeline), waiting for its prompt; used instead of
+            starting one.
+
+    Returns:
+        Tuple of (success, complete) where complete indicates RALPH_COMPLETE was found.
+    """
+    waited = 0.0
+    if limiter:
+        waited = await limiter.acquire(iteration, ui)
+        if waited >= LIMITER_POLL_SECONDS and global_state is not None:
+            with global_state_lock:
+                global_state["launch_wait_seconds"] = global_state.get("launch_wait_seconds", 0) + waited
+
+    print_header(iteration, total)
+    sys.stdout.flush()
+
+    # Log iteration start
+    if activity_log:
+        activity_log.add_iteration_start(iteration, total)
+    prompt_data = prompt.encode()
+    if activity_log:
+        activity_log.add_prompt(iteration, len(prompt_data), task)
+    if ui:
+        ui.iteration_started(iteration, total)
+    if budget:
+        budget.iteration_started(iteration)
+
+    state = {
+        "current_tool": None,
+        "current_tool_input": "",
+        "text_chunks": [],
+        "completion": CompletionMatcher(completion_markers, completion_patterns),
+        "dedup": EventDeduper(),
+        "complete": False,
+        "total_prompt_bytes": len(prompt_data),
+    }
+
+    if event_store:
+        event_store.begin_iteration(iteration)
+    if recorder:
+        recorder.begin_iteration(iteration)
+    sinks = stream_sinks(verbose, activity_log, event_store, ui, profiler, metrics)
+
+    process = None
+    feeder = None
+    outcome = (False, False)
+    started = time.monotonic()
+    spawned = False
+    exited_at = None
+    try:
+        if gaps:
+            gaps.spawned(iteration, waited)
+            spawned = True
+        process = prestarted or await start_claude(claude_bin, claude_environment(iteration, extra_env), cwd)
+        feeder = asyncio.create_task(write_stdin(process, prompt_data))
+
+        last_event = started
+        stopped = None
+        marker_seen = None
+        marker_exit = None
+        reader = StreamLineReader(max_line_bytes)
+        while True:
+            now = time.monotonic()
+            limits = []
+            if iteration_timeout:
+                limits.append((started + iteration_timeout - now, f"iteration ran longer than {iteration_timeout:g}s"))
+            if idle_timeout:
+                limits.append((last_event + idle_timeout - now, f"no stream output for {idle_timeout:g}s"))
+            if budget and budget.max_duration is not None:
+                limits.append((budget.remaining_seconds(), f"run reached --max-duration {budget.max_duration / 60:.1f} min"))
+            if marker_seen is not None:
+                limits.append((marker_seen + exit_on_marker - now, MARKER_GRACE_OVER))
+            wait, reason = min(limits) if limits else (None, None)
+            try:
+                chunk = await asyncio.wait_for(
+                    process.stdout.read(READ_CHUNK_BYTES),
+                    timeout=max(wait, 0) if wait is not None else None,
+                )
+            except asyncio.TimeoutError:
+                if reason == MARKER_GRACE_OVER:
+                    marker_exit = "no result event within the grace period"
+                else:
+                    stopped = f"Timed out: {reason}"
+                break
+            if recorder and chunk:
+                recorder.record(iteration, chunk, time.monotonic() - started)
+            lines = reader.feed(chunk) if chunk else reader.finish()
+            if lines:
+                if gaps and last_event == started:
+                    # Claude's first output, e.g. its system/init event
+                    gaps.first_event(iteration)
+                last_event = time.monotonic()
+            for line in lines:
+                item = decode_stream_line(line, state, iteration)
+                if item is None:
+                    continue
+                sinks.publish(item)
+            if budget and lines:
+                exhausted = budget.update(iteration, state.get("live_tokens", 0))
+                if exhausted:
+                    stopped = f"Budget exhausted: {exhausted}"
+                    break
+            if not chunk:
+                break
+            if exit_on_marker is not None and state.get("complete"):
+                if marker_seen is None:
+                    marker_seen = time.monotonic()
+                if state.get("result_received"):
+                    marker_exit = "result received"
+                    break
+
+        if marker_exit:
+            after_marker = time.monotonic() - marker_seen
+            await terminate_process_group(process, MARKER_TERMINATE_GRACE_SECONDS)
+        elif stopped:
+            # Over time or over budget: stop Claude before waiting for the sinks to catch up
+            await terminate_process_group(process)
+        terminated = bool(marker_exit or stopped)
+
+        # Everything below is printed and logged after the stream's events, unless a sink hangs
+        remaining = started + iteration_timeout - time.monotonic() if iteration_timeout else None
+        behind = await asyncio.to_thread(sinks.flush, remaining, idle_timeout or SINK_STALL_SECONDS)
+        for sink in behind:
+            print(colorize(f"  ⚠️  Event sink {sink.name} is stuck, not waiting for it", Colors.YELLOW))
+            if activity_log and sink.name != "activity":
+                activity_log.add_error(iteration, f"Event sink {sink.name} stopped making progress")
+
+        if verbose and reader.oversized_lines:
+            print(colorize(
+                f"  ✂️  Skipped {reader.bytes_skipped / 1024 / 1024:.1f} MB of {reader.oversized_lines} oversized "
+                f"event(s) (over {max_line_bytes:,} bytes)",
+                Colors.DIM,
+            ))
+
+        if marker_exit:
+            print()
+            print(colorize(f"  🏁 Completion marker seen, stopped Claude ({marker_exit})", Colors.GREEN, Colors.BOLD))
+            return_code = 0
+            record_marker_exit(iteration, marker_exit, after_marker, time.monotonic() - started, state, global_state, activity_log)
+        elif not stopped:
+            # Output is closed, but the child may still hang on exit
+            remaining = started + iteration_timeout - time.monotonic() if iteration_timeout else None
+            try:
+                return_code = await asyncio.wait_for(process.wait(), timeout=max(remaining, 0) if remaining is not None else None)
+            except asyncio.TimeoutError:
+                stopped = f"Timed out: iteration ran longer than {iteration_timeout:g}s"
+
+        if stopped:
+            if not terminated:
+                # Timed out waiting for it to exit after its output closed
+                await terminate_process_group(process)
+            print()
+            print(colorize(f"  ⛔ {stopped}, stopped Claude", Colors.RED, Colors.BOLD))
+            return_code = None
+            state["stopped"] = stopped
+            if activity_log:
+                activity_log.add_error(iteration, stopped)
+        exited_at = time.monotonic()
+
+        if return_code and state.get("error_class") is None:
+            state["error_class"] = ERROR_FATAL if return_code in FATAL_EXIT_CODES else ERROR_OTHER
+        if state.get("error_class") == ERROR_FATAL:
+            report_fatal_error(iteration, state.get("error_message") or f"Claude exited with status {return_code}",
+                               global_state, activity_log)
+
+        # Accumulate stats to global state (shared between parallel workers)
+        if global_state is not None:
+            with global_state_lock:
+                for key in ["total_cost", "total_duration", "total_tokens_in", "total_tokens_out", "total_turns", "total_prompt_bytes"]:
+                    if key in state:
+                        global_state[key] = global_state.get(key, 0) + state[key]
+                if return_code == 0 and not marker_exit:
+                    # Reference for what stopping at the marker saves (see record_marker_exit)
+                    global_state["full_iterations"] = global_state.get("full_iterations", 0) + 1
+                    global_state["full_iteration_seconds"] = global_state.get("full_iteration_seconds", 0) + time.monotonic() - started
+                    global_state["full_iteration_cost"] = global_state.get("full_iteration_cost", 0) + state.get("total_cost", 0)
+
+        success = return_code == 0
+        complete = state.get("complete", False)
+
+        deduper = state["dedup"]
+        if verbose and deduper.suppressed:
+            kinds = ", ".join(f"{count} {kind}" for kind, count in deduper.suppressed_by_kind.most_common())
+            print(colorize(f"  🔁 Suppressed {deduper.suppressed} duplicate blocks ({kinds})", Colors.DIM))
+
+        # Log iteration summary (assistant's text output) and end
+        if activity_log:
+            accumulated = "".join(state["text_chunks"])
+            if accumulated:
+                activity_log.add_iteration_summary(iteration, accumulated)
+            activity_log.add_iteration_end(iteration, success, complete)
+
+        print_footer(iteration, success)
+        sys.stdout.flush()
+
+        outcome = (success, complete)
+        return outcome
+
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        if process and process.returncode is None:
+            signal_process_group(process, signal.SIGTERM)
+        sinks.close(SINK_CLOSE_TIMEOUT_SECONDS)
+        print()
+        print(colorize("  ⚠️  Interrupted by user", Colors.YELLOW, Colors.BOLD))
+        # Log iteration end (interrupted)
+        if activity_log:
+            activity_log.add_iteration_end(iteration, False, False)
+        raise
+    except Exception as e:
+        sinks.close(SINK_CLOSE_TIMEOUT_SECONDS)
+        print(colorize(f"  ❌ Error running Claude: {e}", Colors.RED, Colors.BOLD))
+        sys.stdout.flush()
+        if process and process.returncode is None:
+            signal_process_group(process, signal.SIGKILL)
+        # Log error and iteration end
+        if activity_log:
+            activity_log.add_error(iteration, str(e))
+        if process is None and isinstance(e, OSError):
+            # The CLI can't be started (not found, not executable): no later iteration will do better
+            state["error_class"] = ERROR_FATAL
+            report_fatal_error(iteration, f"cannot run {claude_bin}: {e}", global_state, activity_log)
         if activity_log:
-            activity_log.add_stats(iteration, cost or 0, duration or 0, tokens_in or 0, tokens_out or 0)
+            activity_log.add_iteration_end(iteration, False, False)
+        return False, False
+    finally:
+        if feeder and not feeder.done():
+            feeder.cancel()
+        sinks.close(SINK_CLOSE_TIMEOUT_SECONDS)
+        record_sink_counters(sinks, global_state, verbose)
+        if process:
+            live_process_groups.discard(process.pid)
+        if spawned:
+            # The gap to the next iteration includes the teardown below
+            gaps.exited(iteration, exited_at)
+        if recorder:
+            recorder.end_iteration(iteration)
+        if budget:
+            tokens = state.get("total_tokens_in", 0) + state.get("total_tokens_out", 0)
+            budget.settle(
+                iteration,
+                state.get("total_cost"),
+                tokens or state.get("live_tokens", 0),
+                time.monotonic() - started,
+            )
+        if event_store:
+            event_store.end_iteration(iteration)
+        if ui:
+            ui.iteration_finished(iteration, *outcome, state)
+        if limiter:
+            error_class = state.get("error_class")
+            if error_class is None and not outcome[0]:
+                error_class = ERROR_OTHER
+            cooldown = limiter.release(iteration, error_class, state.get("retry_after"))
+            if cooldown is not None:
+                report_throttle(iteration, state.get("error_message", ""), cooldown, global_state, activity_log)
+
+
+def report_fatal_error(iteration: int, message: str, global_state: Optional[dict], activity_log: Optional[ActivityLog]) -> None:
+    """Announce an error no retry can fix; the loop stops starting iterations (see LaunchLimiter)."""
+    print(colorize(f"  ⛔ Fatal error, retrying won't help: {message}", Colors.RED, Colors.BOLD))
+    if activity_log:
+        activity_log.add_error(iteration, f"Fatal error: {message}")
+    if global_state is not None:
+        with global_state_lock:
+            global_state.setdefault("fatal_error", message)
+
+
+def report_throttle(
+    iteration: int, message: str, cooldown: float, global_state: Optional[dict], activity_log: Optional[ActivityLog]
+) -> None:
+    """Announce a rate-limited iteration and the launch cooldown it started."""
+    print(colorize(f"  ⏳ Rate limited ({message[:120]}), holding off new launches for {cooldown:.0f}s", Colors.YELLOW, Colors.BOLD))
+    sys.stdout.flush()
+    if activity_log:
+        activity_log.add_error(iteration, f"Rate limited, launches paused for {cooldown:.0f}s: {message}")
+    if global_state is not None:
+        with global_state_lock:
+            global_state["throttles"] = global_state.get("throttles", 0) + 1
+
+
+def run_iteration(iteration: int, total: int, prompt: str, **options) -> Tuple[bool, bool]:
+    """Run a single Claude iteration, blocking until it finishes.
+
+    Synchronous wrapper around `run_iteration_async` for callers without an event
+    loop; accepts the same keyword arguments.
+
+    Returns:
+        Tuple of (success, complete) where complete indicates RALPH_COMPLETE was found.
+    """
+    try:
+        return asyncio.run(run_iteration_async(iteration, total, prompt, **options))
+    except KeyboardInterrupt:
+        return False, False
+
+
+class IterationGaps:
+    """Idle time between iterations, when no Claude process is doing any work.
+
+    A gap runs from one Claude process exiting to the next one's first stream
+    event. It is split into the runner's share (teardown, activity log and
+    checkpoint writes, verification, prompt assembly, starting the process)
+    and the CLI's startup (process start to its first event, e.g. system/init).
+    Waits for the launch limiter or a PRD task's retry backoff are left out,
+    and only gaps in which no other iteration is running count, so parallel
+    workers never report any.
+    """
+
+    def __init__(self):
+        self.runner: List[float] = []
+        self.startup: List[float] = []
+        self._running = 0
+        self._idle_since: Optional[float] = None
+        self._paused = 0.0
+        # Started iterations whose gap is still open: (spawned at, runner share)
+        self._open: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def spawned(self, iteration: int, waited: float = 0.0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._running == 0 and self._idle_since is not None:
+                self._open[iteration] = (now, max(now - self._idle_since - self._paused - waited, 0.0))
+            self._paused = 0.0
+            self._running += 1
+
+    def pause(self, seconds: float) -> None:
+        """Leave out time the runner spent waiting on purpose before the next iteration."""
+        with self._lock:
+            self._paused += seconds
+
+    def first_event(self, iteration: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            gap = self._open.pop(iteration, None)
+            if gap:
+                spawned, runner = gap
+                self.runner.append(runner)
+                self.startup.append(now - spawned)
+
+    def exited(self, iteration: int, at: Optional[float] = None) -> None:
+        with self._lock:
+            self._open.pop(iteration, None)
+            self._running -= 1
+            if self._running == 0:
+                self._idle_since = at if at is not None else time.monotonic()
+
+    def summary(self) -> dict:
+        """Gap statistics for global_state (see print_summary); empty before the second iteration."""
+        with self._lock:
+            totals = sorted(runner + startup for runner, startup in zip(self.runner, self.startup))
+            if not totals:
+                return {}
+            return {
+                "gaps": len(totals),
+                "gap_p50": percentile(totals, 0.5),
+                "gap_p95": percentile(totals, 0.95),
+                "gap_runner": sum(self.runner) / len(totals),
+                "gap_startup": sum(self.startup) / len(totals),
+            }
+
+
+class IterationPipeline:
+    """`--pipeline`: overlaps the start of each sequential iteration with the end of the previous one.
+
+    As an ActivityLog listener it hears about an iteration's result event,
+    after which Claude does no more work, and starts the next iteration's
+    Claude process right away. The CLI's cold start then overlaps the old
+    process's exit and the runner's work in between (task bookkeeping,
+    verification, prompt assembly); the prompt goes to the waiting process's
+    stdin once it is built. Iterations run on one persistent event loop, which
+    the spare process belongs to.
+
+    A background thread re-parses the PRD in the meantime and takes over the
+    activity log and checkpoint writes that follow each iteration, in order,
+    so the next launch doesn't wait for their fsyncs.
+    """
+
+    def __init__(self, prompt_builder: Optional[PrdPromptBuilder] = None):
+        self.prompt_builder = prompt_builder
+        self.spares_started = 0
+        self.spares_used = 0
+        self._options: Optional[dict] = None
+        self._total = 0
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        # (iteration, task starting its Claude process)
+        self._spare: Optional[Tuple[int, "asyncio.Task[asyncio.subprocess.Process]"]] = None
+        self._loop = asyncio.Runner()
+        self._queue: "queue.Queue[Optional[Callable[[], object]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ralph-pipeline", daemon=True)
+        self._thread.start()
+
+    def run_iteration(self, iteration: int, total: int, prompt: str, **options) -> Tuple[bool, bool]:
+        """Like `run_iteration`, handing the prompt to a spare Claude process when one was started for it."""
+        try:
+            return self._loop.run(self._run_iteration(iteration, total, prompt, options))
+        except KeyboardInterrupt:
+            return False, False
+
+    async def _run_iteration(self, iteration: int, total: int, prompt: str, options: dict) -> Tuple[bool, bool]:
+        self._options = options
+        self._total = total
+        self._event_loop = asyncio.get_running_loop()
+        prestarted = await self._take_spare(iteration)
+        return await run_iteration_async(iteration, total, prompt, prestarted=prestarted, **options)
 
-        if stats:
-            print(colorize(f"  {' | '.join(stats)}", Colors.MAGENTA))
-        sys.stdout.flush()
+    async def _take_spare(self, iteration: int) -> Optional[asyncio.subprocess.Process]:
+        if self._spare is None:
+            return None
+        spare_iteration, starting = self._spare
+        self._spare = None
+        try:
+            process = await starting
+        except OSError:
+            # run_iteration_async reports it when starting Claude fails again
+            return None
+        # Let a pending exit notification arrive before trusting the process
+        await asyncio.sleep(0)
+        if spare_iteration != iteration or process.returncode is not None:
+            await self._discard(process)
+            return None
+        self.spares_used += 1
+        return process
 
-    elif event_type == "error":
-        error = data.get("error", {})
-        error_msg = error.get("message", str(error))
-        print()
-        print(colorize(f"  ❌ Error: {error_msg}", Colors.RED, Colors.BOLD))
-        # Log error to activity log
-        if activity_log:
-            activity_log.add_error(iteration, error_msg)
-        sys.stdout.flush()
+    @staticmethod
+    async def _discard(process: asyncio.subprocess.Process) -> None:
+        await terminate_process_group(process, MARKER_TERMINATE_GRACE_SECONDS)
+        live_process_groups.discard(process.pid)
 
+    async def _discard_spare(self) -> None:
+        if self._spare is not None:
+            _, starting = self._spare
+            self._spare = None
+            try:
+                await self._discard(await starting)
+            except OSError:
+                pass
 
-def run_iteration(
-    iteration: int,
-    total: int,
-    prompt: str,
-    verbose: bool = False,
-    global_state: dict = None,
-    activity_log: ActivityLog = None
-) -> Tuple[bool, bool]:
-    """Run a single Claude iteration.
+    def submit(self, job: Callable[[], object]) -> None:
+        """Run `job` on the background thread, after every job submitted before it."""
+        self._queue.put(job)
 
-    Returns:
-        Tuple of (success, complete) where complete indicates RALPH_COMPLETE was found.
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                job()
+            except Exception as e:
+                print(colorize(f"  ⚠️  Pipelined work failed: {e}", Colors.YELLOW))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every job submitted so far has run; False if `timeout` passed first."""
+        done = threading.Event()
+        self.submit(done.set)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stop an unused spare process and finish the queued jobs, waiting at most `timeout` seconds for them."""
+        self._loop.run(self._discard_spare())
+        self._loop.close()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    # ActivityLog listener method
+
+    def add_stats(self, iteration: int, cost: float, duration: float, tokens_in: int, tokens_out: int) -> None:
+        # Called on the activity log's event sink thread; the spare belongs to the event loop
+        if self.prompt_builder:
+            self.submit(self.prompt_builder.prefetch)
+        if self._event_loop is not None and iteration < self._total:
+            self._event_loop.call_soon_threadsafe(self._start_spare, iteration + 1)
+
+    def _start_spare(self, iteration: int) -> None:
+        options = self._options
+        if options is None or self._spare is not None:
+            return
+        env = claude_environment(iteration, options.get("extra_env"))
+        starting = asyncio.get_running_loop().create_task(
+            start_claude(options.get("claude_bin", "claude"), env, options.get("cwd"))
+        )
+        self._spare = (iteration, starting)
+        self.spares_started += 1
+
+
+DEFAULT_WORKTREE_BASE_DIR = "../InZone-worktrees"
+
+
+def git(*args: str, cwd: Optional[Path] = None, check: bool = True) -> str:
+    """Run a git command and return its stripped stdout."""
+    result = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if check and result.returncode != 0:
+        details = result.stderr.strip() or result.stdout.strip()
+        raise RuntimeError(f"git {' '.join(args)} failed: {details}")
+    return result.stdout.strip()
+
+
+def get_worktree_base_path(repo_root: Path) -> Path:
+    """Resolve the worktree base directory used by scripts/worktree.
+
+    Honours `settings.worktreeBaseDir` from the shared registry at
+    `.git/inzone/worktree.json` and falls back to the same default.
     """
-    print_header(iteration, total)
-    sys.stdout.flush()
+    base_dir = DEFAULT_WORKTREE_BASE_DIR
+    common_dir = Path(git("rev-parse", "--git-common-dir", cwd=repo_root))
+    if not common_dir.is_absolute():
+        common_dir = repo_root / common_dir
+    try:
+        registry = json.loads((common_dir / "inzone" / "worktree.json").read_text())
+        base_dir = registry.get("settings", {}).get("worktreeBaseDir") or base_dir
+    except (OSError, json.JSONDecodeError):
+        pass
+    return (repo_root / base_dir).resolve()
 
-    # Log iteration start
-    if activity_log:
-        activity_log.add_iteration_start(iteration, total)
 
-    cmd = [
-        "claude",
-        "-p", prompt,
-        "--output-format", "stream-json",
-        "--verbose",
-        "--dangerously-skip-permissions",
-        "--max-turns", "50",
-        "--teammate-mode", "in-process",
-    ]
+class WorktreePool:
+    """A fixed set of git worktrees, one per parallel worker.
 
-    state = {
-        "current_tool": None,
-        "current_tool_input": "",
-        "accumulated_text": "",
-        "complete": False,
-    }
+    Worktrees live next to the ones created by scripts/worktree (`ralph-worker-<n>`)
+    and are reused across runs. Every iteration gets its own `ralph/<run>/iter-<n>`
+    branch created from the base branch's current HEAD, so later iterations build
+    on the work that has already been merged back. Branches are deleted once
+    merged; only those that need a look (failed merges, failed iterations with
+    commits) are kept.
+    """
 
-    process = None
+    def __init__(self, repo_root: Path, workers: int, run_id: str):
+        self.repo_root = repo_root
+        self.run_id = run_id
+        self.base_branch = git("rev-parse", "--abbrev-ref", "HEAD", cwd=repo_root)
+        if self.base_branch == "HEAD":
+            raise RuntimeError("--workers needs a checked-out branch to merge into (HEAD is detached)")
+        base_path = get_worktree_base_path(repo_root)
+        self.paths = [base_path / f"ralph-worker-{n}" for n in range(1, workers + 1)]
+        # Serializes ref updates and merges on the shared repository
+        self._git_lock = threading.Lock()
+
+    def setup(self) -> None:
+        """Create any worker worktrees that don't exist yet."""
+        porcelain = git("worktree", "list", "--porcelain", cwd=self.repo_root)
+        existing = {line[len("worktree "):] for line in porcelain.split("\n") if line.startswith("worktree ")}
+        for path in self.paths:
+            if str(path) not in existing:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                git("worktree", "add", "--detach", str(path), self.base_branch, cwd=self.repo_root)
+
+    def prepare(self, slot: int, iteration: int) -> Tuple[str, str]:
+        """Point a worker's worktree at a fresh iteration branch.
+
+        Returns:
+            Tuple of (branch, base_commit).
+        """
+        path = self.paths[slot]
+        branch = f"ralph/{self.run_id}/iter-{iteration}"
+        with self._git_lock:
+            base_commit = git("rev-parse", self.base_branch, cwd=self.repo_root)
+            git("checkout", "--force", "-B", branch, base_commit, cwd=path)
+        git("clean", "-fd", cwd=path)
+        return branch, base_commit
+
+    def commit_leftovers(self, slot: int, iteration: int) -> None:
+        """Commit changes Claude left uncommitted so they aren't lost when the worktree is reused."""
+        path = self.paths[slot]
+        if not git("status", "--porcelain", cwd=path):
+            return
+        with self._git_lock:
+            git("add", "-A", cwd=path)
+            git("commit", "-m", f"Ralph iteration {iteration}: uncommitted changes", cwd=path, check=False)
+
+    def release(self, slot: int) -> None:
+        """Detach a worker's worktree from its iteration branch, so the branch can be deleted."""
+        git("checkout", "--detach", cwd=self.paths[slot])
+
+    def new_commits(self, branch: str, base_commit: str) -> int:
+        return int(git("rev-list", "--count", f"{base_commit}..{branch}", cwd=self.repo_root))
+
+    def delete_branch(self, branch: str) -> None:
+        with self._git_lock:
+            git("branch", "-D", branch, cwd=self.repo_root, check=False)
+
+    def merge(self, branch: str, base_commit: str, strategy: str = "merge") -> Tuple[bool, str]:
+        """Bring an iteration branch back into the base branch checkout.
+
+        `merge` creates a merge commit per iteration, `rebase` replays the
+        iteration's commits on top of the base branch. Conflicts are aborted and
+        the iteration branch is kept for manual resolution.
+
+        Returns:
+            Tuple of (merged, details).
+        """
+        with self._git_lock:
+            commits = self.new_commits(branch, base_commit)
+            if commits == 0:
+                return True, "no new commits"
+
+            if strategy == "rebase":
+                cmd, abort = ["cherry-pick", f"{base_commit}..{branch}"], ["cherry-pick", "--abort"]
+            else:
+                cmd, abort = ["merge", "--no-ff", "--no-edit", branch], ["merge", "--abort"]
+
+            result = subprocess.run(["git", *cmd], cwd=self.repo_root, capture_output=True, text=True)
+            if result.returncode != 0:
+                git(*abort, cwd=self.repo_root, check=False)
+                details = (result.stderr.strip() or result.stdout.strip()).split("\n")[0]
+                return False, details
+            return True, f"{commits} commit(s)"
+
+
+class ParallelRunner:
+    """Runs iterations on N workers, each in its own git worktree.
+
+    All workers are driven by a single asyncio event loop on a background thread.
+    Iterating yields `(iteration, success, complete)` in iteration order; each
+    successful iteration's branch is merged back into the base branch before it
+    is yielded, so merges happen strictly in order. Branches that are kept
+    (see WorktreePool) are listed in global_state["kept_branches"].
+    """
+
+    def __init__(
+        self,
+        pool: WorktreePool,
+        total: int,
+        prompt: Union[str, Callable[[int], Optional[Tuple[str, Optional[str]]]]],
+        merge_strategy: str = "merge",
+        first: int = 1,
+        **iteration_options,
+    ):
+        """
+        Args:
+            prompt: The prompt, or a function returning an iteration's prompt and
+                the checklist item it assigns, or None when there is nothing left
+                to do (e.g. PrdPromptBuilder.build).
+            first: Iteration number to start at (e.g. when resuming).
+            iteration_options: Keyword arguments passed to `run_iteration_async`
+                for every iteration (verbose, global_state, activity_log, ...).
+        """
+        self.pool = pool
+        self.first = first
+        self.total = total
+        self.prompt = prompt
+        self.merge_strategy = merge_strategy
+        self.iteration_options = iteration_options
+        self.activity_log: Optional[ActivityLog] = iteration_options.get("activity_log")
+        self.ui: Optional[HeadlessUI] = iteration_options.get("ui")
+        self.budget: Optional[BudgetGovernor] = iteration_options.get("budget")
+        self.global_state: Optional[dict] = iteration_options.get("global_state")
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        """Don't start any more iterations; in-flight ones still finish and merge."""
+        self._stop.set()
+
+    def _keep_branch(self, branch: str) -> None:
+        if self.global_state is not None:
+            with global_state_lock:
+                self.global_state.setdefault("kept_branches", []).append(branch)
+
+    def _worker_prompt(self, prompt: str, assigned: bool, slot: int, branch: str) -> str:
+        workers = len(self.pool.paths)
+        if assigned:
+            pick = "The runner assigned you the task above; work only on that item"
+        else:
+            pick = (
+                f"So pick unchecked item number {slot + 1} (counting from the first unchecked item) "
+                f"if there are enough left"
+            )
+        return (
+            f"{prompt}\n\n"
+            f"---\n"
+            f"Ralph parallel mode: you are worker {slot + 1} of {workers}, working in an isolated "
+            f"git worktree on branch `{branch}`. Other workers are implementing other checklist "
+            f"items at the same time. {pick}, and commit your work on this branch.\n"
+        )
+
+    async def _run_one(self, iteration: int, slots: "asyncio.Queue[int]") -> Optional[Tuple[str, str, bool, bool]]:
+        slot = await slots.get()
+        try:
+            if self._stop.is_set():
+                return None
+            worker_tag.set(f"w{slot + 1}")
+            if self.budget:
+                refused = self.budget.admit()
+                if refused:
+                    report_budget_stop(iteration, refused, self.iteration_options.get("global_state"), self.ui)
+                    self.stop()
+                    return None
+            if callable(self.prompt):
+                # May wait for a task's retry backoff, so off the event loop
+                built = await asyncio.to_thread(self.prompt, iteration)
+                if built is None:
+                    self.stop()
+                    return None
+                prompt, task = built
+            else:
+                prompt, task = self.prompt, None
+            branch, base_commit = await asyncio.to_thread(self.pool.prepare, slot, iteration)
+            success, complete = await run_iteration_async(
+                iteration,
+                self.total,
+                self._worker_prompt(prompt, task is not None, slot, branch),
+                task=task,
+                cwd=self.pool.paths[slot],
+                extra_env={"RALPH_WORKER": str(slot + 1)},
+                **self.iteration_options,
+            )
+            await asyncio.to_thread(self.pool.commit_leftovers, slot, iteration)
+            await asyncio.to_thread(self.pool.release, slot)
+            return branch, base_commit, success, complete
+        finally:
+            slots.put_nowait(slot)
+
+    async def run_async(self, on_result) -> None:
+        """Run all iterations on the current event loop.
+
+        `on_result(iteration, outcome)` is called as each iteration finishes, where
+        outcome is `(branch, base_commit, success, complete)`, None if the iteration
+        was skipped after `stop()`, or the exception that aborted it.
+        """
+        slots: "asyncio.Queue[int]" = asyncio.Queue()
+        for slot in range(len(self.pool.paths)):
+            slots.put_nowait(slot)
+
+        async def run_and_report(iteration: int) -> None:
+            try:
+                outcome = await self._run_one(iteration, slots)
+            except Exception as e:
+                outcome = e
+            on_result(iteration, outcome)
+
+        await asyncio.gather(*(run_and_report(i) for i in range(self.first, self.total + 1)))
+
+    def __iter__(self):
+        self.pool.setup()
+
+        finished: "queue.Queue[tuple]" = queue.Queue()
+        loop_thread = threading.Thread(
+            target=lambda: asyncio.run(self.run_async(lambda i, outcome: finished.put((i, outcome)))),
+            name="ralph-workers",
+            daemon=True,
+        )
+        loop_thread.start()
+
+        pending = {}
+        for iteration in range(self.first, self.total + 1):
+            while iteration not in pending:
+                done_iteration, outcome = finished.get()
+                pending[done_iteration] = outcome
+            outcome = pending.pop(iteration)
+
+            if outcome is None:
+                continue
+
+            if isinstance(outcome, Exception):
+                print(colorize(f"  ❌ Worker error in iteration {iteration}: {outcome}", Colors.RED, Colors.BOLD))
+                if self.activity_log:
+                    self.activity_log.add_error(iteration, f"Worker error: {outcome}")
+                yield iteration, False, False
+                continue
+
+            branch, base_commit, success, complete = outcome
+            if success:
+                merged, details = self.pool.merge(branch, base_commit, self.merge_strategy)
+                if merged:
+                    print(colorize(f"  🔀 Merged {branch} into {self.pool.base_branch} ({details})", Colors.CYAN))
+                else:
+                    print(colorize(f"  ❌ Could not merge {branch}: {details}", Colors.RED, Colors.BOLD))
+                    print(colorize(f"     Branch kept for manual resolution", Colors.DIM))
+                    success = False
+                    if self.activity_log:
+                        self.activity_log.add_merge_failure(iteration, branch, details)
+                    if self.ui:
+                        self.ui.emit(f"ralph iteration {iteration}/{self.total} merge FAILED: {details}")
+                    self._keep_branch(branch)
+                sys.stdout.flush()
+                if merged:
+                    self.pool.delete_branch(branch)
+            elif self.pool.new_commits(branch, base_commit):
+                print(colorize(f"     Branch {branch} of the failed iteration kept", Colors.DIM))
+                self._keep_branch(branch)
+            else:
+                self.pool.delete_branch(branch)
+
+            yield iteration, success, complete
+
+        loop_thread.join()
+
+
+DEFAULT_VERIFY_CACHE = ".ralph/verify-cache.json"
+DEFAULT_VERIFY_TIMEOUT_SECONDS = 900.0
+# Workspace packages --verify checks when they change: directory -> (pnpm filter, checks)
+VERIFY_PACKAGES = {
+    "apps/api": ("api", ("typecheck", "test")),
+    "apps/web": ("web", ("typecheck", "test")),
+    "packages/shared": ("@inzone/shared", ("typecheck",)),
+}
+# Root files whose changes can affect every package: all checks run, tests in full
+VERIFY_GLOBAL_FILES = ("package.json", "pnpm-lock.yaml", "pnpm-workspace.yaml")
+# Package files whose changes make its tests run in full instead of only the related ones
+VERIFY_CONFIG_FILE = re.compile(r"(?:^|/)(?:package\.json|tsconfig[^/]*\.json|vitest\.[^/]*\.ts|vite\.config\.ts)$")
+# Cached check results kept, least recently used dropped first
+VERIFY_CACHE_ENTRIES = 500
+# Characters of a failing check's output kept for the log and the next prompt
+VERIFY_OUTPUT_TAIL = 4000
+
+
+class Verifier:
+    """Typechecks and tests the packages the loop changed, between iterations (see --verify).
+
+    Changes are found by comparing git trees: the working tree, committed or
+    not, is snapshotted with `git write-tree` through a scratch index and
+    diffed against the snapshot of the previous verification. Only packages of
+    VERIFY_PACKAGES that changed are checked, all their checks in parallel, and
+    tests run only for the changed files (`vitest related`) unless a config
+    file changed. Results are cached by the package's tree hash, so a package
+    in a state that was checked before is never run again.
+
+    A failing check stays in `failures` until a later run of it passes, and
+    `feedback()` turns the failures into a section for the next prompt.
+    """
+
+    def __init__(self, repo: Path, cache_path: Path, timeout: float = DEFAULT_VERIFY_TIMEOUT_SECONDS):
+        self.repo = repo
+        self.cache_path = cache_path
+        self.timeout = timeout
+        self.cache: "OrderedDict[str, dict]" = OrderedDict()
+        if cache_path.exists():
+            try:
+                self.cache.update(json.loads(cache_path.read_text()))
+            except ValueError:
+                pass
+        # (directory, check) -> result of a check that failed the last time it ran
+        self.failures: Dict[Tuple[str, str], dict] = {}
+        self.baseline = self.snapshot()
+
+    def snapshot(self) -> str:
+        """Tree hash of the working tree as it is now, without touching the real index."""
+        git_dir = Path(git("rev-parse", "--absolute-git-dir", cwd=self.repo))
+        scratch = git_dir / "ralph-verify-index"
+        index = git_dir / "index"
+        if index.exists():
+            # Starting from the real index reuses its stat cache, so only changed files are hashed
+            shutil.copyfile(index, scratch)
+        env = {**os.environ, "GIT_INDEX_FILE": str(scratch)}
+        for args in (("add", "-A"), ("write-tree",)):
+            result = subprocess.run(["git", *args], cwd=self.repo, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+        return result.stdout.strip()
+
+    def _subtree(self, tree: str, path: str) -> str:
+        return git("rev-parse", "--verify", "--quiet", f"{tree}:{path}", cwd=self.repo, check=False)
+
+    @staticmethod
+    def _command(package: str, check: str, files: List[str]) -> List[str]:
+        if check == "typecheck":
+            return ["pnpm", "--filter", package, "exec", "tsc", "--noEmit", "-p", "tsconfig.json"]
+        if files:
+            return ["pnpm", "--filter", package, "exec", "vitest", "related", "--run", "--passWithNoTests", *files]
+        return ["pnpm", "--filter", package, "exec", "vitest", "run", "--passWithNoTests"]
+
+    async def _run_check(self, job: dict) -> dict:
+        started = time.monotonic()
+        env = {**os.environ, "CI": "1", "FORCE_COLOR": "0"}
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *job["command"],
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=self.repo,
+                env=env,
+                start_new_session=True,
+            )
+        except OSError as e:
+            return {**job, "ok": False, "output": str(e), "seconds": 0.0, "cacheable": False}
+        live_process_groups.add(process.pid)
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+            text = ANSI_ESCAPE.sub("", output.decode(errors="replace")).strip()
+            ok = process.returncode == 0
+            cacheable = True
+        except asyncio.TimeoutError:
+            await terminate_process_group(process)
+            text = f"Timed out after {self.timeout:g}s"
+            ok = cacheable = False
+        finally:
+            live_process_groups.discard(process.pid)
+        return {**job, "ok": ok, "output": text[-VERIFY_OUTPUT_TAIL:], "seconds": time.monotonic() - started, "cacheable": cacheable}
+
+    async def _run_all(self, jobs: List[dict]) -> List[dict]:
+        return await asyncio.gather(*(self._run_check(job) for job in jobs))
+
+    def run(self) -> dict:
+        """Check what changed since the last run; returns a report for the log (see ActivityLog.add_verification)."""
+        started = time.monotonic()
+        tree = self.snapshot()
+        changed = git("diff", "--name-only", "--no-renames", self.baseline, tree, cwd=self.repo).splitlines() if tree != self.baseline else []
+        everything = any(path in VERIFY_GLOBAL_FILES for path in changed)
+        global_key = " ".join(self._subtree(tree, path) for path in VERIFY_GLOBAL_FILES)
+
+        results = []
+        jobs = []
+        for directory, (package, checks) in VERIFY_PACKAGES.items():
+            files = [path[len(directory) + 1:] for path in changed if path.startswith(directory + "/")]
+            if not files and not everything:
+                continue
+            package_tree = self._subtree(tree, directory)
+            if not package_tree:
+                continue
+            related = []
+            if not everything and not any(VERIFY_CONFIG_FILE.search(path) for path in files):
+                related = [path for path in files if (self.repo / directory / path).exists()]
+            for check in checks:
+                key = hashlib.sha256(f"{check}\0{package_tree}\0{global_key}".encode()).hexdigest()[:32]
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.cache.move_to_end(key)
+                    results.append({**cached, "cached": True})
+                    continue
+                jobs.append({
+                    "key": key,
+                    "directory": directory,
+                    "check": check,
+                    "related": len(related) if check == "test" else None,
+                    "command": self._command(package, check, related if check == "test" else []),
+                })
+
+        if jobs:
+            for result in asyncio.run(self._run_all(jobs)):
+                key = result.pop("key")
+                if result.pop("cacheable"):
+                    self.cache[key] = result
+                results.append({**result, "cached": False})
+            while len(self.cache) > VERIFY_CACHE_ENTRIES:
+                self.cache.popitem(last=False)
+            self._save_cache()
+
+        for result in results:
+            if result["ok"]:
+                self.failures.pop((result["directory"], result["check"]), None)
+            else:
+                self.failures[(result["directory"], result["check"])] = result
+        self.baseline = tree
+        return {
+            "changed_files": len(changed),
+            "results": results,
+            "seconds": time.monotonic() - started,
+            "cache_hits": sum(result["cached"] for result in results),
+        }
+
+    def _save_cache(self) -> None:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.cache))
+        os.replace(tmp_path, self.cache_path)
+
+    def feedback(self) -> str:
+        """Prompt section describing the checks that are failing, or "" when none are."""
+        if not self.failures:
+            return ""
+        parts = [
+            "---",
+            "Ralph verification: the checks below FAIL on the current code. Fix them before working on "
+            "anything else, and commit the fix.",
+        ]
+        for result in self.failures.values():
+            command = " ".join(result["command"])
+            if len(command) > 200:
+                command = command[:200] + " ..."
+            parts.append(f"\n### {result['directory']} {result['check']}: `{command}`\n\n```\n{result['output']}\n```")
+        return "\n".join(parts) + "\n"
+
+
+def describe_check(result: dict) -> str:
+    """One verification check for the console and the activity log, e.g. "✗ apps/web test (3 related files, 8.1s)"."""
+    details = []
+    if result.get("related") is not None:
+        details.append(f"{result['related']} related file(s)" if result["related"] else "full run")
+    details.append("cached" if result["cached"] else f"{result['seconds']:.1f}s")
+    return f"{'✓' if result['ok'] else '✗'} {result['directory']} {result['check']} ({', '.join(details)})"
+
+
+def verify_iteration(
+    iteration: int, verifier: Verifier, global_state: dict, activity_log: ActivityLog, ui: Optional[HeadlessUI] = None
+) -> None:
+    """Run the verification stage after `iteration` and record it (see --verify)."""
     try:
-        # Set CLAUDE_CODE_SILENT=1 to suppress Claude Code notification hooks
-        # Ralph has its own notification system, so we don't want duplicates
-        env = os.environ.copy()
-        env["CLAUDE_CODE_SILENT"] = "1"
-
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            env=env,
+        report = verifier.run()
+    except RuntimeError as e:
+        print(colorize(f"  ❌ Verification could not run: {e}", Colors.RED, Colors.BOLD))
+        activity_log.add_error(iteration, f"Verification could not run: {e}")
+        return
+    results = report["results"]
+    failed_checks = [result for result in results if not result["ok"]]
+    if results:
+        color = Colors.RED if failed_checks else Colors.GREEN
+        print(colorize(f"  🔎 Verify: {' | '.join(describe_check(result) for result in results)}", color))
+        print(colorize(f"     {report['seconds']:.1f}s, {report['cache_hits']}/{len(results)} cached", Colors.DIM))
+    else:
+        print(colorize(f"  🔎 Verify: no checked package changed", Colors.DIM))
+    if ui and failed_checks:
+        ui.emit(f"ralph iteration {iteration} verification FAILED: " + ", ".join(
+            f"{result['directory']} {result['check']}" for result in failed_checks))
+    sys.stdout.flush()
+    activity_log.add_verification(iteration, report)
+    with global_state_lock:
+        global_state["verify_runs"] = global_state.get("verify_runs", 0) + 1
+        global_state["verify_failed"] = global_state.get("verify_failed", 0) + bool(failed_checks)
+        global_state["verify_checks"] = global_state.get("verify_checks", 0) + len(results)
+        global_state["verify_cache_hits"] = global_state.get("verify_cache_hits", 0) + report["cache_hits"]
+        global_state["verify_seconds"] = global_state.get("verify_seconds", 0) + report["seconds"]
+
+
+def report_budget_stop(iteration: int, reason: str, global_state: Optional[dict], ui: Optional[HeadlessUI] = None) -> None:
+    """Announce that iteration `iteration` will not start because of the budget."""
+    message = f"💸 Not starting iteration {iteration}: {reason}"
+    print(colorize(f"  {message}", Colors.YELLOW, Colors.BOLD))
+    if ui:
+        ui.emit(f"ralph {message}")
+    if global_state is not None:
+        with global_state_lock:
+            global_state.setdefault("budget_stop", reason)
+
+
+def print_banner(iterations: int, prompt_file: str, workers: int = 1) -> None:
+    """Print startup banner."""
+    print()
+    print(colorize("╔══════════════════════════════════════════════════════════╗", Colors.BLUE, Colors.BOLD))
+    print(colorize("║           🤖 Ralph Loop Runner v2                        ║", Colors.BLUE, Colors.BOLD))
+    print(colorize("╠══════════════════════════════════════════════════════════╣", Colors.BLUE, Colors.BOLD))
+    print(colorize(f"║  Iterations: {iterations:<45}║", Colors.BLUE))
+    print(colorize(f"║  Prompt:     {prompt_file:<45}║", Colors.BLUE))
+    if workers > 1:
+        print(colorize(f"║  Workers:    {workers:<45}║", Colors.BLUE))
+    print(colorize(f"║  Started:    {datetime.now().strftime('%Y-%m-%d %H:%M:%S'):<45}║", Colors.BLUE))
+    print(colorize("╚══════════════════════════════════════════════════════════╝", Colors.BLUE, Colors.BOLD))
+
+
+def print_summary(completed: int, failed: int, early_complete: bool, global_state: dict) -> None:
+    """Print final summary."""
+    print()
+    print(colorize("╔══════════════════════════════════════════════════════════╗", Colors.BLUE, Colors.BOLD))
+    print(colorize("║                    📊 Summary                            ║", Colors.BLUE, Colors.BOLD))
+    print(colorize("╠══════════════════════════════════════════════════════════╣", Colors.BLUE, Colors.BOLD))
+    print(colorize(f"║  Total iterations:  {completed + failed:<38}║", Colors.BLUE))
+
+    completed_str = f"{completed} ✓"
+    failed_str = f"{failed} ✗"
+    print(colorize(f"║  Completed:         {completed_str:<38}║", Colors.GREEN if completed > 0 else Colors.BLUE))
+    print(colorize(f"║  Failed:            {failed_str:<38}║", Colors.RED if failed > 0 else Colors.BLUE))
+
+    if early_complete:
+        print(colorize(f"║  Status:            {'🎉 RALPH_COMPLETE detected!':<38}║", Colors.GREEN))
+    elif global_state.get("fatal_error"):
+        print(colorize(f"║  Status:            {'⛔ Stopped by fatal error':<38}║", Colors.RED))
+    elif global_state.get("budget_stop"):
+        print(colorize(f"║  Status:            {'💸 Stopped by budget':<38}║", Colors.YELLOW))
+
+    # Show accumulated stats
+    if global_state.get("total_cost"):
+        cost_str = f"${global_state['total_cost']:.4f}"
+        print(colorize(f"║  Total cost:        {cost_str:<38}║", Colors.MAGENTA))
+
+    if global_state.get("total_duration"):
+        duration_mins = global_state["total_duration"] / 1000 / 60
+        duration_str = f"{duration_mins:.1f} minutes"
+        print(colorize(f"║  Total duration:    {duration_str:<38}║", Colors.MAGENTA))
+
+    if global_state.get("total_tokens_in") and global_state.get("total_tokens_out"):
+        tokens_str = f"{global_state['total_tokens_in']:,} in / {global_state['total_tokens_out']:,} out"
+        print(colorize(f"║  Total tokens:      {tokens_str:<38}║", Colors.MAGENTA))
+
+    iterations = completed + failed
+    if "tasks_done" in global_state:
+        tasks_str = f"{global_state['tasks_done']} done, {global_state['tasks_failed']} failed"
+        if global_state["tasks_done"]:
+            tasks_str += f" ({iterations / global_state['tasks_done']:.1f} it/task)"
+        print(colorize(f"║  PRD tasks:         {tasks_str:<38}║", Colors.CYAN))
+
+    if global_state.get("verify_runs"):
+        verify_str = f"{global_state['verify_runs']} runs, {global_state.get('verify_failed', 0)} failed"
+        if global_state.get("verify_checks"):
+            verify_str += f", {global_state.get('verify_cache_hits', 0) / global_state['verify_checks']:.0%} cached"
+        print(colorize(f"║  Verification:      {verify_str:<38}║", Colors.RED if global_state.get("verify_failed") else Colors.CYAN))
+
+    if global_state.get("throttles") or global_state.get("launch_wait_seconds"):
+        throttles_str = (
+            f"{global_state.get('throttles', 0)} throttled, launches waited "
+            f"{global_state.get('launch_wait_seconds', 0) / 60:.1f} min"
         )
+        print(colorize(f"║  Rate limits:       {throttles_str:<38}║", Colors.YELLOW))
 
-        for line in process.stdout:
-            process_stream_json(line, state, debug=verbose, activity_log=activity_log, iteration=iteration)
+    if global_state.get("gaps"):
+        gap_str = (
+            f"p50 {global_state['gap_p50']:.2f}s, p95 {global_state['gap_p95']:.2f}s "
+            f"(runner {global_state['gap_runner']:.2f}s)"
+        )
+        print(colorize(f"║  Iteration gap:     {gap_str:<38}║", Colors.MAGENTA))
 
-        return_code = process.wait()
+    sinks = global_state.get("event_sinks", {})
+    behind = []
+    for name, counters in sinks.items():
+        for key in ("failures", "dropped"):
+            if counters.get(key):
+                behind.append(f"{name} {counters[key]} {key}")
+                break
+    if behind:
+        sinks_str = ", ".join(behind)
+        print(colorize(f"║  Event sinks:       {sinks_str:<38}║", Colors.YELLOW))
 
-        # Accumulate stats to global state
-        if global_state is not None:
-            for key in ["total_cost", "total_duration", "total_tokens_in", "total_tokens_out"]:
-                if key in state:
-                    global_state[key] = global_state.get(key, 0) + state[key]
+    if iterations and global_state.get("total_turns"):
+        tokens_in = global_state.get("total_tokens_in", 0) / iterations
+        average_str = f"{tokens_in:,.0f} tokens in, {global_state['total_turns'] / iterations:.1f} turns"
+        print(colorize(f"║  Per iteration:     {average_str:<38}║", Colors.MAGENTA))
 
-        success = return_code == 0
-        complete = state.get("complete", False)
+    kept = global_state.get("kept_branches", [])
+    if kept:
+        kept_str = f"{len(kept)}, for manual resolution:"
+        print(colorize(f"║  Kept branches:     {kept_str:<38}║", Colors.YELLOW))
+        for branch in kept:
+            print(colorize(f"║    {branch:<55}║", Colors.YELLOW))
 
-        # Log iteration summary (assistant's text output) and end
-        if activity_log:
-            accumulated = state.get("accumulated_text", "")
-            if accumulated:
-                activity_log.add_iteration_summary(iteration, accumulated)
-            activity_log.add_iteration_end(iteration, success, complete)
+    print(colorize(f"║  Finished at:       {datetime.now().strftime('%Y-%m-%d %H:%M:%S'):<38}║", Colors.BLUE))
+    print(colorize("╚══════════════════════════════════════════════════════════╝", Colors.BLUE, Colors.BOLD))
+    print()
 
-        print_footer(iteration, success)
-        sys.stdout.flush()
 
-        return success, complete
+def read_raw_events(store: Path, run_id: str, iteration: int, lines: Sequence[int]) -> Dict[int, str]:
+    """Fetch raw stream lines from an iteration's segment by line number."""
+    wanted = set(lines)
+    found = {}
+    path = EventStore.segment_path(store, run_id, iteration)
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace") as segment:
+        for number, raw in enumerate(segment):
+            if number in wanted:
+                found[number] = raw.rstrip("\n")
+                if len(found) == len(wanted):
+                    break
+    return found
+
+
+def query_main(argv: List[str]) -> int:
+    """`ralph_v2.py query` - search the --event-store index of past runs."""
+    parser = argparse.ArgumentParser(
+        prog="ralph_v2.py query",
+        description="Query the event store written by --event-store",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+    python ralph_v2.py query --runs                      # List recorded runs
+    python ralph_v2.py query --tool Bash --errors        # Bash commands that errored in the latest run
+    python ralph_v2.py query --run all --kind tool_use --grep prisma
+    python ralph_v2.py query -i 3 --kind result --raw    # Raw result event of iteration 3
+    python ralph_v2.py query --sql "SELECT tool_name, COUNT(*) FROM events GROUP BY 1"
+        """,
+    )
+    parser.add_argument("--store", default=DEFAULT_EVENT_STORE, help=f"Event store directory (default: {DEFAULT_EVENT_STORE})")
+    parser.add_argument("--run", default="latest", help="Run id, 'latest' (default) or 'all'")
+    parser.add_argument("--runs", action="store_true", help="List recorded runs and exit")
+    parser.add_argument("--iteration", "-i", type=int, help="Only this iteration")
+    parser.add_argument("--kind", help="Event or block kind: tool_use, tool_result, text, result, error, system, ...")
+    parser.add_argument("--tool", help="Tool name, e.g. Bash")
+    parser.add_argument("--errors", action="store_true", help="Only errored tool results and error events")
+    parser.add_argument("--grep", help="Only rows whose summary contains this text")
+    parser.add_argument("--limit", type=int, default=100, help="Maximum rows to print (default: 100)")
+    parser.add_argument("--raw", action="store_true", help="Print the full raw event for each row")
+    parser.add_argument("--sql", help="Run a read-only SQL query against the index instead")
+    args = parser.parse_args(argv)
+
+    index_path = Path(args.store) / "index.sqlite"
+    if not index_path.exists():
+        print(colorize(f"Error: No event store index at {index_path}", Colors.RED, Colors.BOLD))
+        return 1
+    db = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+
+    if args.sql:
+        cursor = db.execute(args.sql)
+        print("\t".join(column[0] for column in cursor.description or []))
+        for row in cursor:
+            print("\t".join("" if value is None else str(value) for value in row))
+        return 0
+
+    if args.runs:
+        rows = db.execute(
+            "SELECT r.run_id, r.started, COUNT(DISTINCT e.iteration), COUNT(e.run_id) "
+            "FROM runs r LEFT JOIN events e ON e.run_id = r.run_id GROUP BY r.run_id ORDER BY r.started"
+        ).fetchall()
+        for run_id, started, iterations, events in rows:
+            started_str = datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{run_id}  {started_str}  {iterations} iterations  {events:,} events")
+        return 0
+
+    where, params = [], []
+    if args.run == "latest":
+        latest = db.execute("SELECT run_id FROM runs ORDER BY started DESC LIMIT 1").fetchone()
+        if not latest:
+            print(colorize("No runs recorded yet", Colors.YELLOW))
+            return 0
+        where.append("e.run_id = ?")
+        params.append(latest[0])
+    elif args.run != "all":
+        where.append("e.run_id = ?")
+        params.append(args.run)
+    if args.iteration is not None:
+        where.append("e.iteration = ?")
+        params.append(args.iteration)
+    if args.kind:
+        where.append("e.kind = ?")
+        params.append(args.kind)
+    if args.tool:
+        where.append("e.tool_name = ?")
+        params.append(args.tool)
+    if args.errors:
+        where.append("e.is_error = 1")
+    if args.grep:
+        where.append("instr(e.summary, ?) > 0")
+        params.append(args.grep)
+
+    # Tool results are joined to their tool_use so errors show the command that caused them
+    sql = (
+        "SELECT e.run_id, e.iteration, e.line, e.ts, e.kind, e.tool_name, e.is_error, e.summary, u.summary "
+        "FROM events e LEFT JOIN events u ON e.kind = 'tool_result' AND u.run_id = e.run_id "
+        "AND u.iteration = e.iteration AND u.tool_use_id = e.tool_use_id AND u.kind = 'tool_use' "
+        + ("WHERE " + " AND ".join(where) + " " if where else "")
+        + "ORDER BY e.ts LIMIT ?"
+    )
+    rows = db.execute(sql, [*params, args.limit]).fetchall()
+
+    raw_lines: Dict[tuple, str] = {}
+    if args.raw:
+        by_segment: Dict[tuple, List[int]] = {}
+        for run_id, iteration, line, *_ in rows:
+            by_segment.setdefault((run_id, iteration), []).append(line)
+        for (run_id, iteration), lines in by_segment.items():
+            for line, raw in read_raw_events(Path(args.store), run_id, iteration, lines).items():
+                raw_lines[(run_id, iteration, line)] = raw
+
+    for run_id, iteration, line, ts, kind, tool_name, is_error, summary, tool_input in rows:
+        when = datetime.fromtimestamp(ts).strftime("%H:%M:%S")
+        label = f"{kind}:{tool_name}" if tool_name else kind
+        color = Colors.RED if is_error else Colors.WHITE
+        text = (summary or "").replace("\n", " ⏎ ")
+        if tool_input:
+            text = f"{tool_input.replace(chr(10), ' ⏎ ')}  →  {text}"
+        prefix = f"{run_id} #{iteration} {when}" if args.run == "all" else f"#{iteration} {when}"
+        print(f"{colorize(prefix, Colors.DIM)}  {colorize(label, Colors.YELLOW)}  {colorize(text[:300], color)}")
+        if args.raw:
+            print(colorize(f"  {raw_lines.get((run_id, iteration, line), '')}", Colors.DIM))
+
+    if len(rows) == args.limit:
+        print(colorize(f"(limited to {args.limit} rows, use --limit to see more)", Colors.DIM))
+    return 0
+
+
+ANALYZE_PERIODS = ("day", "week", "run")
+# activity.md lines `analyze` reads (see ActivityLog._render_header and _render_iteration)
+MD_STARTED = re.compile(r"^\*\*Started:\*\* (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)")
+MD_ITERATION = re.compile(r"^### Iteration (\d+) ([✓✗])(?: \((COMPLETE|INTERRUPTED)\))?")
+MD_STAT = re.compile(r"^- (Cost|Duration|Tokens|Turns): \$?([\d.,]+)(?:s| in / ([\d,]+) out)?$")
+MD_TOOL = re.compile(r"^- `([^`]+)`")
+MD_TASK_DONE = re.compile(r"^\*\*Task:\*\* Task `.*` done \(attempt")
+
+
+class RunAnalytics:
+    """Iterations and tool calls of many runs as columns, for `ralph_v2.py analyze`.
+
+    Ingesting appends to one list per column; `freeze()` turns them into NumPy
+    arrays when NumPy is installed. Statistics are then computed a column at a
+    time (bincount, lexsort) rather than per row, and the pure-Python fallback
+    gives the same numbers. Unknown values (e.g. the cost of an interrupted
+    iteration) are NaN.
+    """
+
+    ITERATION_COLUMNS = ("run", "duration", "cost", "tokens", "success", "items_done", "tool_calls")
+    CALL_COLUMNS = ("call_row", "call_tool", "call_error", "call_known")
+
+    def __init__(self):
+        self.runs: List[str] = []
+        self.run_started: List[float] = []
+        self.tool_names: List[str] = []
+        self._run_codes: Dict[str, int] = {}
+        self._tool_codes: Dict[str, int] = {}
+        self._rows: Dict[Tuple[int, int], int] = {}
+        self.frozen = False
+        # One entry per iteration
+        self.run: list = []
+        self.duration: list = []
+        self.cost: list = []
+        self.tokens: list = []
+        self.success: list = []
+        self.items_done: list = []
+        self.tool_calls: list = []
+        # One entry per tool call; call_known is False where the source doesn't say whether it failed
+        self.call_row: list = []
+        self.call_tool: list = []
+        self.call_error: list = []
+        self.call_known: list = []
+
+    def __len__(self) -> int:
+        return len(self.run)
+
+    def run_code(self, run_id: str, started: float) -> Optional[int]:
+        """Code of a new run, or None if a run with this id was already ingested."""
+        if run_id in self._run_codes:
+            return None
+        code = self._run_codes[run_id] = len(self.runs)
+        self.runs.append(run_id)
+        self.run_started.append(started)
+        return code
+
+    def row(self, run_id: str, iteration: int) -> Optional[int]:
+        code = self._run_codes.get(run_id)
+        return self._rows.get((code, iteration)) if code is not None else None
+
+    def add_iteration(self, run: int, iteration: int, duration: float, cost: float, tokens: float, success: bool) -> int:
+        row = self._rows[(run, iteration)] = len(self.run)
+        self.run.append(run)
+        self.duration.append(duration)
+        self.cost.append(cost)
+        self.tokens.append(tokens)
+        self.success.append(success)
+        self.items_done.append(0)
+        self.tool_calls.append(0)
+        return row
+
+    def add_tool_call(self, row: int, tool: str, is_error: Optional[bool]) -> None:
+        code = self._tool_codes.get(tool)
+        if code is None:
+            code = self._tool_codes[tool] = len(self.tool_names)
+            self.tool_names.append(tool)
+        self.call_row.append(row)
+        self.call_tool.append(code)
+        self.call_error.append(bool(is_error))
+        self.call_known.append(is_error is not None)
+        self.tool_calls[row] += 1
+
+    def freeze(self) -> None:
+        """Switch the columns to NumPy arrays, if NumPy is available; no rows can be added after this."""
+        self.frozen = True
+        if np is None:
+            return
+        for name, dtype in (("run", np.int64), ("duration", np.float64), ("cost", np.float64), ("tokens", np.float64),
+                            ("success", bool), ("items_done", np.int64), ("tool_calls", np.int64), ("call_row", np.int64),
+                            ("call_tool", np.int64), ("call_error", bool), ("call_known", bool)):
+            setattr(self, name, np.asarray(getattr(self, name), dtype=dtype))
+
+
+def ingest_activity_log(table: RunAnalytics, path: Path) -> int:
+    """Add the iterations of an activity.md; returns how many. A log without a Started line is skipped."""
+    nan = float("nan")
+    run = None
+    current = None
+    section = None
+    count = 0
+
+    def commit() -> None:
+        nonlocal count
+        if current is None:
+            return
+        row = table.add_iteration(run, current["iteration"], current["duration"], current["cost"], current["tokens"], current["success"])
+        table.items_done[row] = current["items"]
+        for tool in current["tools"]:
+            # activity.md lists errors per iteration, not per tool
+            table.add_tool_call(row, tool, None)
+        count += 1
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if run is None:
+                match = MD_STARTED.match(line)
+                if match:
+                    started = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+                    run = table.run_code(started.strftime("%Y%m%d-%H%M%S"), started.timestamp())
+                    if run is None:
+                        return 0
+                continue
+            if line.startswith("### Iteration "):
+                match = MD_ITERATION.match(line)
+                if match:
+                    commit()
+                    current = {
+                        "iteration": int(match.group(1)), "success": match.group(2) == "✓", "duration": nan,
+                        "cost": nan, "tokens": nan, "items": 0, "tools": [],
+                    }
+                    section = None
+                continue
+            if current is None:
+                continue
+            if not line:
+                section = None
+            elif line == "**Tools Used:**":
+                section = "tools"
+            elif line.startswith("**"):
+                section = None
+                if MD_TASK_DONE.match(line):
+                    current["items"] += 1
+            elif section == "tools":
+                match = MD_TOOL.match(line)
+                if match:
+                    current["tools"].append(match.group(1))
+            elif line.startswith("- "):
+                match = MD_STAT.match(line)
+                if match:
+                    name, value = match.group(1), float(match.group(2).replace(",", ""))
+                    if name == "Cost":
+                        current["cost"] = value
+                    elif name == "Duration":
+                        current["duration"] = value
+                    elif name == "Tokens":
+                        current["tokens"] = value + float(match.group(3).replace(",", ""))
+    commit()
+    return count
+
+
+def ingest_event_store(table: RunAnalytics, root: Path) -> int:
+    """Add every run of an --event-store index; returns how many iterations."""
+    nan = float("nan")
+    db = sqlite3.connect(f"file:{root / 'index.sqlite'}?mode=ro", uri=True)
+    try:
+        codes = {}
+        for run_id, started in db.execute("SELECT run_id, started FROM runs ORDER BY started"):
+            code = table.run_code(run_id, started)
+            if code is not None:
+                codes[run_id] = code
+        results = {
+            (run_id, iteration): (summary, is_error)
+            for run_id, iteration, summary, is_error in db.execute(
+                "SELECT run_id, iteration, summary, is_error FROM events WHERE kind = 'result'"
+            )
+        }
+        count = 0
+        for run_id, iteration, first, last in db.execute(
+            "SELECT run_id, iteration, MIN(ts), MAX(ts) FROM events GROUP BY run_id, iteration ORDER BY run_id, iteration"
+        ):
+            if run_id not in codes:
+                continue
+            summary, is_error = results.get((run_id, iteration), (None, 1))
+            try:
+                stats = json.loads(summary) if summary else {}
+            except ValueError:
+                stats = {}
+            duration = stats["duration_ms"] / 1000 if stats.get("duration_ms") is not None else last - first
+            cost = stats["cost_usd"] if stats.get("cost_usd") is not None else nan
+            tokens_in, tokens_out = stats.get("total_input_tokens"), stats.get("total_output_tokens")
+            tokens = tokens_in + tokens_out if tokens_in is not None and tokens_out is not None else nan
+            table.add_iteration(codes[run_id], iteration, duration, cost, tokens, not is_error)
+            count += 1
+        # Each tool call with the outcome of its result
+        for run_id, iteration, tool_name, is_error in db.execute(
+            "SELECT u.run_id, u.iteration, u.tool_name, r.is_error FROM events u "
+            "LEFT JOIN events r ON r.run_id = u.run_id AND r.iteration = u.iteration "
+            "AND r.tool_use_id = u.tool_use_id AND r.kind = 'tool_result' "
+            "WHERE u.kind = 'tool_use'"
+        ):
+            row = table.row(run_id, iteration) if run_id in codes else None
+            if row is not None:
+                table.add_tool_call(row, tool_name or "?", bool(is_error) if is_error is not None else None)
+        return count
+    finally:
+        db.close()
+
+
+def ingest_task_ledger(table: RunAnalytics, path: Path) -> int:
+    """Credit PRD items finished to the iterations of already ingested runs; returns how many."""
+    count = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") != "done":
+                continue
+            row = table.row(record.get("run_id", ""), record.get("iteration", 0))
+            if row is not None:
+                table.items_done[row] += 1
+                count += 1
+    return count
+
+
+def period_labels(table: RunAnalytics, by: str) -> Tuple[List[str], List[int]]:
+    """Trend periods in time order, and the period of each run."""
+    if by == "run":
+        labels = [table.runs[i] for i in sorted(range(len(table.runs)), key=table.run_started.__getitem__)]
+        return labels, [labels.index(run) for run in table.runs]
+    fmt = "%Y-%m-%d" if by == "day" else "%G-W%V"
+    run_labels = [datetime.fromtimestamp(started).strftime(fmt) for started in table.run_started]
+    labels = sorted(set(run_labels))
+    return labels, [labels.index(label) for label in run_labels]
+
+
+def _iteration_groups_numpy(table: RunAnalytics, codes, groups: int) -> List[dict]:
+    def total(weights):
+        return np.bincount(codes, weights=weights, minlength=groups)
+
+    cost_known = ~np.isnan(table.cost)
+    tokens_known = ~np.isnan(table.tokens)
+    stats = {
+        "iterations": np.bincount(codes, minlength=groups),
+        "succeeded": total(table.success),
+        "cost": total(np.where(cost_known, table.cost, 0.0)),
+        "items_done": np.bincount(codes, weights=table.items_done, minlength=groups).astype(np.int64),
+        "tool_calls": np.bincount(codes, weights=table.tool_calls, minlength=groups).astype(np.int64),
+        "tokens": total(np.where(tokens_known, table.tokens, 0.0)),
+        # Tool calls of the iterations whose tokens are known, the denominator of tokens per call
+        "calls_with_tokens": total(np.where(tokens_known, table.tool_calls, 0)),
+    }
+
+    # Nearest-rank percentiles per group: sort by (group, duration), then index into each group's run
+    known = ~np.isnan(table.duration)
+    group_of, durations = codes[known], table.duration[known]
+    order = np.lexsort((durations, group_of))
+    durations = durations[order]
+    counts = np.bincount(group_of, minlength=groups)
+    starts = np.cumsum(counts) - counts
+    for name, fraction in (("p50", 0.5), ("p95", 0.95)):
+        index = starts + np.maximum(np.ceil(fraction * counts).astype(np.int64) - 1, 0)
+        values = durations[np.minimum(index, len(durations) - 1)] if len(durations) else np.zeros(groups)
+        stats[name] = np.where(counts > 0, values, np.nan)
+    return [{name: column[g].item() for name, column in stats.items()} for g in range(groups)]
+
+
+def _iteration_groups_python(table: RunAnalytics, codes: Sequence[int], groups: int) -> List[dict]:
+    rows = [{"iterations": 0, "succeeded": 0, "cost": 0.0, "items_done": 0, "tool_calls": 0, "tokens": 0.0,
+             "calls_with_tokens": 0} for _ in range(groups)]
+    durations: List[List[float]] = [[] for _ in range(groups)]
+    for i, group in enumerate(codes):
+        row = rows[group]
+        row["iterations"] += 1
+        row["succeeded"] += table.success[i]
+        row["items_done"] += table.items_done[i]
+        row["tool_calls"] += table.tool_calls[i]
+        if not math.isnan(table.cost[i]):
+            row["cost"] += table.cost[i]
+        if not math.isnan(table.tokens[i]):
+            row["tokens"] += table.tokens[i]
+            row["calls_with_tokens"] += table.tool_calls[i]
+        if not math.isnan(table.duration[i]):
+            durations[group].append(table.duration[i])
+    for row, values in zip(rows, durations):
+        values.sort()
+        row["p50"] = percentile(values, 0.5) if values else float("nan")
+        row["p95"] = percentile(values, 0.95) if values else float("nan")
+    return rows
+
+
+def _tool_groups_numpy(table: RunAnalytics) -> List[dict]:
+    tools = len(table.tool_names)
+    tokens_known = ~np.isnan(table.tokens) & (table.tool_calls > 0)
+    # An iteration's tokens are split evenly between its tool calls
+    share = np.where(tokens_known, table.tokens / np.maximum(table.tool_calls, 1), np.nan)[table.call_row]
+    share_known = ~np.isnan(share)
+    stats = {
+        "calls": np.bincount(table.call_tool, minlength=tools),
+        "known": np.bincount(table.call_tool, weights=table.call_known, minlength=tools),
+        "errors": np.bincount(table.call_tool, weights=table.call_error & table.call_known, minlength=tools),
+        "tokens": np.bincount(table.call_tool, weights=np.where(share_known, share, 0.0), minlength=tools),
+        "calls_with_tokens": np.bincount(table.call_tool, weights=share_known, minlength=tools),
+    }
+    return [{name: column[t].item() for name, column in stats.items()} for t in range(tools)]
+
+
+def _tool_groups_python(table: RunAnalytics) -> List[dict]:
+    rows = [{"calls": 0, "known": 0, "errors": 0, "tokens": 0.0, "calls_with_tokens": 0} for _ in table.tool_names]
+    for row_index, tool, is_error, known in zip(table.call_row, table.call_tool, table.call_error, table.call_known):
+        row = rows[tool]
+        row["calls"] += 1
+        row["known"] += known
+        row["errors"] += is_error and known
+        tokens = table.tokens[row_index]
+        if not math.isnan(tokens):
+            row["tokens"] += tokens / table.tool_calls[row_index]
+            row["calls_with_tokens"] += 1
+    return rows
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else float("nan")
+
+
+def analyze_runs(table: RunAnalytics, by: str = "day") -> dict:
+    """Overall, per-period and per-tool statistics of a frozen RunAnalytics."""
+    labels, run_periods = period_labels(table, by)
+    if np is not None:
+        overall = _iteration_groups_numpy(table, np.zeros(len(table), dtype=np.int64), 1)[0]
+        trend = _iteration_groups_numpy(table, np.asarray(run_periods, dtype=np.int64)[table.run], len(labels))
+        tools = _tool_groups_numpy(table)
+    else:
+        overall = _iteration_groups_python(table, [0] * len(table), 1)[0]
+        trend = _iteration_groups_python(table, [run_periods[run] for run in table.run], len(labels))
+        tools = _tool_groups_python(table)
+
+    for row in [overall, *trend]:
+        row["success_rate"] = _ratio(row["succeeded"], row["iterations"])
+        row["cost_per_item"] = _ratio(row["cost"], row["items_done"])
+        row["tokens_per_call"] = _ratio(row["tokens"], row["calls_with_tokens"])
+    for row in tools:
+        row["failure_rate"] = _ratio(row["errors"], row["known"])
+        row["tokens_per_call"] = _ratio(row["tokens"], row["calls_with_tokens"])
+    overall["runs"] = len(table.runs)
+    for label, row in zip(labels, trend):
+        row["period"] = label
+        row["runs"] = run_periods.count(labels.index(label))
+    for name, row in zip(table.tool_names, tools):
+        row["tool"] = name
+    tools.sort(key=lambda row: row["calls"], reverse=True)
+    return {"overall": overall, "trend": [row for row in trend if row["iterations"]], "tools": tools}
 
-    except KeyboardInterrupt:
-        print()
-        print(colorize("  ⚠️  Interrupted by user", Colors.YELLOW, Colors.BOLD))
-        if process:
-            process.terminate()
-        # Log iteration end (interrupted)
-        if activity_log:
-            activity_log.add_iteration_end(iteration, False, False)
-        return False, False
-    except Exception as e:
-        print(colorize(f"  ❌ Error running Claude: {e}", Colors.RED, Colors.BOLD))
-        sys.stdout.flush()
-        # Log error and iteration end
-        if activity_log:
-            activity_log.add_error(iteration, str(e))
-            activity_log.add_iteration_end(iteration, False, False)
-        return False, False
 
+def _fmt(value: float, kind: str = "") -> str:
+    """A statistic for the analyze tables; "-" when unknown."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "-"
+    if kind == "%":
+        return f"{value:.0%}"
+    if kind == "$":
+        return f"${value:,.2f}"
+    if kind == "s":
+        return format_elapsed(value)
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.0f}" if value >= 100 else f"{value:,.1f}"
+    return f"{int(value):,}"
 
-def print_banner(iterations: int, prompt_file: str) -> None:
-    """Print startup banner."""
+
+def print_analysis_table(title: str, headers: Sequence[str], rows: List[List[str]]) -> None:
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *rows)]
     print()
-    print(colorize("╔══════════════════════════════════════════════════════════╗", Colors.BLUE, Colors.BOLD))
-    print(colorize("║           🤖 Ralph Loop Runner v2                        ║", Colors.BLUE, Colors.BOLD))
-    print(colorize("╠══════════════════════════════════════════════════════════╣", Colors.BLUE, Colors.BOLD))
-    print(colorize(f"║  Iterations: {iterations:<45}║", Colors.BLUE))
-    print(colorize(f"║  Prompt:     {prompt_file:<45}║", Colors.BLUE))
-    print(colorize(f"║  Started:    {datetime.now().strftime('%Y-%m-%d %H:%M:%S'):<45}║", Colors.BLUE))
-    print(colorize("╚══════════════════════════════════════════════════════════╝", Colors.BLUE, Colors.BOLD))
+    print(colorize(title, Colors.BOLD, Colors.CYAN))
+    print("  " + "  ".join(f"{header:<{width}}" for header, width in zip(headers, widths)))
+    print("  " + "  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  " + "  ".join(f"{cell:<{width}}" for cell, width in zip(row, widths)))
 
 
-def print_summary(completed: int, failed: int, early_complete: bool, global_state: dict) -> None:
-    """Print final summary."""
-    print()
-    print(colorize("╔══════════════════════════════════════════════════════════╗", Colors.BLUE, Colors.BOLD))
-    print(colorize("║                    📊 Summary                            ║", Colors.BLUE, Colors.BOLD))
-    print(colorize("╠══════════════════════════════════════════════════════════╣", Colors.BLUE, Colors.BOLD))
-    print(colorize(f"║  Total iterations:  {completed + failed:<38}║", Colors.BLUE))
+# Columns of `analyze --csv`: one row for all runs, one per trend period and one per tool
+ANALYZE_CSV_COLUMNS = (
+    "group", "key", "runs", "iterations", "success_rate", "p50_seconds", "p95_seconds", "cost_usd", "items_done",
+    "cost_per_item", "tool_calls", "errors", "failure_rate", "tokens_per_call",
+)
 
-    completed_str = f"{completed} ✓"
-    failed_str = f"{failed} ✗"
-    print(colorize(f"║  Completed:         {completed_str:<38}║", Colors.GREEN if completed > 0 else Colors.BLUE))
-    print(colorize(f"║  Failed:            {failed_str:<38}║", Colors.RED if failed > 0 else Colors.BLUE))
 
-    if early_complete:
-        print(colorize(f"║  Status:            {'🎉 RALPH_COMPLETE detected!':<38}║", Colors.GREEN))
+def write_analysis_csv(path: Path, analysis: dict, by: str) -> None:
+    def number(value) -> str:
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return ""
+        return f"{value:.6g}" if isinstance(value, float) else str(value)
 
-    # Show accumulated stats
-    if global_state.get("total_cost"):
-        cost_str = f"${global_state['total_cost']:.4f}"
-        print(colorize(f"║  Total cost:        {cost_str:<38}║", Colors.MAGENTA))
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(ANALYZE_CSV_COLUMNS)
+        groups = [("all", "all", analysis["overall"])] + [(by, row["period"], row) for row in analysis["trend"]]
+        for group, key, row in groups:
+            writer.writerow([
+                group, key, row["runs"], row["iterations"], number(row["success_rate"]), number(row["p50"]),
+                number(row["p95"]), number(row["cost"]), row["items_done"], number(row["cost_per_item"]),
+                row["tool_calls"], "", "", number(row["tokens_per_call"]),
+            ])
+        for row in analysis["tools"]:
+            writer.writerow([
+                "tool", row["tool"], "", "", "", "", "", "", "", "", int(row["calls"]),
+                int(row["errors"]) if row["known"] else "", number(row["failure_rate"]), number(row["tokens_per_call"]),
+            ])
 
-    if global_state.get("total_duration"):
-        duration_mins = global_state["total_duration"] / 1000 / 60
-        duration_str = f"{duration_mins:.1f} minutes"
-        print(colorize(f"║  Total duration:    {duration_str:<38}║", Colors.MAGENTA))
 
-    if global_state.get("total_tokens_in") and global_state.get("total_tokens_out"):
-        tokens_str = f"{global_state['total_tokens_in']:,} in / {global_state['total_tokens_out']:,} out"
-        print(colorize(f"║  Total tokens:      {tokens_str:<38}║", Colors.MAGENTA))
+def analyze_main(argv: List[str]) -> int:
+    """`ralph_v2.py analyze` - statistics across many runs."""
+    parser = argparse.ArgumentParser(
+        prog="ralph_v2.py analyze",
+        description="Compare runs: durations, cost per PRD item, tokens per tool call, tool failure rates and trends",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+    python ralph_v2.py analyze                           # The event store, or activity.md, of this directory
+    python ralph_v2.py analyze logs/                     # Every activity*.md under logs/
+    python ralph_v2.py analyze --store .ralph/events --by week --csv runs.csv
+        """,
+    )
+    parser.add_argument("logs", nargs="*", metavar="PATH", help="activity.md files, or directories searched for activity*.md")
+    parser.add_argument("--store", action="append", metavar="DIR", help="Event store (--event-store) to read; repeatable")
+    parser.add_argument("--ledger", action="append", metavar="PATH", help=f"Task ledger crediting finished PRD items "
+                        f"to iterations; repeatable (default: {DEFAULT_TASK_LEDGER} if present)")
+    parser.add_argument("--by", choices=ANALYZE_PERIODS, default="day", help="Trend period (default: day)")
+    parser.add_argument("--tools", type=int, default=15, metavar="N", help="Tools shown, most used first (default: 15)")
+    parser.add_argument("--csv", metavar="PATH", help="Also write every statistic as CSV")
+    args = parser.parse_args(argv)
 
-    print(colorize(f"║  Finished at:       {datetime.now().strftime('%Y-%m-%d %H:%M:%S'):<38}║", Colors.BLUE))
-    print(colorize("╚══════════════════════════════════════════════════════════╝", Colors.BLUE, Colors.BOLD))
-    print()
+    started = time.perf_counter()
+    stores = [Path(store) for store in args.store or []]
+    logs = []
+    for name in args.logs:
+        path = Path(name)
+        logs.extend(sorted(path.rglob("activity*.md")) if path.is_dir() else [path])
+    if not stores and not logs:
+        # A run is in both the event store and activity.md, so only one of them is read by default
+        if (Path(DEFAULT_EVENT_STORE) / "index.sqlite").exists():
+            stores.append(Path(DEFAULT_EVENT_STORE))
+        elif Path("activity.md").exists():
+            logs.append(Path("activity.md"))
+    ledgers = [Path(ledger) for ledger in args.ledger or []]
+    if not ledgers and Path(DEFAULT_TASK_LEDGER).exists():
+        ledgers.append(Path(DEFAULT_TASK_LEDGER))
+
+    table = RunAnalytics()
+    for store in stores:
+        if not (store / "index.sqlite").exists():
+            print(colorize(f"Error: No event store index at {store / 'index.sqlite'}", Colors.RED, Colors.BOLD))
+            return 1
+        ingest_event_store(table, store)
+    for log in logs:
+        if not log.exists():
+            print(colorize(f"Error: {log} not found", Colors.RED, Colors.BOLD))
+            return 1
+        ingest_activity_log(table, log)
+    for ledger in ledgers:
+        ingest_task_ledger(table, ledger)
+    if not len(table):
+        print(colorize("No iterations found (pass activity.md files or --store)", Colors.YELLOW))
+        return 1
+    table.freeze()
+    ingested = time.perf_counter() - started
+    analysis = analyze_runs(table, args.by)
+    elapsed = time.perf_counter() - started
+
+    overall = analysis["overall"]
+    print_analysis_table(
+        f"{overall['runs']} runs, {overall['iterations']:,} iterations, {overall['tool_calls']:,} tool calls",
+        ["success", "p50 iteration", "p95 iteration", "cost", "PRD items", "cost/item", "tokens/tool call"],
+        [[_fmt(overall["success_rate"], "%"), _fmt(overall["p50"], "s"), _fmt(overall["p95"], "s"), _fmt(overall["cost"], "$"),
+          _fmt(overall["items_done"]), _fmt(overall["cost_per_item"], "$"), _fmt(overall["tokens_per_call"])]],
+    )
+    print_analysis_table(
+        f"Trend by {args.by}",
+        [args.by, "runs", "iterations", "success", "p50", "p95", "cost", "items", "cost/item", "tokens/call"],
+        [[row["period"], _fmt(row["runs"]), _fmt(row["iterations"]), _fmt(row["success_rate"], "%"), _fmt(row["p50"], "s"),
+          _fmt(row["p95"], "s"), _fmt(row["cost"], "$"), _fmt(row["items_done"]), _fmt(row["cost_per_item"], "$"),
+          _fmt(row["tokens_per_call"])] for row in analysis["trend"]],
+    )
+    if analysis["tools"]:
+        print_analysis_table(
+            "Tools (tokens per call: the iteration's tokens split evenly between its calls)",
+            ["tool", "calls", "errors", "failure rate", "tokens/call"],
+            [[row["tool"], _fmt(row["calls"]), _fmt(row["errors"]) if row["known"] else "-", _fmt(row["failure_rate"], "%"),
+              _fmt(row["tokens_per_call"])] for row in analysis["tools"][:args.tools]],
+        )
+        if any(not row["known"] for row in analysis["tools"]):
+            print(colorize("  Failure rates need an event store: activity.md doesn't tie errors to tools", Colors.DIM))
+
+    if args.csv:
+        write_analysis_csv(Path(args.csv), analysis, args.by)
+        print(colorize(f"\n📄 CSV written to {args.csv}", Colors.CYAN))
+    backend = f"NumPy {np.__version__}" if np is not None else "pure Python"
+    print(colorize(f"\n  Read in {ingested:.2f}s, analyzed in {elapsed - ingested:.3f}s ({backend})", Colors.DIM))
+    return 0
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        sys.exit(query_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "analyze":
+        sys.exit(analyze_main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(
         description="Ralph Loop Runner v2 - Run Claude CLI iterations with enhanced output",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -627,13 +5371,23 @@ Examples:
     python ralph_v2.py 10 --prompt-file PROMPT.md    # Use custom prompt file
     python ralph_v2.py 30 --stop-on-complete         # Stop on RALPH_COMPLETE
     python ralph_v2.py 3 --verbose                   # Show verbose output
+    python ralph_v2.py 30 --prd .claude/plans/inzone-prd.md  # Runner picks each task from the PRD
+    python ralph_v2.py 30 --verify                   # Typecheck/test changed packages between iterations
+    python ralph_v2.py 30 --workers 4                # 4 parallel workers in git worktrees
+    python ralph_v2.py 30 --pipeline                 # Overlap Claude startup with the previous iteration
+    python ralph_v2.py --resume                      # Continue a crashed or interrupted run
+    python ralph_v2.py 30 --ui dashboard             # Live status area instead of the event stream
+    python ralph_v2.py 30 --event-store              # Archive raw events to .ralph/events
+    python ralph_v2.py query --tool Bash --errors    # Query archived events (see: query --help)
+    python ralph_v2.py analyze --csv runs.csv        # Statistics across runs (see: analyze --help)
         """,
     )
 
     parser.add_argument(
         "iterations",
         type=int,
-        help="Number of iterations to run",
+        nargs="?",
+        help="Number of iterations to run (optional with --resume: defaults to the checkpoint's)",
     )
 
     parser.add_argument(
@@ -643,6 +5397,21 @@ Examples:
         help="Path to the prompt file (default: PROMPT.md)",
     )
 
+    parser.add_argument(
+        "--prd",
+        type=str,
+        metavar="PATH",
+        help="PRD checklist to pick each iteration's task from: the prompt file becomes a template "
+             "filled with the next unchecked item and the sections it references",
+    )
+
+    parser.add_argument(
+        "--prd-scope",
+        type=str,
+        metavar="TEXT",
+        help="With --prd, only take items under a heading containing TEXT (e.g. \"Phase 1\")",
+    )
+
     parser.add_argument(
         "--verbose", "-v",
         action="store_true",
@@ -676,8 +5445,334 @@ Examples:
         help="Working directory to run in (default: project root derived from script location)",
     )
 
+    parser.add_argument(
+        "--task-attempts",
+        type=int,
+        default=DEFAULT_TASK_ATTEMPTS,
+        metavar="N",
+        help=f"With --prd, give up on a task after N iterations that didn't check it off (default: {DEFAULT_TASK_ATTEMPTS})",
+    )
+
+    parser.add_argument(
+        "--task-backoff",
+        type=float,
+        default=DEFAULT_TASK_BACKOFF_SECONDS,
+        metavar="SECONDS",
+        help="With --prd, wait this long before retrying a failed task, doubling with each attempt "
+             f"(default: {DEFAULT_TASK_BACKOFF_SECONDS:g})",
+    )
+
+    parser.add_argument(
+        "--task-ledger",
+        type=str,
+        default=DEFAULT_TASK_LEDGER,
+        metavar="PATH",
+        help=f"With --prd, JSONL log of every task start and outcome (default: {DEFAULT_TASK_LEDGER})",
+    )
+
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="After each successful iteration, typecheck and test the changed packages (apps/api, apps/web, "
+             "packages/shared) and put failures into the next prompt",
+    )
+
+    parser.add_argument(
+        "--verify-timeout",
+        type=float,
+        default=DEFAULT_VERIFY_TIMEOUT_SECONDS,
+        metavar="SECONDS",
+        help=f"With --verify, stop a check that runs longer than this (default: {DEFAULT_VERIFY_TIMEOUT_SECONDS:g})",
+    )
+
+    parser.add_argument(
+        "--verify-cache",
+        type=str,
+        default=DEFAULT_VERIFY_CACHE,
+        metavar="PATH",
+        help=f"With --verify, check results by package tree hash (default: {DEFAULT_VERIFY_CACHE})",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=DEFAULT_CHECKPOINT,
+        metavar="PATH",
+        help=f"Loop state saved after every iteration, for --resume (default: {DEFAULT_CHECKPOINT})",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the run saved in the checkpoint: next iteration number, counters, stats and activity log",
+    )
+
+    parser.add_argument(
+        "--workers", "-j",
+        type=int,
+        default=1,
+        help="Number of iterations to run in parallel, each in its own git worktree (default: 1)",
+    )
+
+    parser.add_argument(
+        "--merge-strategy",
+        choices=["merge", "rebase"],
+        default="merge",
+        help="How finished worker branches are brought back, in iteration order (default: merge)",
+    )
+
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Prepare the next iteration while the current one finishes, and write the activity log "
+             "and checkpoint in the background (sequential runs only)",
+    )
+
+    parser.add_argument(
+        "--completion-marker",
+        action="append",
+        metavar="TEXT",
+        help="Text that signals all work is done; repeatable, replaces the defaults "
+             "(default: RALPH_COMPLETE and <promise>COMPLETE</promise>)",
+    )
+
+    parser.add_argument(
+        "--completion-regex",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Regular expression that signals all work is done; repeatable",
+    )
+
+    parser.add_argument(
+        "--event-store",
+        nargs="?",
+        const=DEFAULT_EVENT_STORE,
+        default=None,
+        metavar="DIR",
+        help=f"Archive every raw stream-json event with a SQLite index for `query` (default DIR: {DEFAULT_EVENT_STORE})",
+    )
+
+    parser.add_argument(
+        "--iteration-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop an iteration that runs longer than this and continue with the next one (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Stop an iteration when Claude produces no stream output for this long (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--exit-on-marker",
+        type=float,
+        nargs="?",
+        const=DEFAULT_MARKER_GRACE_SECONDS,
+        default=None,
+        metavar="GRACE",
+        help="Stop Claude as soon as a completion marker is seen, after waiting up to GRACE seconds "
+             f"for its result event (default GRACE: {DEFAULT_MARKER_GRACE_SECONDS:g})",
+    )
+
+    parser.add_argument(
+        "--max-cost",
+        type=float,
+        default=None,
+        metavar="USD",
+        help="Stop the run once it has cost this much, terminating the running iteration (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Stop the run once it has used this many input + output tokens (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--max-duration",
+        type=float,
+        default=None,
+        metavar="MINUTES",
+        help="Stop the run after this many minutes of wall-clock time (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--predictive-budget",
+        action="store_true",
+        help="Don't start an iteration that would probably exceed a budget, based on the average "
+             "of recent iterations",
+    )
+
+    parser.add_argument(
+        "--notify",
+        choices=NOTIFY_BACKENDS,
+        default="auto",
+        help="Desktop notifications: osascript (macOS), notify-send (Linux) or none "
+             "(default: auto, whichever is available)",
+    )
+
+    parser.add_argument(
+        "--notify-webhook",
+        type=str,
+        metavar="URL",
+        help="Also POST every notification as JSON to this URL",
+    )
+
+    parser.add_argument(
+        "--notify-file",
+        type=str,
+        metavar="PATH",
+        help="Also append every notification as a JSON line to this file or FIFO",
+    )
+
+    parser.add_argument(
+        "--notify-every",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Send a progress notification every N finished iterations",
+    )
+
+    parser.add_argument(
+        "--notify-budget",
+        type=float,
+        action="append",
+        metavar="PCT",
+        help="Notify once when this percentage of a budget (--max-cost/--max-tokens/--max-duration) "
+             "is used (repeatable, default: 80)",
+    )
+
+    parser.add_argument(
+        "--max-launch-rate",
+        type=float,
+        default=None,
+        metavar="PER_MIN",
+        help="Start at most this many Claude processes per minute; halved while rate limited (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Claude processes allowed at once, across every runner sharing --limiter-state; halved while "
+             "rate limited (default: --workers)",
+    )
+
+    parser.add_argument(
+        "--throttle-backoff",
+        type=float,
+        default=DEFAULT_THROTTLE_BACKOFF_SECONDS,
+        metavar="SECONDS",
+        help="After a rate-limit or overload error, start nothing for this long, doubling with each throttle "
+             f"in a row unless the error says when to retry (default: {DEFAULT_THROTTLE_BACKOFF_SECONDS:g})",
+    )
+
+    parser.add_argument(
+        "--limiter-state",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Share the launch limits through this file (locked), so runners in other terminals or on other "
+             "hosts with the same filesystem back off together",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        metavar="PORT",
+        help="Serve OpenMetrics/Prometheus metrics at http://127.0.0.1:PORT/metrics while running",
+    )
+
+    parser.add_argument(
+        "--record",
+        nargs="?",
+        const=DEFAULT_RECORD_DIR,
+        default=None,
+        metavar="DIR",
+        help=f"Save each iteration's raw stream-json for replay with fake_claude.py (default DIR: {DEFAULT_RECORD_DIR})",
+    )
+
+    parser.add_argument(
+        "--claude-bin",
+        type=str,
+        default="claude",
+        metavar="PATH",
+        help="Claude CLI executable to run (default: claude); e.g. scripts/ralph/fake_claude.py for testing",
+    )
+
+    parser.add_argument(
+        "--profile-trace",
+        type=str,
+        default=None,
+        metavar="PATH",
+        help="Write tool and model timings as Chrome trace JSON (chrome://tracing, Perfetto, speedscope)",
+    )
+
+    parser.add_argument(
+        "--ui",
+        choices=UI_MODES,
+        default="stream",
+        help="Output mode: stream every event (default), a live dashboard redrawn at a capped frame rate, "
+             "or headless with one line per iteration for CI",
+    )
+
+    parser.add_argument(
+        "--max-line-bytes",
+        type=int,
+        default=DEFAULT_MAX_LINE_BYTES,
+        metavar="BYTES",
+        help=f"Stream events larger than this (e.g. huge tool results) are skipped past, keeping only "
+             f"what the output and log need (default: {DEFAULT_MAX_LINE_BYTES})",
+    )
+
     args = parser.parse_args()
 
+    if args.iterations is None and not args.resume:
+        parser.error("the number of iterations is required (unless resuming with --resume)")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    for option in ("iteration_timeout", "idle_timeout", "max_cost", "max_tokens", "max_duration"):
+        if getattr(args, option) is not None and getattr(args, option) <= 0:
+            parser.error(f"--{option.replace('_', '-')} must be positive")
+    if args.task_attempts < 1:
+        parser.error("--task-attempts must be at least 1")
+    if args.task_backoff < 0:
+        parser.error("--task-backoff must not be negative")
+    if args.notify_every is not None and args.notify_every < 1:
+        parser.error("--notify-every must be at least 1")
+    if args.exit_on_marker is not None and args.exit_on_marker < 0:
+        parser.error("--exit-on-marker grace must not be negative")
+    if args.max_launch_rate is not None and args.max_launch_rate <= 0:
+        parser.error("--max-launch-rate must be positive")
+    if args.max_concurrent is not None and args.max_concurrent < 1:
+        parser.error("--max-concurrent must be at least 1")
+    if args.throttle_backoff < 0:
+        parser.error("--throttle-backoff must not be negative")
+    if args.verify_timeout <= 0:
+        parser.error("--verify-timeout must be positive")
+    if args.pipeline and args.workers > 1:
+        parser.error("--pipeline is for sequential runs; --workers already overlaps iterations")
+
+    completion_markers = args.completion_marker or DEFAULT_COMPLETION_MARKERS
+    for pattern in args.completion_regex:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            parser.error(f"invalid --completion-regex {pattern!r}: {e}")
+
+    # A path to the CLI is relative to where ralph was started, not to --workdir or worker worktrees
+    claude_bin = str(Path(args.claude_bin).resolve()) if os.sep in args.claude_bin else args.claude_bin
+
     # Handle stop-on-complete logic
     stop_on_complete = args.stop_on_complete and not args.no_stop_on_complete
 
@@ -695,13 +5790,146 @@ Examples:
 
     prompt = prompt_file.read_text()
 
+    checkpoint_path = project_root / args.checkpoint
+    resumed = None
+    if args.resume:
+        try:
+            resumed = Checkpoint.load(checkpoint_path).data
+        except RuntimeError as e:
+            print(colorize(f"Error: {e}", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+        if resumed.get("finished"):
+            print(colorize(f"Nothing to resume: run {resumed['run_id']} in {checkpoint_path} already finished", Colors.YELLOW))
+            sys.exit(0)
+
+    if resumed:
+        # Same run id, so the event store and recordings continue in the same run
+        run_id = resumed["run_id"]
+        total_iterations = args.iterations or resumed["iterations"]
+        interrupted = resumed.get("running", [])
+        first_iteration = max([resumed.get("next_iteration", 1)] + [n + 1 for n in interrupted])
+    else:
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        total_iterations = args.iterations
+        interrupted = []
+        first_iteration = 1
+
+    prompt_builder = None
+    if args.prd:
+        prd_path = Path(args.prd)
+        if not prd_path.exists():
+            print(colorize(f"Error: PRD file '{prd_path}' not found", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+        scheduler = TaskScheduler(
+            max_attempts=args.task_attempts,
+            backoff=args.task_backoff,
+            ledger=project_root / args.task_ledger,
+            run_id=run_id,
+        )
+        try:
+            prompt_builder = PrdPromptBuilder(
+                prompt, prd_path, scope=args.prd_scope, display_path=args.prd, scheduler=scheduler
+            )
+        except ValueError as e:
+            print(colorize(f"Error in {prompt_file}: {e}", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+        if resumed:
+            scheduler.sync(prompt_builder.load(), args.prd_scope)
+            scheduler.restore()
+
+    verifier = None
+    if args.verify:
+        try:
+            verifier = Verifier(
+                Path(git("rev-parse", "--show-toplevel", cwd=project_root)),
+                project_root / args.verify_cache,
+                timeout=args.verify_timeout,
+            )
+        except RuntimeError as e:
+            print(colorize(f"Error: --verify needs a git repository: {e}", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+
+    def iteration_prompt(iteration: int) -> Optional[Tuple[str, Optional[str]]]:
+        built = prompt_builder.build(iteration) if prompt_builder else (prompt, None)
+        feedback = verifier.feedback() if verifier and built else ""
+        if feedback:
+            # Checks the last verification left failing come first (see --verify)
+            return f"{built[0]}\n\n{feedback}", built[1]
+        return built
+
+    # Set up worker worktrees before printing anything, so git problems fail fast
+    runner = None
+    if args.workers > 1:
+        try:
+            repo_root = Path(git("rev-parse", "--show-toplevel", cwd=project_root))
+            pool = WorktreePool(repo_root, args.workers, run_id)
+        except RuntimeError as e:
+            print(colorize(f"Error: {e}", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+
+    # Dashboard and headless modes take over stdout; the real stream is restored by close_ui()
+    terminal = sys.stdout
+    ui = None
+    if args.ui == "dashboard" and not terminal.isatty():
+        print(colorize("stdout is not a terminal, using --ui headless instead of dashboard", Colors.YELLOW), file=sys.stderr)
+        args.ui = "headless"
+    if args.ui == "dashboard":
+        ui = Dashboard(terminal)
+    elif args.ui == "headless":
+        ui = HeadlessUI(terminal)
+    if ui:
+        sys.stdout = ui
+        ui.start()
+        atexit.register(ui.stop)
+
+    def close_ui() -> None:
+        # The dashboard's final screen is discarded; later output (summary) goes to the terminal.
+        # Headless mode keeps swallowing it, so CI logs only get the per-iteration lines.
+        if isinstance(ui, Dashboard):
+            ui.stop()
+            sys.stdout = terminal
+
+    if args.workers > 1:
+        sys.stdout = WorkerTaggedStream(sys.stdout)
+
     # Print startup banner
-    print_banner(args.iterations, args.prompt_file)
+    print_banner(total_iterations, args.prompt_file, args.workers)
+    if resumed:
+        print(colorize(
+            f"  ↩️  Resuming run {run_id} at iteration {first_iteration} "
+            f"({resumed.get('completed', 0)} completed, {resumed.get('failed', 0)} failed so far)",
+            Colors.CYAN,
+        ))
 
     # Create activity log
     activity_log_path = project_root / args.activity_log
     activity_log = ActivityLog(activity_log_path)
 
+    # Tool timings, written to the activity log's Tool Profile section at the end of the run
+    profiler = ToolProfiler()
+    activity_log.listeners.append(profiler)
+    profile_trace_path = project_root / args.profile_trace if args.profile_trace else None
+
+    metrics = None
+    if args.metrics_port is not None:
+        metrics = LoopMetrics()
+        activity_log.listeners.append(metrics)
+        try:
+            metrics_server = MetricsServer(metrics, args.metrics_port)
+        except OSError as e:
+            print(colorize(f"Error: cannot serve metrics on port {args.metrics_port}: {e}", Colors.RED, Colors.BOLD))
+            sys.exit(1)
+        metrics_server.start()
+        print(colorize(f"📈 Metrics at {metrics_server.address}", Colors.CYAN))
+
+    recorder = StreamRecorder(project_root / args.record, run_id) if args.record else None
+
+    event_store = None
+    if args.event_store:
+        event_store = EventStore(project_root / args.event_store, run_id)
+        # Closed at exit so the last segment and index batch are flushed, even after Ctrl+C
+        atexit.register(event_store.close)
+
     # Create silent mode flag file to suppress Claude Code notification hooks
     # This is more reliable than environment variables which may not be inherited by hooks
     silent_flag_file = Path("/tmp/.claude_code_silent")
@@ -711,61 +5939,270 @@ Examples:
     completed = 0
     failed = 0
     early_complete = False
+    fatal_stop = False
     global_state = {}
+    run_started = time.monotonic()
+
+    budget = BudgetGovernor(
+        max_cost=args.max_cost,
+        max_tokens=args.max_tokens,
+        max_duration=args.max_duration * 60 if args.max_duration is not None else None,
+        predictive=args.predictive_budget,
+    )
+
+    if resumed:
+        completed = resumed.get("completed", 0)
+        failed = resumed.get("failed", 0) + len(interrupted)
+        global_state.update(resumed.get("global_state", {}))
+        run_started -= resumed.get("elapsed", 0)
+        budget.restore(
+            global_state.get("total_cost", 0),
+            global_state.get("total_tokens_in", 0) + global_state.get("total_tokens_out", 0),
+            resumed.get("elapsed", 0),
+        )
+        activity_log.resume(datetime.fromisoformat(resumed["activity_started"]))
+        for iteration in interrupted:
+            print(colorize(f"  ⚠️  Iteration {iteration} was interrupted when the runner stopped", Colors.YELLOW))
+            activity_log.add_interrupted_iteration(
+                iteration, total_iterations, "Runner stopped during this iteration (found in checkpoint on --resume)"
+            )
+        activity_log.write(completed, failed, early_complete, global_state)
+
+    checkpoint = Checkpoint(checkpoint_path)
+    activity_log.listeners.append(checkpoint)
+
+    limiter = LaunchLimiter(
+        args.max_concurrent or args.workers,
+        rate=args.max_launch_rate,
+        backoff=args.throttle_backoff,
+        state_path=project_root / args.limiter_state if args.limiter_state else None,
+    )
+
+    backends = []
+    desktop = default_notify_backend() if args.notify == "auto" else args.notify
+    if desktop == "osascript":
+        backends.append(send_macos_notification)
+    elif desktop == "notify-send":
+        backends.append(send_desktop_notification)
+    if args.notify_webhook:
+        backends.append(WebhookBackend(args.notify_webhook, run_id))
+    if args.notify_file:
+        backends.append(FileBackend(Path(args.notify_file)))
+    notifier = Notifier(
+        backends,
+        every=args.notify_every,
+        budget=budget or None,
+        budget_thresholds=[pct / 100 for pct in args.notify_budget or [80]],
+        verbose=args.verbose,
+    )
+    activity_log.listeners.append(notifier)
+
+    gaps = IterationGaps()
+    pipeline = None
+    if args.pipeline:
+        pipeline = IterationPipeline(prompt_builder=prompt_builder)
+        activity_log.listeners.append(pipeline)
+
+    def save_checkpoint(**overrides) -> None:
+        with global_state_lock:
+            state = dict(global_state)
+        fields = dict(
+            completed=completed,
+            failed=failed,
+            early_complete=early_complete,
+            global_state=state,
+            elapsed=round(time.monotonic() - run_started, 3),
+        )
+        fields.update(overrides)
+        checkpoint.save(**fields)
+
+    def save_progress(iteration: int) -> None:
+        """Append finished iterations to the activity log (so progress is saved continuously) and checkpoint."""
+        with global_state_lock:
+            state = dict(global_state)
+        counts = dict(completed=completed, failed=failed, early_complete=early_complete)
+
+        def write() -> None:
+            activity_log.write(counts["completed"], counts["failed"], counts["early_complete"], state, upto=iteration)
+            checkpoint.iteration_done(iteration)
+            save_checkpoint(global_state=state, **counts)
+
+        if pipeline:
+            # With --pipeline the next iteration starts while this is written
+            pipeline.submit(write)
+        else:
+            write()
+
+    save_checkpoint(
+        run_id=run_id,
+        iterations=total_iterations,
+        prompt_file=args.prompt_file,
+        activity_log=str(activity_log_path),
+        activity_started=activity_log.start_time.isoformat(),
+        next_iteration=first_iteration,
+        running=[],
+        finished=False,
+    )
 
     # Handle Ctrl+C gracefully
     def signal_handler(sig, frame):
+        close_ui()
         print()
         print(colorize("\n⚠️  Stopping Ralph Loop...", Colors.YELLOW, Colors.BOLD))
-        # Write activity log before exiting
-        activity_log.write(completed, failed, early_complete, global_state)
+        if pipeline:
+            pipeline.drain(timeout=2.0)
+        # Write activity log before exiting (after a pipelined write still in progress, if the drain timed out)
+        activity_log.write(completed, failed, early_complete, global_state, final=True)
         print(colorize(f"📝 Activity log written to: {activity_log_path}", Colors.CYAN))
+        if profile_trace_path:
+            profiler.write_trace(profile_trace_path)
+        # The running iterations were just logged as interrupted; --resume continues after them
+        running = checkpoint.data.get("running", [])
+        save_checkpoint(
+            failed=failed + len(running),
+            running=[],
+            next_iteration=max([checkpoint.data.get("next_iteration", 1)] + [n + 1 for n in running]),
+        )
+        print(colorize(f"💾 Resume with: --resume (checkpoint: {checkpoint_path})", Colors.CYAN))
         # Remove silent flag file before sending notification
         silent_flag_file.unlink(missing_ok=True)
-        send_macos_notification(
+        notifier.notify(
             "Ralph Loop Interrupted ⚠️",
-            f"Stopped after {completed + failed} iterations. Cost: ${global_state.get('total_cost', 0):.2f}"
+            f"Stopped after {completed + failed} iterations. Cost: ${global_state.get('total_cost', 0):.2f}",
+            event="interrupted",
         )
+        notifier.close(timeout=1.0)
         sys.exit(130)
 
     signal.signal(signal.SIGINT, signal_handler)
+    atexit.register(terminate_live_children)
+
+    iteration_options = dict(
+        verbose=args.verbose,
+        global_state=global_state,
+        activity_log=activity_log,
+        completion_markers=completion_markers,
+        completion_patterns=args.completion_regex,
+        event_store=event_store,
+        max_line_bytes=args.max_line_bytes,
+        ui=ui,
+        iteration_timeout=args.iteration_timeout,
+        idle_timeout=args.idle_timeout,
+        budget=budget or None,
+        metrics=metrics,
+        profiler=profiler,
+        recorder=recorder,
+        claude_bin=claude_bin,
+        exit_on_marker=args.exit_on_marker,
+        limiter=limiter,
+        gaps=gaps,
+    )
 
-    for i in range(1, args.iterations + 1):
-        success, is_complete = run_iteration(
-            i,
-            args.iterations,
-            prompt,
-            verbose=args.verbose,
-            global_state=global_state,
-            activity_log=activity_log
+    if args.workers > 1:
+        runner = ParallelRunner(
+            pool,
+            total_iterations,
+            iteration_prompt,
+            merge_strategy=args.merge_strategy,
+            first=first_iteration,
+            **iteration_options,
         )
+        results = iter(runner)
+    else:
+        def run_sequential():
+            for i in range(first_iteration, total_iterations + 1):
+                if budget:
+                    refused = budget.admit()
+                    if refused:
+                        report_budget_stop(i, refused, global_state, ui)
+                        return
+                backoff = prompt_builder.waited if prompt_builder else 0.0
+                built = iteration_prompt(i)
+                if prompt_builder:
+                    gaps.pause(prompt_builder.waited - backoff)
+                if built is None:
+                    return
+                iteration_prompt_text, task = built
+                run = pipeline.run_iteration if pipeline else run_iteration
+                yield (i, *run(i, total_iterations, iteration_prompt_text, task=task, **iteration_options))
 
+        results = run_sequential()
+
+    for i, success, is_complete in results:
         if success:
             completed += 1
         else:
             failed += 1
 
-        # Write activity log after each iteration (so progress is saved continuously)
-        activity_log.write(completed, failed, early_complete, global_state)
+        if prompt_builder:
+            # Merged (or failed): the PRD now shows whether the item is done
+            # A rate-limited iteration's task goes back in the queue without using up an attempt
+            task_outcome = prompt_builder.finish(i, throttled=not success and limiter.outcomes.get(i) == ERROR_THROTTLE)
+            if task_outcome:
+                print(colorize(f"  📋 {task_outcome}", Colors.CYAN))
+                activity_log.add_task_outcome(i, task_outcome)
+                with global_state_lock:
+                    global_state["tasks_done"] = prompt_builder.scheduler.done
+                    global_state["tasks_failed"] = prompt_builder.scheduler.failed
+                    global_state["task_retries"] = prompt_builder.scheduler.retries
+
+        if verifier and success:
+            verify_iteration(i, verifier, global_state, activity_log, ui)
+            if is_complete and verifier.failures:
+                print(colorize("  ⚠️  Completion marker ignored: verification is failing", Colors.YELLOW, Colors.BOLD))
+                is_complete = False
+
+        save_progress(i)
+        # The iteration's final cost is settled by now
+        notifier.check_budget()
+
+        if limiter.outcomes.get(i) == ERROR_FATAL and not fatal_stop:
+            fatal_stop = True
+            print()
+            print(colorize(f"⛔ Stopping: {global_state.get('fatal_error')}", Colors.RED, Colors.BOLD))
+            if runner is None:
+                break
+            runner.stop()
 
         # Check for early completion
-        if is_complete and stop_on_complete:
+        if is_complete and stop_on_complete and not early_complete:
             print()
             print(colorize("🎉 RALPH_COMPLETE detected! All tasks done.", Colors.GREEN, Colors.BOLD))
             early_complete = True
-            # Write final activity log with early_complete flag
-            activity_log.write(completed, failed, early_complete, global_state)
+            # Update the activity log summary with the early_complete flag
+            save_progress(i)
             # Remove silent flag file before sending notification
             silent_flag_file.unlink(missing_ok=True)
-            send_macos_notification(
+            notifier.notify(
                 "Ralph Loop Complete 🎉",
-                f"RALPH_COMPLETE detected after {i} iterations. Cost: ${global_state.get('total_cost', 0):.2f}"
+                f"RALPH_COMPLETE detected after {i} iterations. Cost: ${global_state.get('total_cost', 0):.2f}",
+                event="complete",
             )
-            break
+            if runner is None:
+                break
+            # Let in-flight workers finish so their work is merged and counted
+            runner.stop()
+
+    if prompt_builder and prompt_builder.exhausted and not early_complete:
+        print()
+        if prompt_builder.scheduler.all_done():
+            print(colorize("🎉 Every PRD task in scope is done.", Colors.GREEN, Colors.BOLD))
+            early_complete = True
+        else:
+            print(colorize(f"⛔ No PRD task left that can run: {prompt_builder.scheduler.summary()}", Colors.YELLOW, Colors.BOLD))
+
+    close_ui()
+    if pipeline:
+        pipeline.close()
+    global_state.update(gaps.summary())
 
     # Write activity log
-    activity_log.write(completed, failed, early_complete, global_state)
+    activity_log.write(completed, failed, early_complete, global_state, final=True)
+    save_checkpoint(finished=True)
     print(colorize(f"📝 Activity log written to: {activity_log_path}", Colors.CYAN))
+    if profile_trace_path:
+        profiler.write_trace(profile_trace_path)
+        print(colorize(f"⏱️  Tool profile trace written to: {profile_trace_path}", Colors.CYAN))
 
     # Print summary
     print_summary(completed, failed, early_complete, global_state)
@@ -777,13 +6214,15 @@ Examples:
     # Send notification for normal completion (if not already sent for early completion)
     if not early_complete:
         status = "completed" if failed == 0 else f"finished with {failed} failures"
-        send_macos_notification(
+        notifier.notify(
             "Ralph Loop Finished",
-            f"{completed + failed} iterations {status}. Cost: ${global_state.get('total_cost', 0):.2f}"
+            f"{completed + failed} iterations {status}. Cost: ${global_state.get('total_cost', 0):.2f}",
+            event="finished",
         )
+    notifier.close()
 
     # Exit with appropriate code
-    exit_code = 1 if failed > 0 and not early_complete else 0
+    exit_code = 1 if (failed > 0 or global_state.get("tasks_failed")) and not early_complete else 0
     sys.exit(exit_code)
 
 